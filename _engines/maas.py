@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+'''
+Engine watching MAAS machine and rack controller state.
+
+One shared poller replaces the polling loops of individual states: every
+``interval`` seconds it lists machines, rack controllers and the boot
+resources import, and fires a Salt event for every transition:
+
+    maas/machine/<hostname>/status
+    maas/rack/<hostname>/boot_images
+    maas/boot_resources/importing
+
+With ``metrics`` set, the state of the last poll is also written to that
+node-exporter textfile every ``metrics_interval`` seconds (see
+``maasng.export_metrics``), instead of listing everything again from cron.
+
+:configuration: Enable it in the minion configuration of the region
+                controller::
+
+        engines:
+          - maas:
+              interval: 10
+              metrics: /var/lib/prometheus/node-exporter/maas.prom
+
+'''
+
+from __future__ import absolute_import
+
+import logging
+import time
+
+LOG = logging.getLogger(__name__)
+
+
+def __virtual__():
+    return 'maas'
+
+
+def _fire(tag, data):
+    LOG.debug('Firing {0}: {1}'.format(tag, data))
+    __salt__['event.send'](tag, data)
+
+
+def _watch_machines(previous, fire):
+    previous = previous or {}
+    current = {}
+    for hostname, machine in __salt__['maasng.list_machines'](
+            compact=True, refresh=True).items():
+        current[hostname] = machine['status_name']
+        before = previous.get(hostname)
+        if before == machine['status_name'] or not fire:
+            continue
+        _fire('maas/machine/{0}/status'.format(hostname), {
+            'hostname': hostname,
+            'system_id': machine['system_id'],
+            'status': machine['status_name'],
+            'previous': before,
+        })
+    for hostname in set(previous) - set(current):
+        _fire('maas/machine/{0}/status'.format(hostname), {
+            'hostname': hostname,
+            'status': None,
+            'previous': previous[hostname],
+        })
+    return current
+
+
+def _watch_racks(previous, fire):
+    previous = previous or {}
+    current = {}
+    for hostname in __salt__['maasng.list_racks']():
+        status = __salt__['maasng.rack_list_boot_imgs'](hostname)['status']
+        current[hostname] = status
+        before = previous.get(hostname)
+        if before == status or not fire:
+            continue
+        _fire('maas/rack/{0}/boot_images'.format(hostname), {
+            'hostname': hostname,
+            'status': status,
+            'previous': before,
+        })
+    return current
+
+
+def _watch_boot_resources(previous, fire):
+    current = bool(__salt__['maasng.boot_resources_is_importing']())
+    if current != previous and fire:
+        _fire('maas/boot_resources/importing', {
+            'importing': current,
+            'previous': previous,
+        })
+    return current
+
+
+def _export_metrics(path, states):
+    __salt__['maasng.export_metrics'](
+        path=path,
+        machines=states.get(_watch_machines),
+        racks=states.get(_watch_racks),
+        importing=states.get(_watch_boot_resources))
+
+
+def start(interval=10, machines=True, racks=True, boot_resources=True,
+          fire_initial=False, metrics=None, metrics_interval=60):
+    '''
+    Poll MAAS every ``interval`` seconds and fire events on transitions.
+
+    :param interval: Seconds between two polls
+    :param machines: Watch machine status
+    :param racks: Watch the rack controllers boot images sync
+    :param boot_resources: Watch the boot resources import
+    :param fire_initial: Also fire events for the state found by the
+                         first poll
+    :param metrics: Path of the node-exporter textfile to write the polled
+                    state to
+    :param metrics_interval: Seconds between two writes of ``metrics``
+    '''
+    watchers = []
+    if machines:
+        watchers.append(_watch_machines)
+    if racks:
+        watchers.append(_watch_racks)
+    if boot_resources:
+        watchers.append(_watch_boot_resources)
+    states = dict((watcher, None) for watcher in watchers)
+    exported_at = 0
+    while True:
+        started_at = time.time()
+        for watcher in watchers:
+            previous = states[watcher]
+            try:
+                states[watcher] = watcher(
+                    previous, fire_initial or previous is not None)
+            except Exception:
+                LOG.exception('MAAS engine: {0} failed'.format(
+                    watcher.__name__))
+        if metrics and started_at - exported_at >= metrics_interval:
+            exported_at = started_at
+            try:
+                _export_metrics(metrics, states)
+            except Exception:
+                LOG.exception('MAAS engine: metrics export failed')
+        time.sleep(max(interval - (time.time() - started_at), 0))
@@ -16,7 +16,7 @@ __all__ = [
     'encode_json_data',
     ]
 
-import json
+import json_codec
 
 
 def encode_json_data(params):
@@ -26,7 +26,7 @@ def encode_json_data(params):
     match the key-value data expected by most receiving APIs.
     :return: (body, headers)
     """
-    body = json.dumps(params)
+    body = json_codec.dumps(params)
     headers = {
         'Content-Length': unicode(len(body)),
         'Content-Type': 'application/json',
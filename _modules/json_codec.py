@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+'''
+JSON codec decoding MAAS responses and encoding JSON requests.
+
+The fastest backend available is selected on import: ``ujson``, then
+``simplejson`` with its C speedups, then the standard library ``json``.
+Callers use ``json_codec.loads`` and ``json_codec.dumps``; ``dumps`` only
+takes the object, calls needing ``indent`` or ``sort_keys`` keep using
+``json``.
+'''
+
+from __future__ import absolute_import
+
+import json
+import logging
+
+LOG = logging.getLogger(__name__)
+
+__all__ = [
+    'BACKENDS',
+    'dumps',
+    'loads',
+    'use',
+]
+
+
+def _ujson():
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(obj, escape_forward_slashes=False)
+    return ujson.loads, dumps
+
+
+def _simplejson():
+    import simplejson
+    # Without its C extension simplejson is slower than the stdlib.
+    from simplejson import _speedups  # noqa: F401
+    return simplejson.loads, simplejson.dumps
+
+
+def _stdlib():
+    return json.loads, json.dumps
+
+
+# Backends by order of preference.
+BACKENDS = (
+    ('ujson', _ujson),
+    ('simplejson', _simplejson),
+    ('json', _stdlib),
+)
+
+backend = None
+loads = None
+dumps = None
+
+
+def use(name=None):
+    '''
+    Select the backend ``name``, or the first available one, and return
+    its name.
+
+    :param name: One of ``BACKENDS``, e.g. to compare them.
+    '''
+    global backend, loads, dumps
+    for candidate, factory in BACKENDS:
+        if name is not None and candidate != name:
+            continue
+        try:
+            loads, dumps = factory()
+        except ImportError:
+            if name is not None:
+                raise
+            continue
+        backend = candidate
+        LOG.debug('JSON backend: {0}'.format(backend))
+        return backend
+    raise ValueError('Unknown JSON backend {0}'.format(name))
+
+
+use()
@@ -20,6 +20,7 @@ import io
 import json
 import logging
 import os.path
+import threading
 import time
 import urllib2
 
@@ -28,7 +29,11 @@ LOG = logging.getLogger(__name__)
 # Import third party libs
 HAS_MASS = False
 try:
-    from maas_client import MAASClient, MAASDispatcher, MAASOAuth
+    import json_codec
+    from maas_client import get_client, get_dispatcher, get_governor, \
+        get_response_cache, run_concurrently, endpoint_template, \
+        ResponseCache
+    from maas_inventory import MacIndex, get_inventory
     HAS_MASS = True
 except ImportError:
     LOG.debug('Missing python-oauth module. Skipping')
@@ -45,6 +50,8 @@ def __virtual__():
 
 
 APIKEY_FILE = '/var/lib/maas/.maas_credentials'
+JOURNAL_DIR = '/var/cache/salt/minion/maas'
+API_STATS_FILE = '/var/cache/salt/minion/maas/api_stats.json'
 
 STATUS_NAME_DICT = dict([
     (0, 'New'), (1, 'Commissioning'), (2, 'Failed commissioning'),
@@ -58,6 +65,16 @@ STATUS_NAME_DICT = dict([
     (21, 'Testing'), (22, 'Failed testing')])
 
 
+# Statuses a machine waited for in a given status cannot leave by itself.
+TERMINAL_STATUSES = {
+    'Ready': ('Failed commissioning', 'Failed testing', 'Broken',
+              'Failed disk erasing', 'Releasing failed'),
+    'Deployed': ('Failed deployment', 'Failed testing', 'Broken',
+                 'Failed commissioning', 'Releasing failed'),
+    'Allocated': ('Failed commissioning', 'Failed testing', 'Broken'),
+}
+
+
 def _format_data(data):
     class Lazy:
         def __str__(self):
@@ -68,15 +85,95 @@ def _format_data(data):
 
 def _create_maas_client():
     global APIKEY_FILE
+    api_url = 'http://localhost:5240/MAAS'
+    options = __salt__['config.get']('maas:region:api', {})
+    governor = get_governor(options.get('limits'))
+    cache = get_response_cache(options.get('cache'))
+    dispatcher = get_dispatcher(options.get('cassette'),
+                                endpoints=options.get('endpoints'))
     try:
-        api_token = file(APIKEY_FILE).read().splitlines()[-1].strip()\
-            .split(':')
+        return get_client(api_url, APIKEY_FILE, governor=governor,
+                          cache=cache, dispatcher=dispatcher)
     except:
         LOG.exception('token')
-    auth = MAASOAuth(*api_token)
-    api_url = 'http://localhost:5240/MAAS'
-    dispatcher = MAASDispatcher()
-    return MAASClient(auth, dispatcher, api_url)
+        raise
+
+
+def _fingerprint(data):
+    return hashlib.sha256(
+        json.dumps(data, sort_keys=True, default=repr)).hexdigest()
+
+
+class CheckpointJournal(object):
+    """
+    Last step completed for each object by an interrupted run, with the
+    fingerprint of the configuration it was processed with.
+
+    The journal is written to `path` by `flush`, so that a rerun can skip
+    the steps done by a run that failed halfway. A step recorded with
+    another fingerprint, i.e. for a changed pillar, is ignored.
+    """
+
+    DONE = 'done'
+
+    def __init__(self, path):
+        self.path = path
+        self.steps = {}
+        if os.path.isfile(path):
+            try:
+                with open(path) as fd:
+                    self.steps = json.load(fd)
+            except ValueError:
+                LOG.warning('Ignoring corrupted journal %s', path)
+
+    def step(self, name, fingerprint):
+        entry = self.steps.get(name)
+        if entry and entry['fingerprint'] == fingerprint:
+            return entry['step']
+        return None
+
+    def is_done(self, name, fingerprint):
+        return self.step(name, fingerprint) == self.DONE
+
+    def record(self, name, fingerprint, step=DONE):
+        self.steps[name] = {'fingerprint': fingerprint, 'step': step}
+
+    def flush(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(temp_path, 'w') as fd:
+            json.dump(self.steps, fd)
+        os.rename(temp_path, self.path)
+
+    def forget(self, names):
+        """
+        Drop `names` once processed successfully; the journal file is
+        removed when no object is left in it.
+        """
+        for name in names:
+            self.steps.pop(name, None)
+        if self.steps:
+            self.flush()
+        elif os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+# Listings fetched by MaasObject._prefetch: url -> (client, number of writes
+# to the collection when fetched, fetch time, decoded listing).
+_prefetched = {}
+_prefetched_lock = threading.Lock()
+PREFETCH_MAX_AGE = 60
+# Listings changing under our feet (machine status, ...) are only reused
+# within one process() call.
+VOLATILE_COLLECTIONS = ('devices', 'machines', 'nodes')
+
+
+def _collection_writes(maas, url):
+    name = ResponseCache.collection(url)
+    return sum(maas.writes[related] for related in
+               (name,) + ResponseCache.RELATED_COLLECTIONS.get(name, ()))
 
 
 class MaasObject(object):
@@ -87,17 +184,166 @@ class MaasObject(object):
         self._update = False
         self._element_key = 'name'
         self._update_key = 'id'
+        self._mac_index = None
+        self._listings = {}
+        # Writes recorded instead of sent, see plan()
+        self._planned = None
+        # Entry point name; when set, process() keeps a CheckpointJournal.
+        self._journal_name = None
+        self._journal = None
+        self._current = None
+
+    def _get_mac_index(self):
+        if self._mac_index is None:
+            listings = self._prefetch([u'api/2.0/machines/',
+                                       u'api/2.0/devices/'])
+            self._mac_index = MacIndex(listings[u'api/2.0/machines/'],
+                                       listings[u'api/2.0/devices/'])
+        return self._mac_index
+
+    def _config_items(self, config):
+        """
+        Return the `(name, config_data)` pairs of the objects to process
+        from the pillar found at `_config_path`.
+        """
+        return config.iteritems()
+
+    def _index_elements(self, elements):
+        """
+        Return the existing objects listed by `_all_elements_url` by name.
+        """
+        all_elements = {}
+        for element in elements:
+            if isinstance(element, (str, unicode)):
+                all_elements[element] = {}
+            else:
+                all_elements[element[self._element_key]] = element
+        return all_elements
+
+    def _prefetch(self, urls):
+        """
+        Return `{url: listing}` for `urls`, fetching concurrently those not
+        already fetched by another object of this run (or by this object
+        for VOLATILE_COLLECTIONS). A listing is fetched again once a write
+        went to a related collection or it got too old.
+        """
+        now = time.time()
+        listings = {}
+        missing = []
+        with _prefetched_lock:
+            for url in set(urls):
+                if ResponseCache.collection(url) in VOLATILE_COLLECTIONS:
+                    cached = self._listings.get(url.lstrip('/'))
+                else:
+                    cached = _prefetched.get(url.lstrip('/'))
+                if cached and cached[0] is self._maas and \
+                        cached[1] == _collection_writes(self._maas, url) and \
+                        now - cached[2] < PREFETCH_MAX_AGE:
+                    listings[url] = cached[3]
+                else:
+                    missing.append(url)
+
+        def fetch(url):
+            writes = _collection_writes(self._maas, url)
+            return writes, json_codec.loads(self._maas.get(url).read())
+
+        results = run_concurrently(fetch, missing, len(missing))
+        with _prefetched_lock:
+            for url, (result, error) in zip(missing, results):
+                if error is not None:
+                    raise error
+                if ResponseCache.collection(url) in VOLATILE_COLLECTIONS:
+                    store = self._listings
+                else:
+                    store = _prefetched
+                store[url.lstrip('/')] = (self._maas, result[0], now,
+                                          result[1])
+                listings[url] = result[1]
+        return listings
+
+    def _get_listing(self, url):
+        return self._prefetch([url])[url]
+
+    def _open_journal(self):
+        if self._journal_name:
+            self._journal = CheckpointJournal(os.path.join(
+                JOURNAL_DIR, '{0}.journal'.format(self._journal_name)))
+        return self._journal
+
+    def _last_step(self):
+        """
+        Return the step completed for the current object by a previous run.
+        """
+        if self._journal is None:
+            return None
+        return self._journal.step(*self._current)
+
+    def _checkpoint(self, step=CheckpointJournal.DONE):
+        """
+        Record `step` as completed for the current object.
+        """
+        if self._journal is not None and self._planned is None:
+            self._journal.record(self._current[0], self._current[1], step)
+            self._journal.flush()
+
+    def _check_mac_conflicts(self, name, macs):
+        """
+        Fail before any request if one of `macs` belongs to another node.
+        """
+        if not isinstance(macs, list):
+            macs = [macs]
+        conflicts = self._get_mac_index().conflicts(name, macs)
+        if conflicts:
+            raise Exception('MAC address conflict for {0}: {1}'.format(
+                name, ', '.join(
+                    '{0} already belongs to {1} {2} ({3})'.format(
+                        mac, entry.kind, entry.hostname, entry.system_id)
+                    for mac, entry in sorted(conflicts.items()))))
+
+    def _write(self, method, path, op=None, **data):
+        """
+        Send a write, or only record it in the plan when planning.
+
+        :return: The response, or None when planning.
+        """
+        if self._planned is not None:
+            self._planned.append({
+                'object': self._current and self._current[0],
+                'method': method,
+                'path': path,
+                'op': op,
+            })
+            return None
+        if method == 'PUT':
+            return self._maas.put(path, **data)
+        if method == 'DELETE':
+            return self._maas.delete(path)
+        return self._maas.post(path, op, **data)
+
+    def plan(self, client=None):
+        """
+        Switch to planning: writes are recorded by `_write` instead of being
+        sent, and the client is replaced by a read-only one (`client` if
+        given), so that a write bypassing `_write` fails instead of
+        reaching MAAS.
+        """
+        self._maas = client or self._maas.read_only()
+        self._planned = []
+        return self
 
     def send(self, data):
         LOG.info('%s %s', self.__class__.__name__.lower(), _format_data(data))
         if self._update:
-            return self._maas.put(
-                self._update_url.format(data[self._update_key]), **data).read()
-        if isinstance(self._create_url, tuple):
-            return self._maas.post(self._create_url[0].format(**data),
-                                   *self._create_url[1:], **data).read()
-        return self._maas.post(self._create_url.format(**data),
-                                None, **data).read()
+            response = self._write(
+                'PUT', self._update_url.format(data[self._update_key]),
+                **data)
+        elif isinstance(self._create_url, tuple):
+            response = self._write('POST', self._create_url[0].format(**data),
+                                   *self._create_url[1:], **data)
+        else:
+            response = self._write('POST', self._create_url.format(**data),
+                                   **data)
+        return response and response.read()
 
     def process(self, objects_name=None):
         # FIXME: probably, should be extended with "skipped" return.
@@ -112,7 +358,8 @@ class MaasObject(object):
             config = __salt__['config.get']('maas')
             for part in self._config_path.split('.'):
                 config = config.get(part, {})
-            extra = {}
+            config = dict(self._config_items(config))
+            extra_urls = {}
             for name, url_call in self._extra_data_urls.iteritems():
                 key = 'id'
                 key_name = 'name'
@@ -121,31 +368,40 @@ class MaasObject(object):
                         url_call, key = url_call[:]
                     else:
                         url_call, key, key_name = url_call[:]
-                json_res = json.loads(self._maas.get(url_call).read())
+                extra_urls[name] = (url_call, key, key_name)
+            urls = [url for url, _, _ in extra_urls.values()]
+            if self._all_elements_url:
+                urls.append(self._all_elements_url)
+            listings = self._prefetch(urls)
+            extra = {}
+            for name, (url_call, key, key_name) in extra_urls.iteritems():
+                json_res = listings[url_call]
                 if key:
                     extra[name] = {v[key_name]: v[key] for v in json_res}
                 else:
                     extra[name] = {v[key_name]: v for v in json_res}
             if self._all_elements_url:
-                all_elements = {}
-                elements = self._maas.get(self._all_elements_url).read()
-                res_json = json.loads(elements)
-                for element in res_json:
-                    if isinstance(element, (str, unicode)):
-                        all_elements[element] = {}
-                    else:
-                        all_elements[element[self._element_key]] = element
+                all_elements = self._index_elements(
+                    listings[self._all_elements_url])
             else:
                 all_elements = {}
+            journal = self._open_journal()
+            if journal is not None:
+                ret['skipped'] = []
+            if self._planned is not None:
+                ret['planned'] = self._planned
 
             def process_single(name, config_data):
                 self._update = False
+                self._current = (name, _fingerprint(config_data))
+                if self._last_step() == CheckpointJournal.DONE:
+                    ret['skipped'].append(name)
+                    return
                 try:
                     data = self.fill_data(name, config_data, **extra)
                     if data is None:
                         ret['updated'].append(name)
-                        return
-                    if name in all_elements:
+                    elif name in all_elements:
                         self._update = True
                         data = self.update(data, all_elements[name])
                         self.send(data)
@@ -153,6 +409,7 @@ class MaasObject(object):
                     else:
                         self.send(data)
                         ret['success'].append(name)
+                    self._checkpoint()
                 except urllib2.HTTPError as e:
                     # FIXME add exception's for response:
                     # '{"mode": ["Interface is already set to DHCP."]}
@@ -181,6 +438,8 @@ class MaasObject(object):
                 ret['errors'] = {}
             else:
                 raise Exception(ret)
+        if self._journal is not None and self._planned is None:
+            self._journal.forget(objects_name or config.keys())
         return ret
 
 
@@ -192,6 +451,10 @@ class Fabric(MaasObject):
         self._update_url = u'api/2.0/fabrics/{0}/'
         self._config_path = 'region.fabrics'
 
+    def _config_items(self, config):
+        for key, fabric in config.iteritems():
+            yield fabric.get('name', key), fabric
+
     def fill_data(self, name, fabric):
         data = {
             'name': name,
@@ -223,7 +486,8 @@ class Subnet(MaasObject):
             'cidr': subnet.get('cidr'),
             'gateway_ip': subnet['gateway_ip'],
         }
-        self._iprange = subnet['iprange']
+        # Legacy single range; see IPRange for 'ipranges'
+        self._iprange = subnet.get('iprange')
         return data
 
     def update(self, new, old):
@@ -232,19 +496,20 @@ class Subnet(MaasObject):
 
     def send(self, data):
         response = super(Subnet, self).send(data)
-        res_json = json.loads(response)
-        self._process_iprange(res_json['id'])
+        if self._iprange:
+            subnet_id = json_codec.loads(response)['id'] if response else None
+            self._process_iprange(subnet_id)
         return response
 
     def _get_fabric_from_cidr(self, cidr):
-        subnets = json.loads(self._maas.get(u'api/2.0/subnets/').read())
+        subnets = self._get_listing(u'api/2.0/subnets/')
         for subnet in subnets:
             if subnet['cidr'] == cidr:
                 return subnet['vlan']['fabric']
         return ''
 
     def _process_iprange(self, subnet_id):
-        ipranges = json.loads(self._maas.get(u'api/2.0/ipranges/').read())
+        ipranges = self._get_listing(u'api/2.0/ipranges/')
         LOG.warn('all %s ipranges %s', subnet_id, ipranges)
         update = False
         old_data = None
@@ -263,10 +528,145 @@ class Subnet(MaasObject):
         LOG.info('iprange %s', _format_data(data))
         if update:
             LOG.warn('UPDATING %s %s', data, old_data)
-            self._maas.put(u'api/2.0/ipranges/{0}/'.format(old_data['id']),
-                           **data)
+            self._write('PUT', u'api/2.0/ipranges/{0}/'.format(old_data['id']),
+                        **data)
         else:
-            self._maas.post(u'api/2.0/ipranges/', None, **data)
+            self._write('POST', u'api/2.0/ipranges/', **data)
+
+
+class SubnetByCidr(Subnet):
+    """
+    Subnets as converged by maasng.subnet_present: matched by CIDR and
+    named after their optional `name`, whatever their pillar key.
+    """
+
+    def __init__(self):
+        super(SubnetByCidr, self).__init__()
+        self._element_key = 'cidr'
+
+    def _config_items(self, config):
+        for subnet in config.itervalues():
+            yield subnet['cidr'], subnet
+
+    def fill_data(self, name, subnet, fabrics):
+        data = super(SubnetByCidr, self).fill_data(name, subnet, fabrics)
+        data['name'] = subnet.get('name', '')
+        return data
+
+
+class Vlan(MaasObject):
+    def __init__(self):
+        super(Vlan, self).__init__()
+        self._all_elements_url = u'api/2.0/fabrics/'
+        self._create_url = u'api/2.0/fabrics/{fabric_id}/vlans/'
+        # MAAS 2.3 expects the VID here rather than the VLAN id, see
+        # maasng.create_vlan_in_fabric
+        self._update_url = u'api/2.0/fabrics/{fabric_id}/vlans/{vid}/'
+        self._config_path = 'region.fabrics'
+        self._extra_data_urls = {
+            'fabrics': u'api/2.0/fabrics/',
+            'racks': (u'api/2.0/rackcontrollers/', 'system_id', 'hostname'),
+        }
+
+    def _config_items(self, config):
+        for key, fabric in config.iteritems():
+            fabric_name = fabric.get('name', key)
+            for vid, vlan in fabric.get('vlans', {}).iteritems():
+                yield '{0}.{1}'.format(fabric_name, vid), \
+                    dict(vlan, fabric=fabric_name, vid=vid)
+
+    def _index_elements(self, fabrics):
+        all_elements = {}
+        for fabric in fabrics:
+            for vlan in fabric['vlans']:
+                name = '{0}.{1}'.format(fabric['name'], vlan['vid'])
+                all_elements[name] = vlan
+        return all_elements
+
+    def fill_data(self, name, vlan, fabrics, racks):
+        data = {
+            'fabric_id': str(fabrics[vlan['fabric']]),
+            'vid': str(vlan['vid']),
+            'name': vlan.get('name', ''),
+            'description': vlan.get('description', ''),
+        }
+        if vlan.get('mtu'):
+            data['mtu'] = str(vlan['mtu'])
+        # Optional, as for maasng.vlan_present_in_fabric
+        if vlan.get('primary_rack'):
+            data['primary_rack'] = racks[vlan['primary_rack']]
+        return data
+
+    def update(self, new, old):
+        return new
+
+    def send(self, data):
+        LOG.info('%s %s', self.__class__.__name__.lower(), _format_data(data))
+        params = dict(data)
+        del params['fabric_id']
+        if self._update:
+            del params['vid']
+            response = self._write('PUT', self._update_url.format(**data),
+                                   **params)
+        else:
+            response = self._write('POST', self._create_url.format(**data),
+                                   **params)
+        return response and response.read()
+
+
+class VlanDHCP(Vlan):
+    """
+    Turn DHCP on for the VLANs with `dhcp: true`, once their dynamic
+    ranges exist.
+    """
+
+    def _config_items(self, config):
+        for name, vlan in super(VlanDHCP, self)._config_items(config):
+            if str(vlan.get('dhcp', False)).lower() == 'true':
+                yield name, vlan
+
+    def fill_data(self, name, vlan, fabrics, racks):
+        data = super(VlanDHCP, self).fill_data(name, vlan, fabrics, racks)
+        data['dhcp_on'] = 'True'
+        return data
+
+
+class IPRange(MaasObject):
+    def __init__(self):
+        super(IPRange, self).__init__()
+        self._all_elements_url = u'api/2.0/ipranges/'
+        self._create_url = u'api/2.0/ipranges/'
+        self._update_url = u'api/2.0/ipranges/{0}/'
+        self._config_path = 'region.subnets'
+        self._element_key = 'start_ip'
+        self._extra_data_urls = {
+            'subnets': (u'api/2.0/subnets/', 'id', 'cidr'),
+            'subnet_names': (u'api/2.0/subnets/', 'id', 'name'),
+        }
+
+    def _config_items(self, config):
+        for subnet in config.itervalues():
+            for iprange in subnet.get('ipranges', {}).itervalues():
+                yield iprange['start'], dict(iprange, cidr=subnet['cidr'])
+
+    def fill_data(self, name, iprange, subnets, subnet_names):
+        if iprange.get('subnet'):
+            subnet_id = subnet_names[iprange['subnet']]
+        else:
+            subnet_id = subnets[iprange['cidr']]
+        data = {
+            'type': iprange.get('type', 'dynamic'),
+            'start_ip': iprange['start'],
+            'end_ip': iprange['end'],
+            'subnet': str(subnet_id),
+        }
+        if iprange.get('comment'):
+            data['comment'] = iprange['comment']
+        return data
+
+    def update(self, new, old):
+        new['id'] = str(old['id'])
+        return new
 
 
 class DHCPSnippet(MaasObject):
@@ -357,21 +757,29 @@ class Device(MaasObject):
             'hostname': name,
         }
         self._interface = device_data['interface']
+        self._check_mac_conflicts(name, data['mac_addresses'])
         return data
 
     def update(self, new, old):
-        old_macs = set(v['mac_address'].lower() for v in old['interface_set'])
+        old_macs = self._get_mac_index().macs(old['system_id'])
         if new['mac_addresses'].lower() not in old_macs:
             self._update = False
             LOG.info('Mac changed deleting old device %s', old['system_id'])
-            self._maas.delete(u'api/2.0/devices/{0}/'.format(old['system_id']))
+            self._write('DELETE',
+                        u'api/2.0/devices/{0}/'.format(old['system_id']))
+            self._get_mac_index().remove_node(old['system_id'])
         else:
             new[self._update_key] = str(old[self._update_key])
         return new
 
     def send(self, data):
         response = super(Device, self).send(data)
-        resp_json = json.loads(response)
+        if response is None:
+            # Planning: the ids are only known once the device exists
+            self._link_interface('{system_id}', '{interface_id}')
+            return response
+        resp_json = json_codec.loads(response)
+        self._get_mac_index().add_node('device', resp_json)
         system_id = resp_json['system_id']
         iface_id = resp_json['interface_set'][0]['id']
         self._link_interface(system_id, iface_id)
@@ -389,9 +797,8 @@ class Device(MaasObject):
             data['force'] = '1'
         LOG.info('interfaces link_subnet %s %s %s', system_id, interface_id,
                  _format_data(data))
-        self._maas.post(u'/api/2.0/nodes/{0}/interfaces/{1}/'
-                        .format(system_id, interface_id), 'link_subnet',
-                        **data)
+        self._write('POST', u'/api/2.0/nodes/{0}/interfaces/{1}/'
+                    .format(system_id, interface_id), 'link_subnet', **data)
 
 
 class Machine(MaasObject):
@@ -403,6 +810,7 @@ class Machine(MaasObject):
         self._config_path = 'region.machines'
         self._element_key = 'hostname'
         self._update_key = 'system_id'
+        self._journal_name = 'process_machines'
 
     def fill_data(self, name, machine_data):
         power_data = machine_data['power_parameters']
@@ -463,11 +871,17 @@ class Machine(MaasObject):
 
             data_key = 'power_parameters_{}'.format(k)
             data[data_key] = v
+        self._check_mac_conflicts(name, data['mac_addresses'])
         return data
 
-    def update(self, new, old):
-        LOG.debug('Updating machine')
-        old_macs = set(v['mac_address'].lower() for v in old['interface_set'])
+    def _plan(self, new, old):
+        """
+        Return the action enlisting `new` takes, given the existing machine
+        `old` (or None), and the data to send for it.
+        """
+        if old is None:
+            return 'created', new
+        old_macs = self._get_mac_index().macs(old['system_id'])
         LOG.debug('old_macs: %s' % old_macs)
         if isinstance(new['mac_addresses'], list):
             new_macs = set(v.lower() for v in new['mac_addresses'])
@@ -476,14 +890,128 @@ class Machine(MaasObject):
         LOG.debug('new_macs: %s' % new_macs)
         intersect = list(new_macs.intersection(old_macs))
         if not intersect:
-            self._update = False
+            return 'replaced', new
+        new = dict(new, mac_addresses=intersect)
+        new[self._update_key] = str(old[self._update_key])
+        return 'updated', new
+
+    def _enlist(self, task):
+        """
+        Send one planned machine; safe to run from several threads.
+        """
+        name, action, data, old = task
+        LOG.info('machine %s %s', action, _format_data(data))
+        if action == 'replaced':
             LOG.info('Mac changed deleting old machine %s', old['system_id'])
             self._maas.delete(u'api/2.0/machines/{0}/'
                               .format(old['system_id']))
+        if action == 'updated':
+            response = self._maas.put(
+                self._update_url.format(data[self._update_key]), **data)
         else:
-            new['mac_addresses'] = intersect
-            new[self._update_key] = str(old[self._update_key])
-        return new
+            response = self._maas.post(self._create_url, None, **data)
+        return json_codec.loads(response.read())
+
+    def process(self, objects_name=None):
+        """
+        Enlist the machines in batches of concurrent requests.
+
+        Machines done by a run that failed are recorded in a journal and
+        skipped by the next run, as long as their pillar did not change.
+        They are dropped from the journal once a run succeeds.
+        """
+        options = __salt__['config.get']('maas:region:enlistment', {})
+        concurrency = options.get('concurrency', 8)
+        batch_size = options.get('batch_size', 50)
+        ret = {
+            'success': [],
+            'errors': {},
+            'updated': [],
+            'replaced': [],
+            'skipped': [],
+        }
+        config = __salt__['config.get']('maas')
+        for part in self._config_path.split('.'):
+            config = config.get(part, {})
+        if objects_name is not None:
+            config = dict((name, config[name])
+                          for name in objects_name.split(','))
+        listings = self._prefetch([self._all_elements_url,
+                                   u'api/2.0/devices/'])
+        all_elements = {}
+        for element in listings[self._all_elements_url]:
+            all_elements[element[self._element_key]] = element
+        self._mac_index = MacIndex(all_elements.values(),
+                                   listings[u'api/2.0/devices/'])
+        journal = self._open_journal()
+
+        tasks = []
+        fingerprints = {}
+        for name, config_data in sorted(config.iteritems()):
+            fingerprints[name] = _fingerprint(config_data)
+            if name in all_elements and \
+                    journal.is_done(name, fingerprints[name]):
+                ret['skipped'].append(name)
+                continue
+            try:
+                data = self.fill_data(name, config_data)
+                action, data = self._plan(data, all_elements.get(name))
+                tasks.append((name, action, data, all_elements.get(name)))
+            except Exception as e:
+                LOG.error('Failed for object %s reason %s', name, e)
+                ret['errors'][name] = str(e)
+
+        actions = {'created': 'success', 'updated': 'updated',
+                   'replaced': 'replaced'}
+        if self._planned is not None:
+            for name, action, data, old in tasks:
+                self._current = (name, fingerprints[name])
+                if action == 'replaced':
+                    self._write('DELETE', u'api/2.0/machines/{0}/'
+                                .format(old['system_id']))
+                if action == 'updated':
+                    self._write('PUT', self._update_url.format(
+                        data[self._update_key]), **data)
+                else:
+                    self._write('POST', self._create_url, **data)
+                ret[actions[action]].append(name)
+            ret['planned'] = self._planned
+            tasks = []
+        index = self._mac_index
+        for start in range(0, len(tasks), batch_size):
+            batch = tasks[start:start + batch_size]
+            results = run_concurrently(self._enlist, batch, concurrency)
+            for (name, action, data, old), (machine, error) in \
+                    zip(batch, results):
+                if error is None:
+                    if old is not None:
+                        index.remove_node(old['system_id'])
+                    index.add_node('machine', machine)
+                    journal.record(name, fingerprints[name])
+                    ret[actions[action]].append(name)
+                    continue
+                if isinstance(error, urllib2.HTTPError):
+                    error = error.read()
+                LOG.error('Failed for object %s reason %s', name, error)
+                ret['errors'][name] = str(error)
+            journal.flush()
+
+        ret['summary'] = {
+            'created': len(ret['success']),
+            'updated': len(ret['updated']),
+            'replaced': len(ret['replaced']),
+            'skipped': len(ret['skipped']),
+            'failed': len(ret['errors']),
+        }
+        if ret['errors']:
+            if 'already exists' in str(ret['errors']):
+                ret['success'] = ret['errors']
+                ret['errors'] = {}
+            else:
+                raise Exception(ret)
+        if self._planned is None:
+            journal.forget(config.keys())
+        return ret
 
 
 class AssignMachinesIP(MaasObject):
@@ -502,6 +1030,7 @@ class AssignMachinesIP(MaasObject):
         self._update_key = 'system_id'
         self._extra_data_urls = {'machines': (u'api/2.0/machines/',
                                               None, 'hostname')}
+        self._journal_name = 'process_assign_machines_ip'
 
     def _data_old(self, _interface, _machine):
         """
@@ -528,15 +1057,15 @@ class AssignMachinesIP(MaasObject):
         return data
 
     def _get_nic_id_by_mac(self, machine, req_mac=None):
-        data = {}
-        for nic in machine['interface_set']:
-            data[nic['mac_address']] = nic['id']
         if req_mac:
-            if req_mac in data.keys():
-                return data[req_mac]
-            else:
+            nic_id = self._mac_index.nic_id(machine['system_id'], req_mac)
+            if nic_id is None:
                 raise Exception('NIC with mac:{} not found at '
                                 'node:{}'.format(req_mac, machine['fqdn']))
+            return nic_id
+        data = {}
+        for nic in machine['interface_set']:
+            data[nic['mac_address']] = nic['id']
         return data
 
     def _disconnect_all_nic(self, machine):
@@ -551,8 +1080,8 @@ class AssignMachinesIP(MaasObject):
         for nic in machine['interface_set']:
             LOG.debug("Disconnecting interface:{}".format(nic['mac_address']))
             try:
-                self._maas.post(
-                    u'/api/2.0/nodes/{}/interfaces/{}/'.format(
+                self._write(
+                    'POST', u'/api/2.0/nodes/{}/interfaces/{}/'.format(
                         machine['system_id'], nic['id']), 'disconnect')
             except Exception as e:
                 LOG.error("Failed to disconnect interface:{} on node:{}".format(
@@ -605,14 +1134,14 @@ class AssignMachinesIP(MaasObject):
                                                    physical_data))
             # "link_subnet" and "fill all other data" - its 2 different
             # operations. So, first we update NIC:
-            self._maas.put(
-                u'/api/2.0/nodes/{}/interfaces/{}/'.format(machine['system_id'],
-                                                           nic_id),
+            self._write(
+                'PUT', u'/api/2.0/nodes/{}/interfaces/{}/'.format(
+                    machine['system_id'], nic_id),
                 **physical_data)
             # And then, link subnet configuration:
-            self._maas.post(
-                u'/api/2.0/nodes/{}/interfaces/{}/'.format(machine['system_id'],
-                                                           nic_id),
+            self._write(
+                'POST', u'/api/2.0/nodes/{}/interfaces/{}/'.format(
+                    machine['system_id'], nic_id),
                 'link_subnet', **link_data)
         except Exception as e:
             LOG.error("Failed to process interface:{} on node:{}".format(
@@ -620,6 +1149,8 @@ class AssignMachinesIP(MaasObject):
             raise Exception(str(e))
 
     def fill_data(self, name, data, machines):
+        if self._mac_index is None:
+            self._mac_index = MacIndex(machines.values())
         machine = machines[name]
         if machine['status'] == self.DEPLOYED:
             LOG.debug("Skipping node:{} "
@@ -646,15 +1177,28 @@ class AssignMachinesIP(MaasObject):
             return
         LOG.info('%s for %s', self.__class__.__name__.lower(),
                  machine['fqdn'])
-        self._disconnect_all_nic(machine)
+        # A previous run may have stopped after some interfaces: resume
+        # after the last one it finished.
+        last_step = self._last_step()
+        if last_step is None:
+            self._disconnect_all_nic(machine)
+            self._checkpoint('disconnected')
         for key, value in sorted(interfaces.iteritems()):
+            step = 'interface:{0}'.format(key)
+            if last_step and last_step.startswith('interface:') and \
+                    step <= last_step:
+                LOG.debug("Skipping interface:{} of node:{} done by a "
+                          "previous run".format(key, name))
+                continue
             self._process_interface(value, machine)
+            self._checkpoint(step)
 
 
 class DeployMachines(MaasObject):
     # FIXME
     READY = 4
     DEPLOYED = 6
+    ALLOCATED = 10
 
     def __init__(self):
         super(DeployMachines, self).__init__()
@@ -664,15 +1208,20 @@ class DeployMachines(MaasObject):
         self._element_key = 'hostname'
         self._extra_data_urls = {'machines': (u'api/2.0/machines/',
                                               None, 'hostname')}
+        self._journal_name = 'deploy_machines'
 
     def fill_data(self, name, machine_data, machines):
         machine = machines[name]
         if machine['status'] == self.DEPLOYED:
             return
-        if machine['status'] != self.READY:
+        # Allocated by a previous run which failed to deploy it
+        resumed = machine['status'] == self.ALLOCATED and \
+            self._last_step() == 'allocated'
+        if machine['status'] != self.READY and not resumed:
             raise Exception('Not in ready state')
         data = {
             'system_id': machine['system_id'],
+            'resumed': resumed,
         }
         if 'distro_series' in machine_data:
             data['distro_series'] = machine_data['distro_series']
@@ -681,10 +1230,18 @@ class DeployMachines(MaasObject):
         return data
 
     def send(self, data):
+        data = dict(data)
+        # A journal left by a previous run only counts while the machine
+        # is still Allocated, fill_data checked that.
+        resumed = data.pop('resumed', False)
         LOG.info('%s %s', self.__class__.__name__.lower(), _format_data(data))
-        self._maas.post(u'api/2.0/machines/', 'allocate', system_id=data['system_id']).read()
-        return self._maas.post(self._create_url[0].format(**data),
-                                *self._create_url[1:], **data).read()
+        if not resumed:
+            self._write('POST', u'api/2.0/machines/', 'allocate',
+                        system_id=data['system_id'])
+            self._checkpoint('allocated')
+        response = self._write('POST', self._create_url[0].format(**data),
+                               *self._create_url[1:], **data)
+        return response and response.read()
 
 class BootResource(MaasObject):
     def __init__(self):
@@ -776,12 +1333,12 @@ class SSHPrefs(MaasObject):
             key = 'id'
             if isinstance(url_call, tuple):
                 url_call, key = url_call[:]
-            json_res = json.loads(self._maas.get(url_call).read())
+            json_res = json_codec.loads(self._maas.get(url_call).read())
             extra[name] = {v['name']: v[key] for v in json_res}
         if self._all_elements_url:
             all_elements = {}
             elements = self._maas.get(self._all_elements_url).read()
-            res_json = json.loads(elements)
+            res_json = json_codec.loads(elements)
             for element in res_json:
                 if isinstance(element, (str, unicode)):
                     all_elements[element] = {}
@@ -846,12 +1403,12 @@ class Domain(MaasObject):
             key = 'id'
             if isinstance(url_call, tuple):
                 url_call, key = url_call[:]
-            json_res = json.loads(self._maas.get(url_call).read())
+            json_res = json_codec.loads(self._maas.get(url_call).read())
             extra[name] = {v['name']: v[key] for v in json_res}
         if self._all_elements_url:
             all_elements = {}
             elements = self._maas.get(self._all_elements_url).read()
-            res_json = json.loads(elements)
+            res_json = json_codec.loads(elements)
             for element in res_json:
                 if isinstance(element, (str, unicode)):
                     all_elements[element] = {}
@@ -876,12 +1433,157 @@ class Domain(MaasObject):
         return ret
 
 
+class Redeployer(MaasObject):
+    """
+    Release and deploy again the machines whose deployment failed, at most
+    `attempts` times each. Before each attempt, the machine is left in its
+    failed status for `backoff` seconds, doubled at every attempt.
+
+    The attempts made on each machine are kept in the redeploy_machines
+    journal, so that reruns do not exceed the bound, until the machine is
+    deployed. An attempt released but not deployed yet is resumed by the
+    next run. Writes go through `MaasObject._write`, so a planned
+    Redeployer only records them. A machine which could not be deployed
+    again once Ready is released and reported by `failed`.
+    """
+
+    READY = 'ready'
+    RELEASING = ('releasing', 'disk erasing')
+    # Seconds a released machine may still show its failed status.
+    RELEASE_TIMEOUT = 300
+
+    def __init__(self, config, machines):
+        """
+        :param config: dict with attempts (2), backoff in s (60) and the
+                       statuses to recover (['Failed deployment']).
+        :param machines: maas:region:machines, for the deploy parameters.
+        """
+        self.attempts = int(config.get('attempts', 2))
+        self.backoff = config.get('backoff', 60)
+        self.statuses = set(status.lower() for status in config.get(
+            'statuses', ['Failed deployment']))
+        self.machines = machines
+        super(Redeployer, self).__init__()
+        self.journal = CheckpointJournal(
+            os.path.join(JOURNAL_DIR, 'redeploy_machines.journal'))
+        self._system_ids = {}
+        # Machines released, to be deployed once Ready.
+        self._releasing = set()
+        # Machines whose deploy failed once Ready.
+        self._failed = set()
+
+    def history(self, hostname):
+        """
+        Return the attempts made on `hostname`, oldest first.
+        """
+        system_id = self._system_ids.get(hostname)
+        return self.journal.step(hostname, system_id) or []
+
+    def _record(self, hostname, history):
+        self.journal.record(hostname, self._system_ids[hostname], history)
+        self.journal.flush()
+
+    def done(self, hostname):
+        self._failed.discard(hostname)
+        if hostname in self.journal.steps:
+            self.journal.forget([hostname])
+
+    def failed(self, hostname):
+        """
+        Return True if `hostname` could not be deployed again.
+        """
+        return hostname in self._failed
+
+    def _post(self, path, op, **data):
+        response = self._write('POST', path, op, **data)
+        return response and response.read()
+
+    def _deploy(self, hostname, system_id):
+        machine_data = self.machines.get(hostname) or {}
+        data = {'system_id': system_id}
+        for key in ('distro_series', 'hwe_kernel'):
+            if key in machine_data:
+                data[key] = machine_data[key]
+        self._post(u'api/2.0/machines/', 'allocate', system_id=system_id)
+        try:
+            self._post(u'api/2.0/machines/{0}/'.format(system_id), 'deploy',
+                       **data)
+        except Exception:
+            # Left Allocated, the machine would keep the wait pending.
+            try:
+                self._post(u'api/2.0/machines/{0}/'.format(system_id),
+                           'release')
+            except Exception:
+                LOG.exception('Release of %s failed', hostname)
+            raise
+
+    def recover(self, hostname, system_id, status, in_status):
+        """
+        Move the recovery of `hostname`, seen in `status` for `in_status`
+        seconds, one step further. Return True while it is being recovered,
+        False once it failed for good or is not to be recovered.
+        """
+        self._system_ids[hostname] = system_id
+        status = status.lower()
+        history = self.history(hostname)
+        if history and hostname not in self._releasing and \
+                'deployed_at' not in history[-1] and \
+                'error' not in history[-1]:
+            # Released by a run which stopped before deploying it again.
+            self._releasing.add(hostname)
+        deploying = False
+        try:
+            if hostname in self._releasing:
+                # The release may not be visible at the next poll yet.
+                if status in self.RELEASING or (
+                        status in self.statuses and time.time() -
+                        history[-1]['released_at'] < self.RELEASE_TIMEOUT):
+                    return True
+                self._releasing.discard(hostname)
+                if status != self.READY:
+                    history[-1]['error'] = 'Released to {0}'.format(status)
+                    self._record(hostname, history)
+                    return False
+                LOG.info('Redeploying %s, attempt %d/%d', hostname,
+                         len(history), self.attempts)
+                deploying = True
+                self._deploy(hostname, system_id)
+                history[-1]['deployed_at'] = int(time.time())
+                self._record(hostname, history)
+                return True
+            if status not in self.statuses or \
+                    len(history) >= self.attempts:
+                return False
+            if in_status < self.backoff * 2 ** len(history):
+                return True
+            history.append({'attempt': len(history) + 1,
+                            'failed_status': status,
+                            'released_at': int(time.time())})
+            self._record(hostname, history)
+            LOG.info('Releasing %s after %s', hostname, status)
+            self._post(u'api/2.0/machines/{0}/'.format(system_id), 'release')
+            self._releasing.add(hostname)
+            return True
+        except urllib2.HTTPError as e:
+            error = e.read()
+        except Exception as e:
+            error = str(e)
+        LOG.error('Redeploy of %s failed: %s', hostname, error)
+        self._releasing.discard(hostname)
+        history[-1]['error'] = str(error)
+        self._record(hostname, history)
+        if deploying:
+            # Released again, it will not come back to a failed status.
+            self._failed.add(hostname)
+            return False
+        return len(history) < self.attempts
+
+
 class MachinesStatus(MaasObject):
     @classmethod
-    def execute(cls, objects_name=None):
+    def execute(cls, objects_name=None, refresh=False):
         cls._maas = _create_maas_client()
-        result = cls._maas.get(u'api/2.0/machines/')
-        json_result = json.loads(result.read())
+        inventory = get_inventory(cls._maas, refresh=refresh)
         res = []
         summary = collections.Counter()
         if objects_name:
@@ -889,14 +1591,12 @@ class MachinesStatus(MaasObject):
                 objects_name = set(objects_name.split(','))
             else:
                 objects_name = set([objects_name])
-        for machine in json_result:
-            if objects_name and machine['hostname'] not in objects_name:
-                continue
-            status = STATUS_NAME_DICT[machine['status']]
+        for machine in inventory.filter(hostnames=objects_name):
+            status = STATUS_NAME_DICT[machine.status]
             summary[status] += 1
             res.append(
-                {'hostname': machine['hostname'],
-                 'system_id': machine['system_id'],
+                {'hostname': machine.hostname,
+                 'system_id': machine.system_id,
                  'status': status})
         return {'machines': res, 'summary': summary}
 
@@ -909,6 +1609,12 @@ class MachinesStatus(MaasObject):
         If no kwargs has been passed - will try to wait ALL
         defined in salt::maas::region::machines
 
+        Machines landing in a status they cannot leave by themselves, e.g.
+        'Failed deployment' while waiting for 'Deployed', fail the wait at
+        once instead of at the timeout. The terminal statuses per requested
+        status default to TERMINAL_STATUSES and can be overridden in
+        maas:region:terminal_statuses or with terminal_statuses.
+
         See readme file for more examples.
         CLI Example:
         .. code-block:: bash
@@ -921,51 +1627,126 @@ class MachinesStatus(MaasObject):
             req_status: string; Polling status
             machines:   list; machine names
             ignore_machines: list; machine names
-        :ret: True
-                 Exception - if something fail/timeout reached
+            terminal_statuses: list; statuses failing the wait
+            redeploy:   dict; release and deploy again machines whose
+                        deployment failed, see Redeployer (default
+                        maas:region:redeploy)
+            fail_fast:  bool; fail as soon as one machine is in a terminal
+                        status (default), otherwise once no machine is
+                        pending any more
+        :ret: dict with the outcome of every machine: 'reached', 'failed'
+              or 'pending', its status and the seconds it has been seen
+              in it, and a summary
+                 Exception - with the same dict if a machine failed or the
+                 timeout was reached
         """
         timeout = kwargs.get("timeout", 60 * 120)
         poll_time = kwargs.get("poll_time", 30)
         req_status = kwargs.get("req_status", "Ready")
         to_discover = kwargs.get("machines", None)
         ignore_machines = kwargs.get("ignore_machines", None)
+        fail_fast = kwargs.get("fail_fast", True)
+        region = __salt__['config.get']('maas:region', {})
         if not to_discover:
             try:
-                to_discover = __salt__['config.get']('maas')['region'][
-                    'machines'].keys()
+                to_discover = region['machines'].keys()
             except KeyError:
                 LOG.warning("No defined machines!")
-                return True
+                return {'machines': {}, 'summary': {},
+                        'req_status': req_status, 'elapsed': 0}
+        terminal = kwargs.get("terminal_statuses")
+        if terminal is None:
+            terminal = region.get('terminal_statuses', {}).get(
+                req_status, TERMINAL_STATUSES.get(req_status, ()))
+        terminal = set(status.lower() for status in terminal)
+        redeploy = kwargs.get("redeploy", region.get('redeploy'))
+        redeployer = None
+        if redeploy and redeploy.get('enabled', True) and \
+                req_status.lower() == 'deployed':
+            redeployer = Redeployer(redeploy, region.get('machines', {}))
         total = copy.deepcopy(to_discover) or []
         if ignore_machines and total:
             total = [x for x in to_discover if x not in ignore_machines]
+        outcome = dict((m, {'outcome': 'pending', 'status': None,
+                            'in_status': 0}) for m in total)
         started_at = time.time()
-        while len(total) <= len(to_discover):
-            for m in to_discover:
-                for discovered in MachinesStatus.execute()['machines']:
-                    if m == discovered['hostname'] and \
-                            discovered['status'].lower() == req_status.lower():
-                        if m in total:
-                            total.remove(m)
-
-            if len(total) <= 0:
+        # Machines not listed yet count as seen in no status from the start.
+        seen_at = dict.fromkeys(outcome, started_at)
+        while True:
+            now = time.time()
+            discovered = dict(
+                (machine['hostname'], machine)
+                for machine in MachinesStatus.execute(refresh=True)['machines'])
+            for m, state in outcome.items():
+                if state['outcome'] == 'reached':
+                    continue
+                machine = discovered.get(m) or {}
+                status = machine.get('status')
+                if status != state['status']:
+                    seen_at[m] = now
+                state['status'] = status
+                state['in_status'] = int(now - seen_at[m])
+                if status is None:
+                    state['outcome'] = 'pending'
+                elif status.lower() == req_status.lower():
+                    state['outcome'] = 'reached'
+                    if redeployer is not None:
+                        redeployer.done(m)
+                elif redeployer is not None and redeployer.recover(
+                        m, machine['system_id'], status,
+                        state['in_status']):
+                    state['outcome'] = 'pending'
+                elif redeployer is not None and redeployer.failed(m):
+                    state['outcome'] = 'failed'
+                elif status.lower() in terminal:
+                    state['outcome'] = 'failed'
+                else:
+                    state['outcome'] = 'pending'
+                if redeployer is not None and redeployer.history(m):
+                    state['attempts'] = redeployer.history(m)
+
+            summary = collections.Counter(
+                state['outcome'] for state in outcome.values())
+            ret = {'machines': outcome, 'summary': dict(summary),
+                   'req_status': req_status,
+                   'elapsed': int(now - started_at)}
+            if not summary['pending'] and not summary['failed']:
                 LOG.debug(
                     "Machines:{} are:{}".format(to_discover, req_status))
-                return True
+                return ret
+            if summary['failed'] and (fail_fast or not summary['pending']):
+                LOG.error("Machines:{} in terminal status, not {}".format(
+                    sorted(m for m, state in outcome.items()
+                           if state['outcome'] == 'failed'), req_status))
+                raise Exception(ret)
             if (timeout - (time.time() - started_at)) <= 0:
-                raise Exception(
-                    'Machines:{}not in {} state'.format(total, req_status))
+                LOG.error('Machines:{}not in {} state'.format(
+                    sorted(m for m, state in outcome.items()
+                           if state['outcome'] != 'reached'), req_status))
+                raise Exception(ret)
             LOG.info(
                 "Waiting status:{} "
                 "for machines:{}"
                 "\nsleep for:{}s "
-                "Timeout:{}s".format(req_status, total, poll_time, timeout))
+                "Timeout:{}s".format(
+                    req_status,
+                    sorted(m for m, state in outcome.items()
+                           if state['outcome'] == 'pending'),
+                    poll_time, timeout))
             time.sleep(poll_time)
 
 
 def process_fabrics():
     return Fabric().process()
 
+
+def process_vlans():
+    return Vlan().process()
+
+
+def process_ipranges():
+    return IPRange().process()
+
 def process_boot_sources():
     return Boot_source().process()
 
@@ -1027,3 +1808,174 @@ def process_sshprefs():
 
 def wait_for_machine_status(**kwargs):
     return MachinesStatus.wait_for_machine_status(**kwargs)
+
+
+# Steps of sync_region: name, MaasObject class, key of the objects in
+# maas:region and the steps that must succeed first.
+SYNC_STEPS = [
+    ('maas_config', MaasConfig, 'maas_config', ()),
+    ('commissioning_scripts', CommissioningScripts, 'commissioning_scripts',
+     ()),
+    ('package_repositories', PacketRepository, 'package_repositories', ()),
+    ('fabrics', Fabric, 'fabrics', ()),
+    ('vlans', Vlan, 'fabrics', ('fabrics',)),
+    ('subnets', SubnetByCidr, 'subnets', ('vlans',)),
+    ('ipranges', IPRange, 'subnets', ('subnets',)),
+    ('vlans_dhcp', VlanDHCP, 'fabrics', ('ipranges',)),
+    ('dhcp_snippets', DHCPSnippet, 'dhcp_snippets', ('subnets',)),
+    ('devices', Device, 'devices', ('ipranges',)),
+]
+
+
+def _run_step(step):
+    try:
+        return step[1]().process()
+    except Exception as e:
+        if e.args and isinstance(e.args[0], dict):
+            return e.args[0]
+        LOG.exception('Step %s failed', step[0])
+        return {'success': [], 'updated': [], 'errors': {'*': str(e)}}
+
+
+def sync_region():
+    """
+    Converge every object type of maas:region in one run.
+
+    Steps run as soon as the steps they depend on succeeded (fabrics, vlans,
+    subnets, ipranges, DHCP on vlans, then dhcp snippets and devices);
+    independent ones (maas_config, commissioning_scripts,
+    package_repositories) run concurrently with them. All steps share the
+    client and the listings fetched. Steps without pillar data are left
+    out, steps depending on a failed one are skipped.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-call maas.sync_region
+    """
+    region = __salt__['config.get']('maas').get('region', {})
+    steps = [step for step in SYNC_STEPS if region.get(step[2])]
+    names = set(step[0] for step in steps)
+    report = {}
+    status = {}
+    while len(status) < len(steps):
+        ready = []
+        for step in steps:
+            name, _, _, requires = step
+            if name in status:
+                continue
+            requires = [r for r in requires if r in names]
+            failed = [r for r in requires if status.get(r) in ('failed',
+                                                                 'skipped')]
+            if failed:
+                status[name] = 'skipped'
+                report[name] = {'skipped': 'requires failed step {0}'.format(
+                    ', '.join(failed))}
+            elif all(status.get(r) == 'ok' for r in requires):
+                ready.append(step)
+        LOG.info('sync_region: running %s', ', '.join(s[0] for s in ready))
+        for step, (ret, _) in zip(ready, run_concurrently(
+                _run_step, ready, len(ready))):
+            report[step[0]] = ret
+            status[step[0]] = 'failed' if ret['errors'] else 'ok'
+    report['summary'] = status
+    if 'failed' in status.values():
+        raise Exception(report)
+    return report
+
+
+# Steps planned by plan_region besides those of sync_region
+PLAN_STEPS = SYNC_STEPS + [
+    ('domain', Domain, 'domain', ()),
+    ('sshprefs', SSHPrefs, 'sshprefs', ()),
+    ('boot_sources', Boot_source, 'boot_sources', ()),
+    ('machines', Machine, 'machines', ()),
+    ('assign_machines_ip', AssignMachinesIP, 'machines', ()),
+    ('deploy_machines', DeployMachines, 'machines', ()),
+]
+
+# Keys of maas:region whose writes plan_region does not compute, and why.
+PLAN_EXCLUDED = {
+    'boot_sources_selections': 'converged by '
+        'maasng.boot_sources_all_selections_present, which cannot plan',
+    'boot_resources': 'planning would read and hash every upload',
+}
+
+# Seconds per request assumed by plan_region for endpoints missing from
+# the statistics of the last run.
+DEFAULT_LATENCY = {'GET': 0.05, 'POST': 0.5, 'PUT': 0.3, 'DELETE': 0.3}
+
+
+def plan_region(stats_file=API_STATS_FILE):
+    """
+    Return the writes a run of sync_region and process_machines would make,
+    without making any: current objects are read once through a client
+    refusing writes, and every write is recorded instead of being sent.
+
+    The result lists the planned writes and the objects to create or update
+    per step, the requests count and an estimate of the run time based on
+    the latency per endpoint recorded in `stats_file` (see
+    maasng.api_stats). Objects depending on objects only planned, e.g.
+    subnets in a new fabric or IPs of machines not commissioned yet, cannot
+    be planned and are reported as errors. Keys of `PLAN_EXCLUDED` present
+    in the pillar are listed under `excluded`: their writes are not counted.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-call maas.plan_region
+    """
+    region = __salt__['config.get']('maas').get('region', {})
+    client = _create_maas_client().read_only()
+    steps = [step for step in PLAN_STEPS if region.get(step[2])]
+
+    def plan_step(step):
+        obj = step[1]().plan(client)
+        try:
+            ret = obj.process()
+        except Exception as e:
+            if not e.args or not isinstance(e.args[0], dict):
+                raise
+            ret = e.args[0]
+        return {
+            'create': ret['success'],
+            'update': ret['updated'] + ret.get('replaced', []),
+            'skipped': ret.get('skipped', []),
+            'errors': ret['errors'],
+            'planned': obj._planned,
+        }
+
+    latency = {}
+    if stats_file and os.path.isfile(stats_file):
+        with open(stats_file) as fd:
+            latency = dict((endpoint, data['p50']) for endpoint, data in
+                           json.load(fd)['endpoints'].items())
+    report = {}
+    writes = 0
+    seconds = 0.0
+    for step, (ret, error) in zip(steps, run_concurrently(
+            plan_step, steps, len(steps))):
+        if error is not None:
+            ret = {'errors': {'*': str(error)}, 'planned': []}
+        report[step[0]] = ret
+        for write in ret['planned']:
+            url = client._make_url(write['path'])
+            if write['op']:
+                url += '?op={0}'.format(write['op'])
+            endpoint = endpoint_template(write['method'], url)
+            writes += 1
+            seconds += latency.get(endpoint,
+                                   DEFAULT_LATENCY[write['method']])
+    reads = client.dispatcher.reads
+    seconds += reads * DEFAULT_LATENCY['GET']
+    report['excluded'] = dict((key, reason) for key, reason in
+                              PLAN_EXCLUDED.items() if region.get(key))
+    report['estimate'] = {
+        'reads': reads,
+        'writes': writes,
+        'requests': reads + writes,
+        'seconds': round(seconds, 1),
+    }
+    return report
@@ -13,20 +13,73 @@ str = None
 
 __metaclass__ = type
 __all__ = [
+    'CassetteMiss',
+    'ClientRegistry',
+    'DispatchHook',
+    'EndpointPool',
+    'InstrumentedDispatcher',
     'MAASClient',
     'MAASDispatcher',
     'MAASOAuth',
+    'PersistentResponseCache',
+    'ReadOnlyDispatcher',
+    'RecordingDispatcher',
+    'ReplayDispatcher',
+    'RequestGovernor',
+    'RequestStats',
+    'ResponseCache',
+    'TokenBucket',
+    'WriteBlocked',
+    'endpoint_template',
+    'get_client',
+    'get_dispatcher',
+    'get_governor',
+    'get_request_stats',
+    'get_response_cache',
+    'request_timeout',
+    'run_concurrently',
     ]
 
+import atexit
+import base64
+from collections import (
+    Counter,
+    defaultdict,
+    deque,
+    OrderedDict,
+    )
+from contextlib import contextmanager
+import copy
+import errno
+import fcntl
 import gzip
+import httplib
 from io import BytesIO
+import json
+import logging
+import marshal
+import math
+from multiprocessing.pool import ThreadPool
+import os
+import random
+import re
+import socket
+import tempfile
+import threading
+import time
+import urllib
 import urllib2
+import urlparse
+import zlib
 
+from creds import convert_string_to_tuple
 from encode_json import encode_json_data
 from multipart import encode_multipart_data
 from utils import urlencode
 import oauth.oauth as oauth
 
+LOG = logging.getLogger(__name__)
+
 
 class MAASOAuth:
     """Helper class to OAuth-sign an HTTP request."""
@@ -36,6 +89,20 @@ class MAASOAuth:
             resource_secret, resource_token)
         self.resource_token = oauth.OAuthToken.from_string(resource_tok_string)
         self.consumer_token = oauth.OAuthConsumer(consumer_key, "")
+        # A PLAINTEXT signature does not depend on the request: the header
+        # is built once, only the nonce and timestamp change per request.
+        # It is kept as bytes, like the one built by the oauth library, so
+        # httplib does not decode binary bodies to join them to it.
+        signature = oauth.OAuthSignatureMethod_PLAINTEXT().build_signature(
+            None, self.consumer_token, self.resource_token)
+        self._header = b", ".join(
+            b'%s="%s"' % (name, oauth.escape(value.encode("utf-8")))
+            for name, value in (
+                (b"oauth_consumer_key", self.consumer_token.key),
+                (b"oauth_token", self.resource_token.key),
+                (b"oauth_version", oauth.OAuthRequest.version),
+                (b"oauth_signature_method", "PLAINTEXT"),
+                (b"oauth_signature", signature)))
 
     def sign_request(self, url, headers):
         """Sign a request.
@@ -44,12 +111,9 @@ class MAASOAuth:
         @param headers: The headers in the request.  These will be updated
             with the signature.
         """
-        oauth_request = oauth.OAuthRequest.from_consumer_and_token(
-            self.consumer_token, token=self.resource_token, http_url=url)
-        oauth_request.sign_request(
-            oauth.OAuthSignatureMethod_PLAINTEXT(), self.consumer_token,
-            self.resource_token)
-        headers.update(oauth_request.to_header())
+        headers[b"Authorization"] = (
+            b'OAuth realm="", %s, oauth_nonce="%08d", oauth_timestamp="%d"'
+            % (self._header, random.randint(0, 99999999), time.time()))
 
 
 class NoAuth:
@@ -77,6 +141,25 @@ class RequestWithMethod(urllib2.Request):
             else super(RequestWithMethod, self).get_method())
 
 
+_request_options = threading.local()
+
+
+@contextmanager
+def request_timeout(seconds):
+    """Give up on requests made by this thread after `seconds`.
+
+    Used for calls which wait on something slow behind the region, e.g. a
+    BMC answering `query_power_state`.  A timed out request raises
+    `socket.timeout`, or `URLError` if the connection could not be made.
+    """
+    previous = getattr(_request_options, 'timeout', None)
+    _request_options.timeout = seconds
+    try:
+        yield
+    finally:
+        _request_options.timeout = previous
+
+
 class MAASDispatcher:
     """Helper class to connect to a MAAS server using blocking requests.
 
@@ -110,7 +193,11 @@ class MAASDispatcher:
             set_accept_encoding = True
             headers['Accept-encoding'] = 'gzip'
         req = RequestWithMethod(request_url, data, headers, method=method)
-        res = urllib2.urlopen(req)
+        timeout = getattr(_request_options, 'timeout', None)
+        if timeout is None:
+            res = urllib2.urlopen(req)
+        else:
+            res = urllib2.urlopen(req, timeout=timeout)
         # If we set the Accept-encoding header, then we decode the header for
         # the caller.
         is_gzip = (
@@ -125,6 +212,1032 @@ class MAASDispatcher:
         return res
 
 
+class CassetteMiss(Exception):
+    """Raised when a replayed request has no recorded counterpart."""
+
+
+class WriteBlocked(Exception):
+    """Raised when a read-only client is asked to change something."""
+
+
+class ReadOnlyDispatcher:
+    """Dispatcher refusing every request but GETs, which it counts."""
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.reads = 0
+        self._lock = threading.Lock()
+
+    def dispatch_query(self, request_url, headers, method="GET", data=None):
+        if method != "GET":
+            raise WriteBlocked("%s %s" % (method, request_url))
+        with self._lock:
+            self.reads += 1
+        return self.dispatcher.dispatch_query(
+            request_url, headers, method=method, data=data)
+
+
+class EndpointPool:
+    """Dispatcher spreading requests over several region API endpoints.
+
+    Region controllers of an HA region share the database, so any of them
+    can serve any request.  GETs go to the endpoints in turn
+    (`round_robin`) or to the one with the lowest average latency
+    (`least_latency`); writes stick to one endpoint so that they are
+    applied in order.  An endpoint failing to connect is ejected for
+    `eject_for` seconds and the request is retried on the next one.  Only
+    GETs are retried when the connection broke after the request was sent.
+    """
+
+    STRATEGIES = ('round_robin', 'least_latency')
+
+    # Weight of the last request in the average latency of an endpoint.
+    LATENCY_WEIGHT = 0.3
+
+    def __init__(self, dispatcher, urls, strategy='round_robin',
+                 eject_for=30):
+        """Initialise the pool.
+
+        :param dispatcher: The dispatcher actually sending the requests.
+        :param urls: Base URLs of the region API endpoints, e.g.
+            http://10.0.0.11:5240/MAAS.
+        :param strategy: How GETs pick an endpoint, see `STRATEGIES`.
+        :param eject_for: Seconds an unreachable endpoint is left out.
+        """
+        if not urls:
+            raise ValueError("No region API endpoint given")
+        if strategy not in self.STRATEGIES:
+            raise ValueError("Unknown endpoint strategy %r" % (strategy,))
+        self.dispatcher = dispatcher
+        self.strategy = strategy
+        self.eject_for = eject_for
+        self.endpoints = [
+            {'url': url.rstrip('/'), 'ejected_until': 0, 'latency': 0.0,
+             'requests': 0, 'errors': 0}
+            for url in urls]
+        self._next = 0
+        self._writer = self.endpoints[0]
+        self._lock = threading.Lock()
+
+    def _available(self, now):
+        available = [
+            endpoint for endpoint in self.endpoints
+            if endpoint['ejected_until'] <= now]
+        # When every endpoint is ejected, try the one back the soonest.
+        return available or [
+            min(self.endpoints, key=lambda e: e['ejected_until'])]
+
+    def _pick(self, method, tried):
+        with self._lock:
+            now = time.time()
+            available = [
+                endpoint for endpoint in self._available(now)
+                if endpoint not in tried]
+            if not available:
+                return None
+            if method != "GET":
+                if self._writer not in available:
+                    self._writer = available[0]
+                return self._writer
+            if self.strategy == 'least_latency':
+                return min(available, key=lambda e: e['latency'])
+            self._next += 1
+            return available[self._next % len(available)]
+
+    def _record(self, endpoint, latency=None):
+        with self._lock:
+            endpoint['requests'] += 1
+            if latency is None:
+                endpoint['errors'] += 1
+                endpoint['ejected_until'] = time.time() + self.eject_for
+            elif endpoint['latency']:
+                endpoint['latency'] += self.LATENCY_WEIGHT * (
+                    latency - endpoint['latency'])
+            else:
+                endpoint['latency'] = latency
+
+    def dispatch_query(self, request_url, headers, method="GET", data=None):
+        """Dispatch the request to one of the endpoints.
+
+        See `MAASDispatcher.dispatch_query`.
+        """
+        split = request_url.find('/api/')
+        if split < 0:
+            return self.dispatcher.dispatch_query(
+                request_url, headers, method=method, data=data)
+        path = request_url[split:]
+        tried = []
+        last_error = None
+        while True:
+            endpoint = self._pick(method, tried)
+            if endpoint is None:
+                raise last_error
+            tried.append(endpoint)
+            started_at = time.time()
+            try:
+                res = self.dispatcher.dispatch_query(
+                    endpoint['url'] + path, headers, method=method,
+                    data=data)
+            except urllib2.HTTPError:
+                self._record(endpoint, time.time() - started_at)
+                raise
+            except socket.timeout:
+                # The request outlived its `request_timeout`: the endpoint
+                # answered too slowly for this call, it is not down.
+                self._record(endpoint, time.time() - started_at)
+                raise
+            except urllib2.URLError as error:
+                # Nothing was sent: safe to retry, whatever the method.
+                last_error = error
+                self._record(endpoint)
+            except (socket.error, httplib.HTTPException) as error:
+                last_error = error
+                self._record(endpoint)
+                if method != "GET":
+                    raise
+            else:
+                self._record(endpoint, time.time() - started_at)
+                return res
+            LOG.warning("MAAS endpoint %s ejected for %ss: %s" % (
+                endpoint['url'], self.eject_for, last_error))
+
+    def status(self):
+        """Return the state of every endpoint."""
+        now = time.time()
+        with self._lock:
+            return [
+                dict(endpoint,
+                     ejected=endpoint['ejected_until'] > now,
+                     writer=endpoint is self._writer)
+                for endpoint in self.endpoints]
+
+
+def _interaction_key(method, url):
+    """Return the host-independent key matching requests to recordings.
+
+    Query parameters are sorted, so the key does not depend on the order
+    in which they were encoded.
+    """
+    parts = urlparse.urlsplit(url)
+    query = urllib.urlencode(sorted(urlparse.parse_qsl(parts.query)))
+    return "%s %s?%s" % (method, parts.path, query)
+
+
+class RecordingDispatcher:
+    """Dispatcher recording every exchange into a cassette file.
+
+    Requests are passed on to another dispatcher and each request and its
+    response (or HTTP error) are appended, as one JSON line, to a gzipped
+    cassette.  Response bodies are read in full and handed back to the
+    caller from memory.
+
+    The cassette is opened once, on the first exchange, and appended to as
+    a single gzip member until `close`, which also runs at exit.  An
+    exclusive `flock` is held on it meanwhile, so another process
+    recording into the same cassette waits instead of interleaving its
+    writes.
+    """
+
+    def __init__(self, cassette, dispatcher=None):
+        """Initialise the dispatcher.
+
+        :param cassette: Path of the cassette file to append to.
+        :param dispatcher: The dispatcher actually sending the requests,
+            a `MAASDispatcher` by default.
+        """
+        self.cassette = cassette
+        self.dispatcher = dispatcher or MAASDispatcher()
+        self._lock = threading.Lock()
+        self._file = None
+        self._gzip = None
+
+    def _open(self):
+        self._file = open(self.cassette, 'ab')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            self._gzip = gzip.GzipFile(fileobj=self._file, mode='ab')
+        except Exception:
+            self._file.close()
+            self._file = None
+            raise
+        atexit.register(self.close)
+
+    def close(self):
+        """Finish the gzip member and release the cassette."""
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                self._gzip.close()
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+                self._file.close()
+                self._file = self._gzip = None
+
+    def _record(self, method, url, data, code, info, body, latency):
+        headers = [
+            (key, value) for key, value in info.items()
+            if key.lower() not in ('content-encoding', 'transfer-encoding')]
+        interaction = {
+            'key': _interaction_key(method, url),
+            'status': code,
+            'headers': headers,
+            'latency': round(latency, 6),
+            'request_bytes': len(data) if data else 0,
+            }
+        try:
+            interaction['body'] = body.decode('utf-8')
+        except UnicodeDecodeError:
+            interaction['body_b64'] = base64.b64encode(body)
+        line = json.dumps(interaction) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._gzip.write(line.encode('utf-8'))
+            # Keep what was recorded so far readable if the process dies.
+            self._gzip.flush(zlib.Z_SYNC_FLUSH)
+
+    def dispatch_query(self, request_url, headers, method="GET", data=None):
+        """Dispatch the request and record the exchange.
+
+        See `MAASDispatcher.dispatch_query`.
+        """
+        started_at = time.time()
+        try:
+            res = self.dispatcher.dispatch_query(
+                request_url, headers, method=method, data=data)
+        except urllib2.HTTPError as error:
+            body = error.read()
+            self._record(
+                method, request_url, data, error.code, error.info(), body,
+                time.time() - started_at)
+            raise urllib2.HTTPError(
+                request_url, error.code, error.msg, error.info(),
+                BytesIO(body))
+        body = res.read()
+        self._record(
+            method, request_url, data, res.code, res.info(), body,
+            time.time() - started_at)
+        return urllib2.addinfourl(
+            BytesIO(body), res.info(), res.geturl(), res.code)
+
+
+class ReplayDispatcher:
+    """Dispatcher serving responses from a cassette, without any network.
+
+    Requests are matched on method, path and query parameters; recordings
+    of the same request are served in their recorded order and the last
+    one is repeated once they run out, so polling loops can outlast the
+    trace.  `requests` counts the replayed requests per key.
+    """
+
+    def __init__(self, cassette, latency_scale=None):
+        """Initialise the dispatcher.
+
+        :param cassette: Path of a cassette written by `RecordingDispatcher`.
+        :param latency_scale: Optional factor applied to recorded latencies;
+            responses are served immediately if not given.
+        """
+        self.cassette = cassette
+        self.latency_scale = latency_scale
+        self.requests = Counter()
+        self.misses = Counter()
+        self._interactions = defaultdict(deque)
+        self._lock = threading.Lock()
+        with gzip.open(cassette, 'rb') as lines:
+            for line in lines:
+                if line.strip():
+                    interaction = json.loads(line.decode('utf-8'))
+                    self._interactions[interaction['key']].append(
+                        interaction)
+
+    def _next(self, key):
+        with self._lock:
+            recorded = self._interactions.get(key)
+            if not recorded:
+                self.misses[key] += 1
+                return None
+            self.requests[key] += 1
+            if len(recorded) > 1:
+                return recorded.popleft()
+            return recorded[0]
+
+    def dispatch_query(self, request_url, headers, method="GET", data=None):
+        """Serve the recorded response for the request.
+
+        See `MAASDispatcher.dispatch_query`.  Raises `CassetteMiss` for a
+        request absent from the cassette.
+        """
+        key = _interaction_key(method, request_url)
+        interaction = self._next(key)
+        if interaction is None:
+            raise CassetteMiss(key)
+        if self.latency_scale:
+            time.sleep(interaction['latency'] * float(self.latency_scale))
+        if 'body_b64' in interaction:
+            body = base64.b64decode(interaction['body_b64'])
+        else:
+            body = interaction['body'].encode('utf-8')
+        info = httplib.HTTPMessage(BytesIO(b''.join(
+            ('%s: %s\r\n' % (name, value)).encode('utf-8')
+            for name, value in interaction['headers']) + b'\r\n'))
+        code = interaction['status']
+        if not 200 <= code < 300:
+            raise urllib2.HTTPError(
+                request_url, code, httplib.responses.get(code, ''), info,
+                BytesIO(body))
+        return urllib2.addinfourl(BytesIO(body), info, request_url, code)
+
+
+# Collections whose objects are addressed by name or system_id rather
+# than by a numeric id.
+_NAMED_COLLECTIONS = frozenset([
+    'commissioning-scripts',
+    'controllers',
+    'devices',
+    'domains',
+    'machines',
+    'nodes',
+    'rackcontrollers',
+    'regioncontrollers',
+    'tags',
+    'users',
+    'zones',
+    ])
+
+
+def endpoint_template(method, url):
+    """Return `method` and the path of `url` with object ids templated.
+
+    E.g. `POST /MAAS/api/2.0/machines/{id}/?op=deploy`.  Only the `op`
+    parameter of the query is kept.
+    """
+    parts = urlparse.urlsplit(url)
+    segments = parts.path.split('/')
+    for index, segment in enumerate(segments):
+        previous = segments[index - 1] if index else ''
+        if segment and (segment.isdigit() or previous in _NAMED_COLLECTIONS):
+            segments[index] = '{id}'
+    template = "%s %s" % (method, '/'.join(segments))
+    op = urlparse.parse_qs(parts.query).get('op')
+    if op:
+        template += "?op=%s" % op[0]
+    return template
+
+
+class DispatchHook:
+    """Base class for `InstrumentedDispatcher` hooks.
+
+    Both methods receive the same dict describing the request: `method`,
+    `url`, `endpoint` (see `endpoint_template`) and `bytes_out`, to which
+    `status` (0 when no HTTP response was received), `bytes_in` and
+    `latency` in seconds are added once the request is done.
+    """
+
+    def pre_request(self, request):
+        """Called before the request is sent."""
+
+    def post_request(self, request):
+        """Called after the response, or an error, was received."""
+
+
+class InstrumentedDispatcher:
+    """Dispatcher running `DispatchHook`s around every request.
+
+    The response body is read in full so that its size and the complete
+    latency can be measured; it is handed back to the caller from memory.
+    """
+
+    def __init__(self, dispatcher, hooks=()):
+        """Initialise the dispatcher.
+
+        :param dispatcher: The dispatcher actually sending the requests.
+        :param hooks: Sequence of `DispatchHook` instances.
+        """
+        self.dispatcher = dispatcher
+        self.hooks = list(hooks)
+
+    def dispatch_query(self, request_url, headers, method="GET", data=None):
+        """Dispatch the request, running the hooks around it.
+
+        See `MAASDispatcher.dispatch_query`.
+        """
+        request = {
+            'method': method,
+            'url': request_url,
+            'endpoint': endpoint_template(method, request_url),
+            'bytes_out': len(data) if data else 0,
+            'bytes_in': 0,
+            'status': 0,
+            }
+        for hook in self.hooks:
+            hook.pre_request(request)
+        started_at = time.time()
+        try:
+            res = self.dispatcher.dispatch_query(
+                request_url, headers, method=method, data=data)
+            body = res.read()
+            request['status'] = res.code
+            request['bytes_in'] = len(body)
+            return urllib2.addinfourl(
+                BytesIO(body), res.info(), res.geturl(), res.code)
+        except urllib2.HTTPError as error:
+            request['status'] = error.code
+            raise
+        finally:
+            request['latency'] = time.time() - started_at
+            for hook in self.hooks:
+                hook.post_request(request)
+
+
+def _percentile(values, fraction):
+    """Return the nearest-rank percentile of the sorted `values`."""
+    rank = int(math.ceil(fraction * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+class RequestStats(DispatchHook):
+    """Hook aggregating request counts, sizes and latencies per endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget every request seen so far."""
+        with self._lock:
+            self._endpoints = defaultdict(lambda: {
+                'count': 0,
+                'errors': 0,
+                'bytes_in': 0,
+                'bytes_out': 0,
+                'latencies': [],
+                })
+            self.started_at = time.time()
+
+    def post_request(self, request):
+        with self._lock:
+            endpoint = self._endpoints[request['endpoint']]
+            endpoint['count'] += 1
+            if not 200 <= request['status'] < 400:
+                endpoint['errors'] += 1
+            endpoint['bytes_in'] += request['bytes_in']
+            endpoint['bytes_out'] += request['bytes_out']
+            endpoint['latencies'].append(request['latency'])
+
+    def summary(self):
+        """Return the totals and the per-endpoint statistics.
+
+        Latencies are given in seconds as `p50`, `p95`, `max` and `total`.
+        """
+        with self._lock:
+            endpoints = {}
+            for name, endpoint in self._endpoints.items():
+                latencies = sorted(endpoint['latencies'])
+                endpoints[name] = {
+                    'count': endpoint['count'],
+                    'errors': endpoint['errors'],
+                    'bytes_in': endpoint['bytes_in'],
+                    'bytes_out': endpoint['bytes_out'],
+                    'p50': round(_percentile(latencies, 0.5), 6),
+                    'p95': round(_percentile(latencies, 0.95), 6),
+                    'max': round(latencies[-1], 6),
+                    'total': round(sum(latencies), 6),
+                    }
+        return {
+            'started_at': self.started_at,
+            'duration': round(time.time() - self.started_at, 6),
+            'requests': sum(e['count'] for e in endpoints.values()),
+            'errors': sum(e['errors'] for e in endpoints.values()),
+            'endpoints': endpoints,
+            }
+
+    def write(self, path):
+        """Write the summary to `path` as JSON, replacing it atomically."""
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'w') as fd:
+            json.dump(self.summary(), fd, indent=2, sort_keys=True)
+        os.rename(temp_path, path)
+
+
+_request_stats = RequestStats()
+
+
+def get_request_stats():
+    """Return the `RequestStats` of every client built in this process."""
+    return _request_stats
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting the rate of requests.
+
+    Tokens are replenished continuously at `rate` per second, up to `burst`
+    tokens.  Every request consumes one token and waits if none is left.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(self.rate, 1))
+        self._tokens = self.capacity
+        self._stamp = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until one becomes available."""
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+class RequestGovernor:
+    """Rate and concurrency limits for requests sent to regiond.
+
+    Requests are split into four classes: "read" (GET), "write" (any other
+    method), "long" (operations which start heavy work on the region,
+    like `deploy` or `import_boot_images`, whatever the method) and "bmc"
+    (operations waiting on a machine BMC through a rack controller, like
+    `query_power_state`).  Each class has its own token bucket and its own
+    cap on requests in flight, so slow BMCs do not hold the read slots.
+    """
+
+    LONG_OPS = (
+        'commission',
+        'deploy',
+        'import',
+        'import_boot_images',
+        )
+
+    BMC_OPS = (
+        'query_power_state',
+        )
+
+    DEFAULT_LIMITS = {
+        'read': {'rate': 50, 'burst': 100, 'concurrency': 16},
+        'write': {'rate': 20, 'burst': 40, 'concurrency': 8},
+        'long': {'rate': 2, 'burst': 4, 'concurrency': 2},
+        'bmc': {'rate': 20, 'burst': 40, 'concurrency': 32},
+        }
+
+    def __init__(self, limits=None):
+        """Initialise the governor.
+
+        :param limits: Optional dict overriding `DEFAULT_LIMITS`, keyed by
+            request class.  Each value may set `rate` (requests per second),
+            `burst` and `concurrency`; a false value for one of them
+            disables that limit, and a false value for the whole class
+            (e.g. `read: false`) disables both limits of the class.  The
+            "long" and "bmc" classes additionally accept `ops`, the list of
+            operation names in the class.
+        """
+        self.config = copy.deepcopy(limits or {})
+        self.long_ops = self._ops('long', self.LONG_OPS)
+        self.bmc_ops = self._ops('bmc', self.BMC_OPS)
+        self._buckets = {}
+        self._slots = {}
+        for name, defaults in self.DEFAULT_LIMITS.items():
+            override = self.config.get(name)
+            if not isinstance(override, dict):
+                if override is not None and not override:
+                    continue
+                override = {}
+            limit = dict(defaults)
+            limit.update(override)
+            if limit.get('rate'):
+                self._buckets[name] = TokenBucket(
+                    limit['rate'], limit.get('burst'))
+            if limit.get('concurrency'):
+                self._slots[name] = threading.BoundedSemaphore(
+                    int(limit['concurrency']))
+
+    def _ops(self, name, default):
+        config = self.config.get(name)
+        if not isinstance(config, dict):
+            config = {}
+        return frozenset(config.get('ops', default))
+
+    def classify(self, method, op=None):
+        """Return the request class for `method` and the named `op`."""
+        if op in self.bmc_ops:
+            return 'bmc'
+        if op in self.long_ops:
+            return 'long'
+        if method == 'GET':
+            return 'read'
+        return 'write'
+
+    @contextmanager
+    def slot(self, method, op=None):
+        """Hold a rate token and an in-flight slot for one request."""
+        name = self.classify(method, op)
+        bucket = self._buckets.get(name)
+        if bucket is not None:
+            bucket.acquire()
+        semaphore = self._slots.get(name)
+        if semaphore is None:
+            yield name
+            return
+        semaphore.acquire()
+        try:
+            yield name
+        finally:
+            semaphore.release()
+
+
+class ResponseCache:
+    """LRU cache of GET responses.
+
+    Responses carrying an `ETag` or `Last-Modified` validator are stored and
+    revalidated with a conditional request, so an unchanged resource costs
+    a 304 instead of a full body.  Collections listed in `ttl` are also
+    served locally, without any request, while younger than their TTL.
+    Writes to a collection drop every cached response of that collection
+    and of the collections embedding its objects.
+    """
+
+    DEFAULT_TTL = {
+        'account': 60,
+        'boot-sources': 60,
+        'fabrics': 30,
+        'rackcontrollers': 30,
+        'subnets': 30,
+        }
+
+    RELATED_COLLECTIONS = {
+        'devices': ('nodes',),
+        'fabrics': ('subnets', 'vlans'),
+        'ipranges': ('subnets',),
+        'machines': ('nodes',),
+        'nodes': (
+            'devices', 'machines', 'rackcontrollers', 'regioncontrollers'),
+        'rackcontrollers': ('nodes',),
+        'regioncontrollers': ('nodes',),
+        'subnets': ('fabrics', 'ipranges', 'vlans'),
+        'vlans': ('fabrics', 'subnets'),
+        }
+
+    def __init__(self, config=None):
+        """Initialise the cache.
+
+        :param config: Optional dict with `size`, the maximum number of
+            cached responses, and `ttl`, a dict of per-collection freshness
+            lifetimes in seconds merged over `DEFAULT_TTL`.
+        """
+        self.config = copy.deepcopy(config or {})
+        self.size = int(self.config.get('size', 256))
+        self.ttl = dict(self.DEFAULT_TTL)
+        self.ttl.update(self.config.get('ttl') or {})
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def collection(key):
+        """Return the collection name of the resource at `key`.
+
+        :param key: Resource path relative to the MAAS URL, e.g.
+            `/api/2.0/fabrics/1/vlans/`, optionally with a query string.
+        """
+        parts = [part for part in key.split('?')[0].split('/') if part]
+        if parts[:1] == ['api']:
+            parts = parts[2:]
+        return parts[0] if parts else ''
+
+    def lookup(self, key):
+        """Return the entry cached for `key`, or None."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def is_fresh(self, key, entry):
+        """Can `entry` be served for `key` without asking the region?"""
+        if 'op=' in key:
+            return False
+        ttl = self.ttl.get(self.collection(key))
+        return bool(ttl) and time.time() - entry['stored_at'] < ttl
+
+    def validators(self, entry):
+        """Return the conditional request headers for `entry`."""
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def touch(self, key):
+        """Mark the entry for `key` as just revalidated."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry['stored_at'] = time.time()
+
+    def store(self, key, response, body):
+        """Cache `body` of `response` for `key`, if it is cacheable."""
+        info = response.info()
+        entry = {
+            'body': body,
+            'headers': info,
+            'code': response.code,
+            'url': response.geturl(),
+            'etag': info.get('ETag'),
+            'last_modified': info.get('Last-Modified'),
+            'stored_at': time.time(),
+            }
+        cacheable = (
+            entry['etag'] or entry['last_modified'] or
+            ('op=' not in key and self.ttl.get(self.collection(key))))
+        if response.code != 200 or not cacheable:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """Drop cached responses affected by a write to `key`."""
+        name = self.collection(key)
+        names = set((name,) + self.RELATED_COLLECTIONS.get(name, ()))
+        with self._lock:
+            for cached in list(self._entries):
+                if self.collection(cached) in names:
+                    del self._entries[cached]
+
+    def response(self, entry):
+        """Build a response object serving the body of `entry`."""
+        return urllib2.addinfourl(
+            BytesIO(entry['body']), entry['headers'], entry['url'],
+            entry['code'])
+
+
+class PersistentResponseCache(ResponseCache):
+    """`ResponseCache` shared through files by every process of the minion.
+
+    Each `salt-call` or `module.run` is a new process, which would start with
+    an empty cache.  Entries are also marshalled into one file per
+    collection under `path`: a process loads a collection on first use and
+    again whenever its file changed, writes through every stored entry and
+    removes the files of the collections a write invalidates.  Files are
+    replaced by atomic renames, under a `flock` on a lock file per
+    collection, so concurrent readers never see a partial file.
+    """
+
+    DEFAULT_PATH = '/var/cache/salt/minion/maas/responses'
+
+    # Format of the cache files; files of other versions are ignored.
+    VERSION = 1
+
+    def __init__(self, config=None):
+        """Initialise the cache.
+
+        :param config: `ResponseCache` settings, plus `path`, the directory
+            of the cache files, and `max_age`, the number of seconds after
+            which entries are dropped from the files (one day by default).
+        """
+        super(PersistentResponseCache, self).__init__(config)
+        self.path = self.config.get('path', self.DEFAULT_PATH)
+        self.max_age = int(self.config.get('max_age', 86400))
+        # Stamp of the file of each collection when it was last loaded.
+        self._loaded = {}
+
+    def _file(self, name):
+        return os.path.join(self.path, '%s.cache' % (name or '_root'))
+
+    @staticmethod
+    def _persisted(name):
+        """Can the collection `name` be used as a file name?"""
+        return re.match(r'^[\w-]*$', name) is not None
+
+    def _stamp(self, name):
+        try:
+            st = os.stat(self._file(name))
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime, st.st_size
+
+    @contextmanager
+    def _locked(self, name, operation):
+        """Hold `operation`, a `flock` mode, on the collection `name`."""
+        try:
+            os.makedirs(self.path, 0o700)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        with open(self._file(name) + '.lock', 'ab') as lock:
+            fcntl.flock(lock, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self, name):
+        """Return the records of the collection `name`, by key."""
+        try:
+            with open(self._file(name), 'rb') as fd:
+                data = marshal.load(fd)
+        except (IOError, EOFError, ValueError, TypeError):
+            return {}
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            return {}
+        return data['entries']
+
+    def _dump(self, name, records):
+        """Atomically replace the file of the collection `name`."""
+        fd, temp = tempfile.mkstemp(dir=self.path, prefix='.%s.' % name)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                marshal.dump(
+                    {'version': self.VERSION, 'entries': records}, out)
+            os.rename(temp, self._file(name))
+        except:
+            os.unlink(temp)
+            raise
+
+    @staticmethod
+    def _record(entry):
+        """Return `entry` as a marshallable tuple."""
+        headers = entry['headers']
+        text = b''.join(getattr(headers, 'headers', None) or [
+            b'%s: %s\r\n' % item for item in headers.items()])
+        return (
+            entry['body'], text, entry['code'], entry['url'], entry['etag'],
+            entry['last_modified'], entry['stored_at'])
+
+    @staticmethod
+    def _entry(record):
+        body, text, code, url, etag, last_modified, stored_at = record
+        return {
+            'body': body,
+            'headers': httplib.HTTPMessage(BytesIO(text)),
+            'code': code,
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'stored_at': stored_at,
+            }
+
+    def _sync(self, name):
+        """Reload the entries of the collection `name` if its file changed."""
+        stamp = self._stamp(name)
+        if self._loaded.get(name, False) == stamp:
+            return
+        with self._locked(name, fcntl.LOCK_SH):
+            records = self._load(name)
+        with self._lock:
+            for key in list(self._entries):
+                if self.collection(key) == name:
+                    del self._entries[key]
+            for key, record in records.items():
+                self._entries[key] = self._entry(record)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            self._loaded[name] = stamp
+
+    def _update(self, name, key, entry):
+        """Write `entry` for `key` through to the file of `name`."""
+        with self._locked(name, fcntl.LOCK_EX):
+            now = time.time()
+            records = dict(
+                (cached, record)
+                for cached, record in self._load(name).items()
+                if now - record[6] < self.max_age)
+            records[key] = self._record(entry)
+            self._dump(name, records)
+        # Reload on next lookup: the stamp of the file loaded before is
+        # stale, and its removal by another process would go unnoticed.
+        self._loaded.pop(name, None)
+
+    def lookup(self, key):
+        name = self.collection(key)
+        if self._persisted(name):
+            self._sync(name)
+        return super(PersistentResponseCache, self).lookup(key)
+
+    def touch(self, key):
+        super(PersistentResponseCache, self).touch(key)
+        self._write_through(key)
+
+    def store(self, key, response, body):
+        super(PersistentResponseCache, self).store(key, response, body)
+        self._write_through(key)
+
+    def _write_through(self, key):
+        name = self.collection(key)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and self._persisted(name):
+            self._update(name, key, entry)
+
+    def invalidate(self, key):
+        super(PersistentResponseCache, self).invalidate(key)
+        collection = self.collection(key)
+        for name in set((collection,) +
+                        self.RELATED_COLLECTIONS.get(collection, ())):
+            if not self._persisted(name):
+                continue
+            with self._locked(name, fcntl.LOCK_EX):
+                try:
+                    os.unlink(self._file(name))
+                except OSError as error:
+                    if error.errno != errno.ENOENT:
+                        raise
+            self._loaded.pop(name, None)
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def _get_shared(factory, config):
+    """Return the process-wide `factory(config)` instance.
+
+    The instance is rebuilt only when `config` changes.
+    """
+    with _shared_lock:
+        instance = _shared.get(factory)
+        if instance is None or instance.config != config:
+            instance = _shared[factory] = factory(config)
+        return instance
+
+
+def get_governor(limits=None):
+    """Return the process-wide `RequestGovernor` configured with `limits`.
+
+    Every client built in the same process shares one governor, so limits
+    hold for the process as a whole rather than per client.  The governor
+    is rebuilt only when `limits` change.
+    """
+    return _get_shared(RequestGovernor, limits or {})
+
+
+def get_response_cache(config=None):
+    """Return the process-wide `ResponseCache` for `config`.
+
+    :param config: Cache settings, see `ResponseCache`.  Caching is off,
+        and None is returned, when `config` is empty or its `enabled` key
+        is false.  With a true `persistent` key, the cache is also kept on
+        disk for the next processes, see `PersistentResponseCache`.
+    """
+    if not config or not config.get('enabled', True):
+        return None
+    if config.get('persistent'):
+        return _get_shared(PersistentResponseCache, config)
+    return _get_shared(ResponseCache, config)
+
+
+def _build_dispatcher(config):
+    endpoints = config.get('endpoints')
+    if isinstance(endpoints, list):
+        endpoints = {'urls': endpoints}
+    if config.get('replay'):
+        dispatcher = ReplayDispatcher(
+            config['replay'], latency_scale=config.get('latency_scale'))
+    elif endpoints:
+        dispatcher = EndpointPool(
+            MAASDispatcher(), endpoints['urls'],
+            strategy=endpoints.get('strategy', 'round_robin'),
+            eject_for=endpoints.get('eject_for', 30))
+    else:
+        dispatcher = MAASDispatcher()
+    if config.get('record') and not config.get('replay'):
+        dispatcher = RecordingDispatcher(config['record'], dispatcher)
+    dispatcher = InstrumentedDispatcher(dispatcher, hooks=[_request_stats])
+    dispatcher.config = config
+    return dispatcher
+
+
+def get_dispatcher(config=None, endpoints=None):
+    """Return the process-wide dispatcher for `config`.
+
+    :param config: Optional dict.  With `record`, a cassette path, requests
+        go to the region and are recorded into the cassette.  With `replay`,
+        a cassette path, responses are served from the cassette, delayed by
+        the recorded latencies times `latency_scale` if it is given.  A
+        plain `MAASDispatcher` is used otherwise.  In all cases requests
+        are counted by the process-wide `RequestStats`.
+    :param endpoints: Optional list of region API URLs, or dict with
+        `urls`, `strategy` and `eject_for`: requests are spread over them
+        by an `EndpointPool` instead of going to the client's URL.
+    """
+    config = dict(config or {})
+    if endpoints:
+        config['endpoints'] = endpoints
+    return _get_shared(_build_dispatcher, config)
+
+
 class MAASClient:
     """Base class for connecting to MAAS servers.
 
@@ -134,7 +1247,8 @@ class MAASClient:
     is equivalent to `"nodes/%s" % node_id`.
     """
 
-    def __init__(self, auth, dispatcher, base_url):
+    def __init__(self, auth, dispatcher, base_url, governor=None,
+                 cache=None):
         """Intialise the client.
 
         :param auth: A `MAASOAuth` to sign requests.
@@ -142,10 +1256,17 @@ class MAASClient:
             base class.
         :param base_url: The base URL for the MAAS server, e.g.
             http://my.maas.com:5240/
+        :param governor: Optional `RequestGovernor` limiting the rate and
+            concurrency of requests.
+        :param cache: Optional `ResponseCache` for GET responses.
         """
         self.dispatcher = dispatcher
         self.auth = auth
         self.url = base_url
+        self.governor = governor
+        self.cache = cache
+        # Number of writes made through this client, per collection.
+        self.writes = Counter()
 
     def _make_url(self, path):
         """Compose an absolute URL to `path`.
@@ -205,6 +1326,51 @@ class MAASClient:
         self.auth.sign_request(url, headers)
         return url, headers, body
 
+    def _dispatch(self, url, method, headers, data=None, op=None):
+        """Send a request through the dispatcher, within governor limits."""
+        if self.governor is None:
+            return self.dispatcher.dispatch_query(
+                url, method=method, headers=headers, data=data)
+        with self.governor.slot(method, op):
+            return self.dispatcher.dispatch_query(
+                url, method=method, headers=headers, data=data)
+
+    def _cache_key(self, url):
+        """Return the `ResponseCache` key for the absolute `url`."""
+        return url[len(self.url.rstrip("/")):]
+
+    def _cached_get(self, url, headers, op=None):
+        """Dispatch a GET through the response cache.
+
+        A fresh cached response is returned without a request; otherwise
+        the request is made conditional on the cached validators, and a
+        304 answer is served from the cache.
+        """
+        key = self._cache_key(url)
+        entry = self.cache.lookup(key)
+        if entry is not None:
+            if self.cache.is_fresh(key, entry):
+                return self.cache.response(entry)
+            headers.update(self.cache.validators(entry))
+        try:
+            res = self._dispatch(url, "GET", headers, op=op)
+        except urllib2.HTTPError as error:
+            if error.code == 304 and entry is not None:
+                self.cache.touch(key)
+                return self.cache.response(entry)
+            raise
+        body = res.read()
+        self.cache.store(key, res, body)
+        return urllib2.addinfourl(
+            BytesIO(body), res.info(), res.geturl(), res.code)
+
+    def _invalidate(self, url):
+        """Drop cached responses made stale by a write to `url`."""
+        key = self._cache_key(url)
+        self.writes[ResponseCache.collection(key)] += 1
+        if self.cache is not None:
+            self.cache.invalidate(key)
+
     def get(self, path, op=None, **kwargs):
         """Dispatch a GET.
 
@@ -215,8 +1381,9 @@ class MAASClient:
         if op is not None:
             kwargs['op'] = op
         url, headers = self._formulate_get(path, kwargs)
-        return self.dispatcher.dispatch_query(
-            url, method="GET", headers=headers)
+        if self.cache is not None:
+            return self._cached_get(url, headers, op=op)
+        return self._dispatch(url, "GET", headers, op=op)
 
     def post(self, path, op, as_json=False, **kwargs):
         """Dispatch POST method `op` on `path`, with the given parameters.
@@ -229,17 +1396,121 @@ class MAASClient:
             kwargs['op'] = op
         url, headers, body = self._formulate_change(
             path, kwargs, as_json=as_json)
-        return self.dispatcher.dispatch_query(
-            url, method="POST", headers=headers, data=body)
+        try:
+            return self._dispatch(url, "POST", headers, body, op=op)
+        finally:
+            self._invalidate(url)
 
     def put(self, path, **kwargs):
         """Dispatch a PUT on the resource at `path`."""
         url, headers, body = self._formulate_change(path, kwargs)
-        return self.dispatcher.dispatch_query(
-            url, method="PUT", headers=headers, data=body)
+        try:
+            return self._dispatch(url, "PUT", headers, body)
+        finally:
+            self._invalidate(url)
 
     def delete(self, path):
         """Dispatch a DELETE on the resource at `path`."""
         url, headers, body = self._formulate_change(path, {})
-        return self.dispatcher.dispatch_query(
-            url, method="DELETE", headers=headers, data=body)
+        try:
+            return self._dispatch(url, "DELETE", headers, body)
+        finally:
+            self._invalidate(url)
+
+    def read_only(self):
+        """Return a copy of this client that can never write.
+
+        The copy shares the governor and response cache; its dispatcher is
+        a `ReadOnlyDispatcher` raising `WriteBlocked` on writes.
+        """
+        client = copy.copy(self)
+        client.dispatcher = ReadOnlyDispatcher(self.dispatcher)
+        client.writes = Counter()
+        return client
+
+
+class ClientRegistry:
+    """Process-wide registry of `MAASClient` instances.
+
+    Clients are keyed by API URL, credentials file, governor, cache and
+    dispatcher.  A client, with its OAuth tokens, is built once and then
+    reused for as long as the modification time of the credentials file
+    stays the same, so the file is read again only after it has been
+    rewritten.  A shared client is never reconfigured: callers asking for
+    other settings get a client of their own.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _read_credentials(self, credentials_file):
+        """Read the credentials tuple from the last line of the file."""
+        with open(credentials_file) as fd:
+            creds_string = fd.read().splitlines()[-1].strip()
+        return convert_string_to_tuple(creds_string)
+
+    def get_client(self, api_url, credentials_file, governor=None,
+                   cache=None, dispatcher=None):
+        """Return the shared client for `api_url`.
+
+        :param api_url: The base URL for the MAAS server.
+        :param credentials_file: Path to a file holding the API key as its
+            last line, in the colon-separated format.
+        :param governor: Optional `RequestGovernor` for the client.
+        :param cache: Optional `ResponseCache` for the client.
+        :param dispatcher: Optional dispatcher replacing the client's own
+            `MAASDispatcher`.
+        """
+        mtime = os.stat(credentials_file).st_mtime
+        # Settings are compared by identity: the process-wide ones are
+        # shared objects, rebuilt only when their configuration changes.
+        key = (api_url, credentials_file, governor, cache, dispatcher)
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is None or entry[0] != mtime:
+                auth = MAASOAuth(*self._read_credentials(credentials_file))
+                client = MAASClient(
+                    auth, dispatcher or MAASDispatcher(), api_url,
+                    governor=governor, cache=cache)
+                entry = self._clients[key] = (mtime, client)
+            return entry[1]
+
+
+_registry = ClientRegistry()
+
+
+def get_client(api_url, credentials_file, governor=None, cache=None,
+               dispatcher=None):
+    """Return the process-wide client for `api_url`.
+
+    See `ClientRegistry.get_client`.
+    """
+    return _registry.get_client(
+        api_url, credentials_file, governor=governor, cache=cache,
+        dispatcher=dispatcher)
+
+
+def run_concurrently(function, items, concurrency):
+    """Call `function` on every item of `items` from `concurrency` threads.
+
+    Clients are thread-safe and share the process-wide governor, which
+    still bounds the number of requests actually in flight.
+
+    :return: A list with one `(result, exception)` tuple per item, in the
+        order of `items`; `exception` is None when `function` succeeded.
+    """
+    def call(item):
+        try:
+            return function(item), None
+        except Exception as error:
+            return None, error
+
+    items = list(items)
+    if concurrency <= 1 or len(items) <= 1:
+        return [call(item) for item in items]
+    pool = ThreadPool(min(concurrency, len(items)))
+    try:
+        return pool.map(call, items)
+    finally:
+        pool.close()
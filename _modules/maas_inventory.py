@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+'''
+Compact, indexed snapshot of the MAAS machines.
+
+The machine listing returned by the region carries every interface, block
+device and tag of every machine.  The inventory keeps only the fields the
+formula uses, in ``__slots__`` records sharing their repeated strings, and
+indexes them by hostname, system_id and MAC address.  One inventory is
+shared by every module of the salt process and rebuilt only when it got
+too old or when machines were written through the same client.
+
+Refreshing an inventory does not list the machines again: the events
+logged by the region since the last refresh name the nodes that changed,
+and only those are fetched again.
+'''
+
+from __future__ import absolute_import
+
+import collections
+import logging
+import threading
+import time
+import urllib2
+
+import json_codec
+from maas_client import run_concurrently
+
+LOG = logging.getLogger(__name__)
+
+__all__ = [
+    'Inventory',
+    'MacIndex',
+    'MachineRecord',
+    'get_inventory',
+    'get_mac_index',
+    'invalidate_inventory',
+]
+
+# Seconds an inventory is reused for, unless machines are written.
+DEFAULT_MAX_AGE = 60
+
+# Seconds after which a refresh lists every machine again rather than
+# following the events.
+DEFAULT_FULL_EVERY = 600
+
+# Collections whose writes make the inventory stale.
+MACHINE_COLLECTIONS = ('machines', 'nodes')
+
+EVENTS_URL = u'api/2.0/events/'
+
+# Most events followed per refresh: past that many changes listing the
+# machines is cheaper.
+EVENTS_LIMIT = 1000
+
+# Most nodes fetched one by one per refresh, and concurrently.
+DELTA_MAX_NODES = 100
+DELTA_CONCURRENCY = 8
+
+_strings = {}
+
+
+def _intern(value):
+    '''
+    Return the shared copy of ``value``; the builtin intern() does not
+    accept unicode strings.
+    '''
+    if value is None:
+        return None
+    return _strings.setdefault(value, value)
+
+
+def _name(value):
+    '''
+    Return the name of a ``{'name': ...}`` reference or the value itself.
+    '''
+    if isinstance(value, dict):
+        value = value.get('name')
+    return _intern(value)
+
+
+class MachineRecord(object):
+    '''
+    The fields of a MAAS machine used by the formula.
+    '''
+
+    __slots__ = ('hostname', 'system_id', 'fqdn', 'status', 'status_name',
+                 'power_type', 'power_state', 'architecture', 'osystem',
+                 'distro_series', 'zone', 'pool', 'domain', 'owner',
+                 'boot_mac', 'boot_rack', 'macs', 'ip_addresses',
+                 'tag_names')
+
+    def __init__(self, machine):
+        self.hostname = machine['hostname']
+        self.system_id = machine['system_id']
+        self.fqdn = machine.get('fqdn')
+        self.status = machine.get('status')
+        self.status_name = _intern(machine.get('status_name'))
+        self.power_type = _intern(machine.get('power_type'))
+        self.power_state = _intern(machine.get('power_state'))
+        self.architecture = _intern(machine.get('architecture'))
+        self.osystem = _intern(machine.get('osystem'))
+        self.distro_series = _intern(machine.get('distro_series'))
+        self.zone = _name(machine.get('zone'))
+        self.pool = _name(machine.get('pool'))
+        self.domain = _name(machine.get('domain'))
+        self.owner = _intern(machine.get('owner'))
+        boot_interface = machine.get('boot_interface') or {}
+        self.boot_mac = boot_interface.get('mac_address')
+        # Rack controller serving the VLAN the machine boots from.
+        self.boot_rack = _intern(
+            (boot_interface.get('vlan') or {}).get('primary_rack'))
+        self.macs = tuple(interface['mac_address']
+                          for interface in machine.get('interface_set') or []
+                          if interface.get('mac_address'))
+        self.ip_addresses = tuple(machine.get('ip_addresses') or ())
+        self.tag_names = tuple(_intern(tag)
+                               for tag in machine.get('tag_names') or ())
+
+    def as_dict(self):
+        '''
+        Return the record as a plain dict, e.g. to be returned by salt.
+        '''
+        return dict((name, list(value) if isinstance(value, tuple) else value)
+                    for name, value in
+                    ((name, getattr(self, name)) for name in self.__slots__))
+
+    def __repr__(self):
+        return '<MachineRecord {0} {1} {2}>'.format(
+            self.hostname, self.system_id, self.status_name)
+
+
+class Inventory(object):
+    '''
+    Machine records indexed by hostname, system_id and MAC address.
+    '''
+
+    def __init__(self, machines, cursor=None):
+        '''
+        :param machines: Machines as listed by ``api/2.0/machines/``.
+        :param cursor: Id of the last event logged before the listing.
+        '''
+        self.created_at = self.updated_at = time.time()
+        self.cursor = cursor
+        self.records = []
+        self.by_hostname = {}
+        self.by_system_id = {}
+        self.by_mac = {}
+        for machine in machines:
+            self.add(MachineRecord(machine))
+
+    def copy(self):
+        '''
+        Return a copy sharing the records, to be updated while this one is
+        still read by other threads.
+        '''
+        inventory = Inventory(())
+        inventory.created_at = self.created_at
+        inventory.cursor = self.cursor
+        inventory.records = list(self.records)
+        inventory.by_hostname = dict(self.by_hostname)
+        inventory.by_system_id = dict(self.by_system_id)
+        inventory.by_mac = dict(self.by_mac)
+        return inventory
+
+    def add(self, record):
+        '''
+        Index ``record``, replacing a record with the same system_id.
+        '''
+        previous = self.by_system_id.get(record.system_id)
+        if previous is not None:
+            self.remove(previous)
+        self.records.append(record)
+        self.by_hostname[record.hostname] = record
+        self.by_system_id[record.system_id] = record
+        for mac in record.macs:
+            self.by_mac[mac.lower()] = record
+
+    def remove(self, record):
+        '''
+        Drop ``record`` from the inventory and its indexes.
+        '''
+        self.records.remove(record)
+        self.by_hostname.pop(record.hostname, None)
+        self.by_system_id.pop(record.system_id, None)
+        for mac in record.macs:
+            if self.by_mac.get(mac.lower()) is record:
+                del self.by_mac[mac.lower()]
+
+    def get(self, hostname):
+        return self.by_hostname.get(hostname)
+
+    def get_by_system_id(self, system_id):
+        return self.by_system_id.get(system_id)
+
+    def get_by_mac(self, mac):
+        return self.by_mac.get(mac.lower())
+
+    def filter(self, status_names=None, hostnames=None):
+        '''
+        Return the records in any of ``status_names`` and ``hostnames``.
+        '''
+        return [record for record in self.records
+                if (not status_names or record.status_name in status_names)
+                and (not hostnames or record.hostname in hostnames)]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+
+_inventory = {}
+_inventory_lock = threading.Lock()
+
+
+def _writes(maas):
+    return sum(maas.writes[name] for name in MACHINE_COLLECTIONS)
+
+
+def _query_events(maas, **params):
+    return json_codec.loads(maas.get(
+        EVENTS_URL, 'query', level='DEBUG', **params).read())['events']
+
+
+def _last_event_id(maas):
+    '''
+    Return the id of the last event logged by the region, or None when the
+    events cannot be read.
+    '''
+    try:
+        events = _query_events(maas, limit='1')
+    except Exception as e:
+        LOG.debug('MAAS events unavailable: {0}'.format(e))
+        return None
+    return max([event['id'] for event in events] or [0])
+
+
+def _changed_nodes(maas, cursor):
+    '''
+    Return the system_ids of the nodes with events after ``cursor`` and the
+    id of the last of those events, or None instead of the system_ids when
+    there are too many events to follow.
+    '''
+    events = _query_events(maas, after=str(cursor), limit=str(EVENTS_LIMIT))
+    if len(events) >= EVENTS_LIMIT:
+        return None, cursor
+    changed = set()
+    for event in events:
+        cursor = max(cursor, event['id'])
+        if event.get('node'):
+            changed.add(event['node'])
+    return changed, cursor
+
+
+def _fetch_machine(maas, system_id):
+    '''
+    Return the machine ``system_id``, or None if it is gone or is not a
+    machine.
+    '''
+    try:
+        return json_codec.loads(maas.get(
+            u'api/2.0/machines/{0}/'.format(system_id)).read())
+    except urllib2.HTTPError as e:
+        if e.code == 404:
+            return None
+        raise
+
+
+def _refresh(maas, inventory):
+    '''
+    Return ``inventory`` updated with the nodes changed since its cursor,
+    or None when the machines have to be listed again.
+    '''
+    if inventory.cursor is None:
+        return None
+    try:
+        changed, cursor = _changed_nodes(maas, inventory.cursor)
+    except Exception as e:
+        LOG.debug('MAAS events unavailable: {0}'.format(e))
+        return None
+    if changed is None or len(changed) > DELTA_MAX_NODES:
+        return None
+    changed = sorted(changed)
+    fetched = run_concurrently(lambda system_id: _fetch_machine(
+        maas, system_id), changed, DELTA_CONCURRENCY)
+    inventory = inventory.copy()
+    for system_id, (machine, error) in zip(changed, fetched):
+        if error is not None:
+            LOG.debug('MAAS machine {0} not refreshed: {1}'.format(
+                system_id, error))
+            return None
+        if machine is not None:
+            inventory.add(MachineRecord(machine))
+        elif system_id in inventory.by_system_id:
+            inventory.remove(inventory.by_system_id[system_id])
+    inventory.cursor = cursor
+    LOG.debug('MAAS inventory refreshed: {0} nodes changed'.format(
+        len(changed)))
+    return inventory
+
+
+def get_inventory(maas, refresh=False, max_age=DEFAULT_MAX_AGE,
+                  full_every=DEFAULT_FULL_EVERY):
+    '''
+    Return the process-wide ``Inventory`` of the region behind ``maas``.
+
+    :param maas: ``MAASClient`` used to list the machines.
+    :param refresh: Always bring the inventory up to date, e.g. while
+                    waiting for the status of machines to change.  Only the
+                    machines named by the events logged since the last
+                    refresh are fetched again.
+    :param max_age: Seconds an inventory is reused for.
+    :param full_every: Seconds after which every machine is listed again.
+    '''
+    with _inventory_lock:
+        cached = _inventory.get(maas.url)
+        if cached is not None:
+            client, writes, inventory = cached
+            current = client is maas and writes == _writes(maas)
+            if current and not refresh and \
+                    time.time() - inventory.updated_at < max_age:
+                return inventory
+            if current and time.time() - inventory.created_at < full_every:
+                inventory = _refresh(maas, inventory)
+                if inventory is not None:
+                    _inventory[maas.url] = (maas, writes, inventory)
+                    return inventory
+        writes = _writes(maas)
+        cursor = _last_event_id(maas)
+        inventory = Inventory(json_codec.loads(
+            maas.get(u'api/2.0/machines/').read()), cursor=cursor)
+        LOG.debug('MAAS inventory of {0} machines built'.format(
+            len(inventory)))
+        _inventory[maas.url] = (maas, writes, inventory)
+        return inventory
+
+
+def invalidate_inventory():
+    '''
+    Forget every inventory, e.g. after machines changed outside the client.
+    '''
+    with _inventory_lock:
+        _inventory.clear()
+
+
+# Owner of a MAC address: node kind ('machine' or 'device'), hostname,
+# system_id and id of the interface carrying it.
+MacEntry = collections.namedtuple(
+    'MacEntry', ('kind', 'hostname', 'system_id', 'nic_id'))
+
+
+class MacIndex(object):
+    '''
+    MAC address to owning node and interface, across machines and devices.
+    '''
+
+    def __init__(self, machines=(), devices=()):
+        '''
+        :param machines: Machines as listed by ``api/2.0/machines/``.
+        :param devices: Devices as listed by ``api/2.0/devices/``.
+        '''
+        self.by_mac = {}
+        self.by_system_id = {}
+        for machine in machines:
+            self.add_node('machine', machine)
+        for device in devices:
+            self.add_node('device', device)
+
+    def add_node(self, kind, node):
+        '''
+        Index the interfaces of ``node``, e.g. after it has been created.
+        '''
+        self.remove_node(node['system_id'])
+        macs = set()
+        for nic in node.get('interface_set') or []:
+            if not nic.get('mac_address'):
+                continue
+            mac = nic['mac_address'].lower()
+            macs.add(mac)
+            self.by_mac[mac] = MacEntry(kind, node['hostname'],
+                                        node['system_id'], nic['id'])
+        self.by_system_id[node['system_id']] = macs
+
+    def remove_node(self, system_id):
+        '''
+        Forget the interfaces of the node ``system_id``, e.g. once deleted.
+        '''
+        for mac in self.by_system_id.pop(system_id, ()):
+            # A MAC shared with a node removed earlier is already gone.
+            entry = self.by_mac.get(mac)
+            if entry is not None and entry.system_id == system_id:
+                del self.by_mac[mac]
+
+    def get(self, mac):
+        return self.by_mac.get(mac.lower())
+
+    def macs(self, system_id):
+        '''
+        Return the lower-cased MAC addresses of the node ``system_id``.
+        '''
+        return self.by_system_id.get(system_id, set())
+
+    def nic_id(self, system_id, mac):
+        '''
+        Return the id of the interface of ``system_id`` with ``mac``, or None.
+        '''
+        entry = self.get(mac)
+        if entry is None or entry.system_id != system_id:
+            return None
+        return entry.nic_id
+
+    def conflicts(self, hostname, macs):
+        '''
+        Return ``{mac: MacEntry}`` for the ``macs`` owned by another node
+        than ``hostname``.
+        '''
+        result = {}
+        for mac in macs:
+            entry = self.get(mac)
+            if entry is not None and entry.hostname != hostname:
+                result[mac] = entry
+        return result
+
+
+def get_mac_index(maas):
+    '''
+    Build a ``MacIndex`` of the machines and devices behind ``maas``.
+
+    The index is not shared: callers keep it up to date with their own
+    writes through ``add_node`` and ``remove_node``.
+    '''
+    machines = json_codec.loads(maas.get(u'api/2.0/machines/').read())
+    devices = json_codec.loads(maas.get(u'api/2.0/devices/').read())
+    return MacIndex(machines, devices)
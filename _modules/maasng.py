@@ -19,6 +19,9 @@ import hashlib
 import io
 import json
 import logging
+import os
+import socket
+import threading
 import time
 import urllib2
 # Salt utils
@@ -42,7 +45,11 @@ RAID = {
 # Import third party libs
 HAS_MASS = False
 try:
-    from maas_client import MAASClient, MAASDispatcher, MAASOAuth
+    import json_codec
+    from maas_client import get_client, get_dispatcher, get_governor, \
+        get_request_stats, get_response_cache, request_timeout, \
+        run_concurrently
+    from maas_inventory import get_inventory
     HAS_MASS = True
 except ImportError:
     LOG.debug('Missing MaaS client module is Missing. Skipping')
@@ -73,14 +80,17 @@ def _create_maas_client(api_url=None):
     if not api_url:
         api_url = 'http://localhost:5240/MAAS'
     global APIKEY_FILE
+    options = __salt__['config.get']('maas:region:api', {})
+    governor = get_governor(options.get('limits'))
+    cache = get_response_cache(options.get('cache'))
+    dispatcher = get_dispatcher(options.get('cassette'),
+                                endpoints=options.get('endpoints'))
     try:
-        api_token = file(APIKEY_FILE).read().splitlines()[-1].strip()\
-            .split(':')
+        return get_client(api_url, APIKEY_FILE, governor=governor,
+                          cache=cache, dispatcher=dispatcher)
     except:
         LOG.exception('token')
-    auth = MAASOAuth(*api_token)
-    dispatcher = MAASDispatcher()
-    return MAASClient(auth, dispatcher, api_url)
+        raise
 
 
 def _get_blockdevice_id_by_name(hostname, device):
@@ -112,44 +122,64 @@ def _get_partition_id_by_name(hostname, device, partition):
 # MACHINE SECTION
 
 
-def get_machine(hostname):
+def get_machine(hostname, compact=False):
     """
     Get information aboout specified machine
 
+    The machine is looked up in the shared machine inventory; pass
+    ``compact=True`` to get only the fields it keeps instead of the
+    complete MAAS machine object.
+
     CLI Example:
 
     .. code-block:: bash
 
         salt-call maasng.get_machine server_hostname
+        salt-call maasng.get_machine server_hostname compact=True
 
     Error codes:
         0 : Machine not found
     """
-    try:
-        return list_machines()[hostname]
-    except KeyError:
+    maas = _create_maas_client()
+    machine = get_inventory(maas).get(hostname)
+    if machine is None:
         return {"error":
                        { 0: "Machine not found" }
                }
+    if compact:
+        return machine.as_dict()
+    return json_codec.loads(maas.get(
+        u'api/2.0/machines/{0}/'.format(machine.system_id)).read())
 
 
-def list_machines(status_filter=None):
+def list_machines(status_filter=None, compact=False, refresh=False):
     """
     Get list of all machines from maas server
 
+    Pass ``compact=True`` to get only the fields kept by the shared machine
+    inventory (hostname, system_id, status_name, power, MACs, ...) instead
+    of the complete MAAS machine objects; the inventory is kept up to date
+    from the region events, ``refresh=True`` polls them first.
+
     CLI Example:
 
     .. code-block:: bash
 
         salt 'maas-node' maasng.list_machines
         salt 'maas-node' maasng.list_machines status_filter=[Deployed,Ready]
+        salt 'maas-node' maasng.list_machines compact=True
     """
     machines = {}
     maas = _create_maas_client()
-    json_res = json.loads(maas.get(u'api/2.0/machines/').read())
-    for item in json_res:
-        if not status_filter or item['status_name'] in status_filter:
-            machines[item["hostname"]] = item
+    if not compact:
+        json_res = json_codec.loads(maas.get(u'api/2.0/machines/').read())
+        for item in json_res:
+            if not status_filter or item['status_name'] in status_filter:
+                machines[item["hostname"]] = item
+        return machines
+    inventory = get_inventory(maas, refresh=refresh)
+    for machine in inventory.filter(status_names=status_filter):
+        machines[machine.hostname] = machine.as_dict()
     return machines
 
 
@@ -177,7 +207,7 @@ def delete_machine(hostname):
     """
     result = {}
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     LOG.debug('delete_machine: {}'.format(system_id))
     maas.delete(
         u"api/2.0/machines/{0}/".format(system_id)).read()
@@ -201,19 +231,293 @@ def action_machine(hostname, action, comment=None):
     result = {}
     data = {}
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     LOG.debug('action_machine: {}'.format(system_id))
 
     # TODO validation
     if comment:
         data["comment"] = comment
-    json_res = json.loads(maas.post(
+    json_res = json_codec.loads(maas.post(
         u"api/2.0/machines/{0}/".format(system_id), action, **data).read())
     LOG.info(json_res)
     result["new"] = "Machine {0} action {1} executed".format(hostname, action)
 
     return result
 
+
+# Machines acted on at the same time by action_machines and
+# delete_machines; the API limits still apply.
+BULK_CONCURRENCY = 16
+
+
+def _select_machines(maas, hostnames=None, selector=None, default_all=False):
+    """
+    Resolve ``hostnames`` and ``selector`` to machine records with a single
+    inventory refresh.
+
+    :param hostnames:   List or comma separated string of hostnames.
+    :param selector:    Dict of record fields (status_name, zone, pool,
+                        power_type, tag_names, ...) to a value or a list of
+                        values; list fields like tag_names match if they
+                        contain the value.
+    :param default_all: Select every machine when neither is given,
+                        instead of failing.
+    :return: The matching records, and the hostnames not found.
+    """
+    if isinstance(hostnames, basestring):
+        hostnames = hostnames.split(',')
+    hostnames = set(hostname.strip() for hostname in hostnames or ()
+                    if hostname.strip())
+    if not hostnames and not selector and not default_all:
+        raise SaltInvocationError('hostnames or selector is required')
+    inventory = get_inventory(maas, refresh=True)
+    records = inventory.filter(hostnames=hostnames)
+    missing = sorted(hostnames -
+                     set(record.hostname for record in records))
+    for field, wanted in (selector or {}).items():
+        if not isinstance(wanted, list):
+            wanted = [wanted]
+
+        def matches(record):
+            value = getattr(record, field, None)
+            if isinstance(value, tuple):
+                return any(item in value for item in wanted)
+            return value in wanted
+        records = [record for record in records if matches(record)]
+    return records, missing
+
+
+def _bulk(maas, records, missing, function, concurrency):
+    """
+    Call ``function(record)`` for every record from ``concurrency`` threads
+    and return the per-host results.
+    """
+    machines = dict((hostname, {'result': False,
+                                'comment': 'Machine not found'})
+                    for hostname in missing)
+    for record, (comment, error) in zip(records, run_concurrently(
+            function, records, concurrency)):
+        if isinstance(error, urllib2.HTTPError):
+            error = error.read()
+        machines[record.hostname] = {
+            'system_id': record.system_id,
+            'result': error is None,
+            'comment': comment if error is None else str(error),
+        }
+    failed = sorted(hostname for hostname, ret in machines.items()
+                    if not ret['result'])
+    return {
+        'result': not failed,
+        'comment': '{0} machines done, {1} failed{2}'.format(
+            len(machines) - len(failed), len(failed),
+            ': ' + ', '.join(failed) if failed else ''),
+        'machines': machines,
+    }
+
+
+def action_machines(hostnames=None, action=None, comment=None,
+                    concurrency=BULK_CONCURRENCY, selector=None):
+    """
+    Send a simple action (e.g. mark_broken, release, commission, power_on,
+    abort) to many machines at once.
+
+    Every machine is resolved from one inventory refresh and the actions
+    are sent concurrently.
+
+    :param hostnames:   List or comma separated string of hostnames.
+    :param action:      Action to send (one of MaaS' op codes).
+    :param comment:     Optional comment for the event log.
+    :param concurrency: Number of actions sent at the same time.
+    :param selector:    Select machines by field instead of, or on top of,
+                        hostnames, e.g. {status_name: Failed deployment}.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-call maasng.action_machines kvm01,kvm02 mark_broken comment='dead'
+        salt-call maasng.action_machines action=release selector='{status_name: Failed deployment, zone: az1}'
+    """
+    if not action:
+        raise SaltInvocationError('action is required')
+    maas = _create_maas_client()
+    records, missing = _select_machines(maas, hostnames, selector)
+    data = {}
+    if comment:
+        data["comment"] = comment
+
+    def act(record):
+        LOG.debug('action_machines: {0} {1}'.format(action,
+                                                    record.system_id))
+        maas.post(u"api/2.0/machines/{0}/".format(record.system_id),
+                  action, **data).read()
+        return "Machine {0} action {1} executed".format(record.hostname,
+                                                       action)
+    return _bulk(maas, records, missing, act, int(concurrency))
+
+
+def delete_machines(hostnames=None, concurrency=BULK_CONCURRENCY,
+                    selector=None):
+    """
+    Delete many machines at once.
+
+    :param hostnames:   List or comma separated string of hostnames.
+    :param concurrency: Number of machines deleted at the same time.
+    :param selector:    Select machines by field, see action_machines.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-call maasng.delete_machines kvm01,kvm02
+        salt-call maasng.delete_machines selector='{status_name: New}'
+    """
+    maas = _create_maas_client()
+    records, missing = _select_machines(maas, hostnames, selector)
+
+    def delete(record):
+        LOG.debug('delete_machines: {0}'.format(record.system_id))
+        maas.delete(u"api/2.0/machines/{0}/".format(record.system_id)).read()
+        return "Machine {0} deleted".format(record.hostname)
+    return _bulk(maas, records, missing, delete, int(concurrency))
+
+# Power states queried by power_audit: system_id to (checked_at, state).
+POWER_STATES_FILE = '/var/cache/salt/minion/maas/power_states.json'
+
+
+def _load_power_states(path):
+    try:
+        with open(path) as fd:
+            return json.load(fd)
+    except (IOError, ValueError):
+        return {}
+
+
+def _save_power_states(path, states):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'w') as fd:
+        json.dump(states, fd)
+    os.rename(temp_path, path)
+
+
+def power_audit(hostnames=None, selector=None, concurrency=32,
+                rack_concurrency=8, timeout=30, cache_ttl=60,
+                refresh=False, path=POWER_STATES_FILE):
+    """
+    Query the power state of many machines through their BMCs at once.
+
+    Queries run concurrently, at most ``rack_concurrency`` at a time per
+    rack controller serving the machine, and each gives up after
+    ``timeout`` seconds. Machines with no known rack are not capped per
+    rack. States younger than ``cache_ttl`` seconds are reused from
+    ``path`` unless ``refresh`` is set.
+
+    Queries are in the ``bmc`` class of the request limits
+    (maas:region:api:limits:bmc), apart from reads: the queries in flight
+    are the lowest of ``concurrency`` and the ``bmc`` concurrency limit.
+
+    :param hostnames:        List or comma separated string of hostnames;
+                             every machine by default.
+    :param selector:         Select machines by field, see action_machines.
+    :param concurrency:      Number of queries in flight, within the
+                             ``bmc`` concurrency limit.
+    :param rack_concurrency: Number of queries in flight per rack.
+    :param timeout:          Seconds to wait for one BMC.
+    :param cache_ttl:        Seconds a queried state is reused for.
+    :param refresh:          Query every machine again.
+    :param path:             File keeping the states between runs.
+    :return: Power state per machine and on/off/unknown/error counts per
+             power_type.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-call maasng.power_audit
+        salt-call maasng.power_audit selector='{status_name: Ready}' timeout=10
+    """
+    started_at = time.time()
+    maas = _create_maas_client()
+    records, missing = _select_machines(maas, hostnames, selector,
+                                        default_all=True)
+    states = _load_power_states(path) if path else {}
+    racks = collections.defaultdict(
+        lambda: threading.BoundedSemaphore(int(rack_concurrency)))
+    racks_lock = threading.Lock()
+
+    def query(record):
+        # Without a known rack, a shared key would make unrelated machines
+        # wait on each other: key them by machine instead.
+        key = record.boot_rack or ('machine', record.system_id)
+        with racks_lock:
+            rack = racks[key]
+        with rack:
+            with request_timeout(float(timeout)):
+                return json_codec.loads(maas.get(
+                    u'api/2.0/machines/{0}/'.format(record.system_id),
+                    'query_power_state').read())['state']
+
+    now = time.time()
+    machines = dict((hostname, {'error': 'Machine not found'})
+                    for hostname in missing)
+    to_query = []
+    for record in records:
+        cached = states.get(record.system_id)
+        if cached and not refresh and now - cached[0] < float(cache_ttl):
+            machines[record.hostname] = {
+                'system_id': record.system_id,
+                'power_type': record.power_type,
+                'rack': record.boot_rack,
+                'state': cached[1],
+                'checked_at': cached[0],
+                'cached': True,
+            }
+        else:
+            to_query.append(record)
+    for record, (state, error) in zip(to_query, run_concurrently(
+            query, to_query, int(concurrency))):
+        result = {
+            'system_id': record.system_id,
+            'power_type': record.power_type,
+            'rack': record.boot_rack,
+            'checked_at': time.time(),
+            'cached': False,
+        }
+        if error is None:
+            result['state'] = state
+            states[record.system_id] = (result['checked_at'], state)
+        else:
+            if isinstance(error, urllib2.HTTPError):
+                error = error.read()
+            elif isinstance(error, socket.timeout):
+                error = 'Timed out after {0}s'.format(timeout)
+            result['state'] = 'error'
+            result['error'] = str(error)
+        machines[record.hostname] = result
+    if path and to_query:
+        _save_power_states(path, dict(
+            (system_id, cached) for system_id, cached in states.items()
+            if now - cached[0] < float(cache_ttl)))
+
+    summary = collections.defaultdict(
+        lambda: dict.fromkeys(('on', 'off', 'unknown', 'error'), 0))
+    for result in machines.values():
+        if 'system_id' not in result:
+            continue
+        state = result['state']
+        if state not in ('on', 'off', 'error'):
+            state = 'unknown'
+        summary[result['power_type']][state] += 1
+    return {
+        'machines': machines,
+        'summary': dict(summary),
+        'queried': len(to_query),
+        'duration': round(time.time() - started_at, 1),
+    }
+
 # END MACHINE SECTION
 # RAID SECTION
 
@@ -263,12 +567,12 @@ def create_raid(hostname, name, level, disks=[], partitions=[], **kwargs):
     }
 
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     LOG.info(system_id)
 
     # TODO validation
     LOG.info(data)
-    json_res = json.loads(
+    json_res = json_codec.loads(
         maas.post(u"api/2.0/nodes/{0}/raids/".format(system_id), None, **data).read())
     LOG.info(json_res)
     result["new"] = "Raid {0} created".format(name)
@@ -289,9 +593,9 @@ def list_raids(hostname):
 
     raids = {}
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     # TODO validation
-    json_res = json.loads(
+    json_res = json_codec.loads(
         maas.get(u"api/2.0/nodes/{0}/raids/".format(system_id)).read())
     LOG.debug('list_raids:{} {}'.format(system_id, json_res))
     for item in json_res:
@@ -330,7 +634,7 @@ def delete_raid(hostname, raid_name):
     """
     result = {}
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     raid_id = _get_raid_id_by_name(hostname, raid_name)
     LOG.debug('delete_raid: {} {}'.format(system_id, raid_id))
     maas.delete(
@@ -357,12 +661,12 @@ def list_blockdevices(hostname):
     ret = {}
 
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     LOG.info(system_id)
 
     # TODO validation if exists
 
-    json_res = json.loads(
+    json_res = json_codec.loads(
         maas.get(u"api/2.0/nodes/{0}/blockdevices/".format(system_id)).read())
     LOG.info(json_res)
     for item in json_res:
@@ -402,13 +706,13 @@ def list_partitions(hostname, device):
     """
     ret = {}
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     LOG.info(system_id)
 
     partitions = get_blockdevice(hostname, device)["partitions"]
     LOG.info(partitions)
 
-    #json_res = json.loads(maas.get(u"api/2.0/nodes/{0}/blockdevices/{1}/partitions/".format(system_id, device_id)).read())
+    #json_res = json_codec.loads(maas.get(u"api/2.0/nodes/{0}/blockdevices/{1}/partitions/".format(system_id, device_id)).read())
     # LOG.info(json_res)
 
     if len(device) > 0:
@@ -450,7 +754,7 @@ def create_partition(hostname, disk, size, fs_type=None, mount=None):
     # TODO validation
     result = {}
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     LOG.info(system_id)
 
     device_id = _get_blockdevice_id_by_name(hostname, disk)
@@ -465,7 +769,7 @@ def create_partition(hostname, disk, size, fs_type=None, mount=None):
     }
 
     # TODO validation
-    partition = json.loads(maas.post(
+    partition = json_codec.loads(maas.post(
         u"api/2.0/nodes/{0}/blockdevices/{1}/partitions/".format(system_id, device_id), None, **data).read())
     LOG.info(partition)
     result["partition"] = "Partition created on {0}".format(disk)
@@ -477,7 +781,7 @@ def create_partition(hostname, disk, size, fs_type=None, mount=None):
         partition_id = str(partition["id"])
         LOG.info("Partition id: " + partition_id)
         # TODO validation
-        json_res = json.loads(maas.post(u"api/2.0/nodes/{0}/blockdevices/{1}/partition/{2}".format(
+        json_res = json_codec.loads(maas.post(u"api/2.0/nodes/{0}/blockdevices/{1}/partition/{2}".format(
             system_id, device_id, partition_id), "format", **data_fs_type).read())
         LOG.info(json_res)
         result["filesystem"] = "Filesystem {0} created".format(fs_type)
@@ -488,7 +792,7 @@ def create_partition(hostname, disk, size, fs_type=None, mount=None):
         }
 
         # TODO validation
-        json_res = json.loads(maas.post(u"api/2.0/nodes/{0}/blockdevices/{1}/partition/{2}".format(
+        json_res = json_codec.loads(maas.post(u"api/2.0/nodes/{0}/blockdevices/{1}/partition/{2}".format(
             system_id, device_id, str(partition['id'])), "mount", **data).read())
         LOG.info(json_res)
         result["mount"] = "Mount point {0} created".format(mount)
@@ -512,7 +816,7 @@ def delete_partition(hostname, disk, partition_name):
     result = {}
     data = {}
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     LOG.info(system_id)
 
     device_id = _get_blockdevice_id_by_name(hostname, disk)
@@ -542,7 +846,7 @@ def delete_partition_by_id(hostname, disk, partition_id):
     result = {}
     data = {}
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     LOG.info(system_id)
 
     device_id = _get_blockdevice_id_by_name(hostname, disk)
@@ -606,7 +910,7 @@ def update_disk_layout(hostname, layout, root_size=None, root_device=None, volum
     }
 
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     LOG.info(system_id)
 
     if layout == 'custom':
@@ -640,7 +944,7 @@ def update_disk_layout(hostname, layout, root_size=None, root_device=None, volum
             data["lv_size"] = vol_size
 
     # TODO validation
-    json_res = json.loads(maas.post(
+    json_res = json_codec.loads(maas.post(
         u"api/2.0/machines/{0}/".format(system_id), "set_storage_layout", **data).read())
     LOG.info(json_res)
     result["new"] = {
@@ -667,12 +971,12 @@ def list_volume_groups(hostname):
     volume_groups = {}
 
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     LOG.info(system_id)
 
     # TODO validation if exists
 
-    json_res = json.loads(
+    json_res = json_codec.loads(
         maas.get(u"api/2.0/nodes/{0}/volume-groups/".format(system_id)).read())
     LOG.info(json_res)
     for item in json_res:
@@ -714,7 +1018,7 @@ def create_volume_group(hostname, volume_group_name, disks=[], partitions=[]):
     }
 
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     LOG.info(system_id)
 
     disk_ids = []
@@ -747,7 +1051,7 @@ def create_volume_group(hostname, volume_group_name, disks=[], partitions=[]):
     LOG.info(partitions)
 
     # TODO validation
-    json_res = json.loads(maas.post(
+    json_res = json_codec.loads(maas.post(
         u"api/2.0/nodes/{0}/volume-groups/".format(system_id), None, **data).read())
     LOG.info(json_res)
     result["new"] = "Volume group {0} created".format(json_res["name"])
@@ -768,7 +1072,7 @@ def delete_volume_group(hostname, name):
     """
 
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     LOG.debug('delete_volume_group:{}'.format(system_id))
 
     vg_id = str(_get_volume_group_id_by_name(hostname, name))
@@ -776,7 +1080,7 @@ def delete_volume_group(hostname, name):
         delete_volume(hostname, vol, name)
 
     # TODO validation
-    json_res = json.loads(maas.delete(
+    json_res = json_codec.loads(maas.delete(
         u"api/2.0/nodes/{0}/volume-group/{1}/".format(system_id, vg_id)).read() or 'null')
     LOG.info(json_res)
 
@@ -807,7 +1111,7 @@ def create_volume(hostname, volume_name, volume_group, size, fs_type=None,
     data["size"] = bit_size
 
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     LOG.info(system_id)
 
     volume_group_id = str(_get_volume_group_id_by_name(hostname, volume_group))
@@ -815,7 +1119,7 @@ def create_volume(hostname, volume_name, volume_group, size, fs_type=None,
     LOG.info(volume_group_id)
 
     # TODO validation
-    json_res = json.loads(maas.post(u"api/2.0/nodes/{0}/volume-group/{1}/".format(
+    json_res = json_codec.loads(maas.post(u"api/2.0/nodes/{0}/volume-group/{1}/".format(
         system_id, volume_group_id), "create_logical_volume", **data).read())
     LOG.info(json_res)
 
@@ -842,7 +1146,7 @@ def delete_volume(hostname, volume_name, volume_group):
     """
 
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     LOG.debug('delete_volume:{}'.format(system_id))
 
     volume_group_id = str(_get_volume_group_id_by_name(hostname, volume_group))
@@ -857,7 +1161,7 @@ def delete_volume(hostname, volume_name, volume_group):
     }
 
     # TODO validation
-    json_res = json.loads(maas.post(u"api/2.0/nodes/{0}/volume-group/{1}/".format(
+    json_res = json_codec.loads(maas.post(u"api/2.0/nodes/{0}/volume-group/{1}/".format(
         system_id, volume_group_id), "delete_logical_volume", **data).read() or 'null')
     return True
 
@@ -880,21 +1184,21 @@ def get_volumes(hostname, vg_name):
 def create_volume_filesystem(hostname, device, fs_type=None, mount=None):
 
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
 
     blockdevices_id = _get_blockdevice_id_by_name(hostname, device)
     data = {}
     if fs_type != None:
         data["fstype"] = fs_type
         # TODO validation
-        json_res = json.loads(maas.post(u"/api/2.0/nodes/{0}/blockdevices/{1}/".format(
+        json_res = json_codec.loads(maas.post(u"/api/2.0/nodes/{0}/blockdevices/{1}/".format(
             system_id, blockdevices_id), "format", **data).read())
         LOG.info(json_res)
 
     if mount != None:
         data["mount_point"] = mount
         # TODO validation
-        json_res = json.loads(maas.post(u"/api/2.0/nodes/{0}/blockdevices/{1}/".format(
+        json_res = json_codec.loads(maas.post(u"/api/2.0/nodes/{0}/blockdevices/{1}/".format(
             system_id, blockdevices_id), "mount", **data).read())
         LOG.info(json_res)
 
@@ -915,7 +1219,7 @@ def set_boot_disk(hostname, name):
     data = {}
     result = {}
     maas = _create_maas_client()
-    system_id = get_machine(hostname)["system_id"]
+    system_id = get_machine(hostname, compact=True)["system_id"]
     blockdevices_id = _get_blockdevice_id_by_name(hostname, name)
 
     maas.post(u"/api/2.0/nodes/{0}/blockdevices/{1}/".format(
@@ -941,7 +1245,7 @@ def list_fabric():
     """
     fabrics = {}
     maas = _create_maas_client()
-    json_res = json.loads(maas.get(u'api/2.0/fabrics/').read())
+    json_res = json_codec.loads(maas.get(u'api/2.0/fabrics/').read())
     LOG.info(json_res)
     for item in json_res:
         fabrics[item["name"]] = item
@@ -1037,12 +1341,12 @@ def create_fabric(name, description=None, fabric_id=None, update=False):
     json_res = None
     try:
         if update:
-            json_res = json.loads(
+            json_res = json_codec.loads(
                 maas.put(u"api/2.0/fabrics/{0}/".format(fabric_id),
                          **data).read())
             result["new"] = "Fabric  {0} created".format(json_res["name"])
         else:
-            json_res = json.loads(
+            json_res = json_codec.loads(
                 maas.post(u"api/2.0/fabrics/", None, **data).read())
             result["changes"] = "Fabric  {0} updated".format(json_res["name"])
     except Exception as inst:
@@ -1073,7 +1377,7 @@ def list_subnets(sort_by='name'):
     """
     subnets = {}
     maas = _create_maas_client()
-    json_res = json.loads(maas.get(u'api/2.0/subnets/').read())
+    json_res = json_codec.loads(maas.get(u'api/2.0/subnets/').read())
     for item in json_res:
         subnets[item[sort_by]] = item
     return subnets
@@ -1094,7 +1398,7 @@ def list_vlans(fabric, sort_by='vid'):
     fabric_id = get_fabricid(fabric)
 
     try:
-        json_res = json.loads(
+        json_res = json_codec.loads(
             maas.get(u'api/2.0/fabrics/{0}/vlans/'.format(fabric_id)).read())
     except Exception as inst:
         m = inst.readlines()
@@ -1166,13 +1470,13 @@ def create_vlan_in_fabric(name, fabric, vlan, description, primary_rack, mtu=150
             # be passed VID - which mean, API ID for vlan.
             # Otherwise, at least for maas 2.3.3-6498-ge4db91d exactly VLAN
             # should be passed. so, make temp.backward-convertation.
-            # json_res = json.loads(maas.put(u'api/2.0/fabrics/{0}/vlans/{1}/'.format(fabric_id,vlan_id), **data).read())
-            json_res = json.loads(maas.put(
+            # json_res = json_codec.loads(maas.put(u'api/2.0/fabrics/{0}/vlans/{1}/'.format(fabric_id,vlan_id), **data).read())
+            json_res = json_codec.loads(maas.put(
                 u'api/2.0/fabrics/{0}/vlans/{1}/'.format(fabric_id, vlan),
                 **data).read())
         else:
             data['vid'] = str(vlan)
-            json_res = json.loads(maas.post(
+            json_res = json_codec.loads(maas.post(
                 u'api/2.0/fabrics/{0}/vlans/'.format(fabric_id), None, **data).read())
     except Exception as inst:
         LOG.debug("create_vlan_in_fabric data:{}".format(data))
@@ -1236,10 +1540,10 @@ def create_subnet(cidr='', name='', fabric='', gateway_ip='', vlan='',
     data.pop('vlan', '')
     try:
         if update:
-            json_res = json.loads(
+            json_res = json_codec.loads(
                 maas.put(u"api/2.0/subnets/{0}/".format(subnet_id), **data).read())
         else:
-            json_res = json.loads(
+            json_res = json_codec.loads(
                 maas.post(u"api/2.0/subnets/", None, **data).read())
     except Exception as inst:
         LOG.debug("create_subnet data:{}".format(data))
@@ -1304,7 +1608,7 @@ def list_ipranges():
     """
     ipranges = {}
     maas = _create_maas_client()
-    json_res = json.loads(maas.get(u'api/2.0/ipranges/').read())
+    json_res = json_codec.loads(maas.get(u'api/2.0/ipranges/').read())
     for item in json_res:
         ipranges[item["start_ip"]] = item
     return ipranges
@@ -1335,7 +1639,7 @@ def create_iprange(type_range, start_ip, end_ip, subnet=None, comment=None):
     maas = _create_maas_client()
     _name = "Type:{}: {}-{}".format(type_range, start_ip, end_ip)
     try:
-        json_res = json.loads(
+        json_res = json_codec.loads(
             maas.post(u"api/2.0/ipranges/", None, **data).read())
     except Exception as inst:
         try:
@@ -1461,7 +1765,7 @@ def get_boot_source(url=None):
     """
     boot_sources = {}
     maas = _create_maas_client()
-    json_res = json.loads(maas.get(u'api/2.0/boot-sources/').read() or 'null')
+    json_res = json_codec.loads(maas.get(u'api/2.0/boot-sources/').read() or 'null')
     for item in json_res:
         boot_sources[str(item["url"])] = item
     if url:
@@ -1484,7 +1788,7 @@ def delete_boot_source(url, bs_id=None):
     if not bs_id:
         bs_id = _get_boot_source_id_by_url(url)
     maas = _create_maas_client()
-    json_res = json.loads(maas.delete(
+    json_res = json_codec.loads(maas.delete(
         u'/api/2.0/boot-sources/{0}/'.format(bs_id)).read() or 'null')
     LOG.debug("delete_boot_source:{}".format(json_res))
     result["new"] = "Boot-resource {0} deleted".format(url)
@@ -1540,14 +1844,14 @@ def create_boot_source(url, keyring_filename='', keyring_data='', wait=False):
         return result
 
     # NOTE: maas.post will return 400, if url already defined.
-    json_res = json.loads(
+    json_res = json_codec.loads(
         maas.post(u'api/2.0/boot-sources/', None, **data).read())
     if wait:
         LOG.debug(
             "Sleep for 5s,to get MaaS some time to process previous request")
         time.sleep(5)
         ret = boot_resources_is_importing(wait=True)
-        if ret is dict:
+        if isinstance(ret, dict):
             return ret
     LOG.debug("create_boot_source:{}".format(json_res))
     result["new"] = "boot resource {0} was created".format(json_res["url"])
@@ -1575,7 +1879,9 @@ def boot_resources_import(action='import', wait=False):
     if imp.code == 200:
         LOG.debug('boot_resources_import:{}'.format(imp.readline()))
         if wait:
-            boot_resources_is_importing(wait=True)
+            ret = boot_resources_is_importing(wait=True)
+            if isinstance(ret, dict):
+                return ret
         return True
     else:
         return False
@@ -1599,10 +1905,10 @@ def boot_resources_is_importing(wait=False):
                 "sleep for:{}s "
                 "Left:{}/{}s".format(poll_time, round(c_timeout), timeout))
             time.sleep(poll_time)
-        return json.loads(
+        return json_codec.loads(
             maas.get(u'api/2.0/boot-resources/', 'is_importing').read())
     else:
-        return json.loads(
+        return json_codec.loads(
             maas.get(u'api/2.0/boot-resources/', 'is_importing').read())
 
 #####
@@ -1613,16 +1919,29 @@ def boot_resources_is_importing(wait=False):
 #    return result
 
 
+def _selection_key(selection):
+    """
+    Return the (os, release, arches, subarches, labels) key of a boot-source
+    selection, either as requested or as listed by MAAS.
+    """
+    def values(value):
+        if isinstance(value, basestring):
+            value = value.split(',')
+        return tuple(sorted(str(v).strip().strip('"\'') for v in value))
+    return (str(selection['os']), str(selection['release']),
+            values(selection.get('arches', '*')),
+            values(selection.get('subarches', '*')),
+            values(selection.get('labels', '*')))
+
+
 def is_boot_source_selections_in(dict1, list1):
     """
     Check that requested boot-selection already in maas bs selections,
     if True- return bss id.
-    # FIXME: those hack check doesn't look good.
     """
+    key = _selection_key(dict1)
     for bs in list1:
-        same = set(dict1.keys()) & set(bs.keys())
-        if all(elem in same for elem in
-               ['os', 'release', 'arches', 'subarches', 'labels']):
+        if _selection_key(bs) == key:
             LOG.debug("boot-selection in maas:{0}\n"
                       "looks same to requested:{1}".format(bs, dict1))
             return bs['id']
@@ -1636,13 +1955,61 @@ def get_boot_source_selections(bs_url):
     # check for key_error!
     bs_id = _get_boot_source_id_by_url(bs_url)
     maas = _create_maas_client()
-    json_res = json.loads(
+    json_res = json_codec.loads(
         maas.get(u'/api/2.0/boot-sources/{0}/selections/'.format(bs_id)).read())
     LOG.debug(
         "get_boot_source_selections for url:{} \n{}".format(bs_url, json_res))
     return json_res
 
 
+def _post_boot_source_selection(maas, bs_id, data):
+    """
+    Create a boot-source selection, retrying while MAAS has not imported
+    the stream info yet. Return the created selection or False.
+    """
+    # NOTE: maas.post will return 400, if url already defined.
+    # Also, maas need's some time to import info about stream.
+    # unfortunatly, maas don't have any call to check stream-import-info - so, we need to implement
+    # at least simple retry ;(
+    json_res = False
+    poll_time = 5
+    for i in range(0, 10):
+        try:
+            json_res = json_codec.loads(
+                maas.post(u'api/2.0/boot-sources/{0}/selections/'.format(bs_id), None,
+                          **data).read())
+        except Exception as inst:
+            m = inst.readlines()
+            LOG.warning("boot_source_selections "
+                        "catch error during processing. Most-probably, "
+                        "streams data not imported yet.\nSleep:{}s "
+                        "Retry:{}/10".format(poll_time, i))
+            LOG.warning("Message:{0}".format(m))
+            time.sleep(poll_time)
+            continue
+        break
+    LOG.debug("create_boot_source_selections:{}".format(json_res))
+    return json_res
+
+
+def _import_boot_resources_after_selections():
+    """
+    Import the boot resources and wait for it to finish.
+
+    :return: None, or a dict with the ``comment`` of the failure.
+    """
+    LOG.debug(
+        "Sleep for 5s,to get MaaS some time to process previous request")
+    time.sleep(5)
+    ret = boot_resources_import(action='import', wait=True)
+    if isinstance(ret, dict):
+        return ret
+    if not ret:
+        return {'result': False,
+                'comment': 'Boot-resources import failed to start'}
+    return None
+
+
 def create_boot_source_selections(bs_url, os, release, arches="*",
                                   subarches="*", labels="*", wait=True):
     """
@@ -1666,7 +2033,6 @@ def create_boot_source_selections(bs_url, os, release, arches="*",
 
     maas = _create_maas_client()
     bs_id = _get_boot_source_id_by_url(bs_url)
-    # TODO add pre-create verify
     maas_bs_s = get_boot_source_selections(bs_url)
     if is_boot_source_selections_in(data, maas_bs_s):
         result["result"] = True
@@ -1675,46 +2041,97 @@ def create_boot_source_selections(bs_url, os, release, arches="*",
             bs_url)
         return result
 
-    # NOTE: maas.post will return 400, if url already defined.
-    # Also, maas need's some time to import info about stream.
-    # unfortunatly, maas don't have any call to check stream-import-info - so, we need to implement
-    # at least simple retry ;(
-    json_res = False
-    poll_time = 5
-    for i in range(0, 10):
-        try:
-            json_res = json.loads(
-                maas.post(u'api/2.0/boot-sources/{0}/selections/'.format(bs_id), None,
-                          **data).read())
-        except Exception as inst:
-            m = inst.readlines()
-            LOG.warning("boot_source_selections "
-                        "catch error during processing. Most-probably, "
-                        "streams data not imported yet.\nSleep:{}s "
-                        "Retry:{}/10".format(poll_time, i))
-            LOG.warning("Message:{0}".format(m))
-            time.sleep(poll_time)
-            continue
-        break
-    LOG.debug("create_boot_source_selections:{}".format(json_res))
+    json_res = _post_boot_source_selection(maas, bs_id, data)
     if not json_res:
         result["result"] = False
         result["comment"] = 'Failed to create requested boot-source selection' \
                             ' for {0}.'.format(bs_url)
         return result
     if wait:
-        LOG.debug(
-            "Sleep for 5s,to get MaaS some time to process previous request")
-        time.sleep(5)
-        ret = boot_resources_import(action='import', wait=True)
-        if ret is dict:
-            return ret
+        ret = _import_boot_resources_after_selections()
+        if isinstance(ret, dict):
+            result["result"] = False
+            result["comment"] = "boot-source selection for {0} was " \
+                                "created: {1}".format(bs_url, ret['comment'])
+            result["new"] = data
+            return result
     result["comment"] = "boot-source selection for {0} was created".format(
         bs_url)
     result["new"] = data
 
     return result
 
+
+def create_boot_sources_selections(selections, wait=True):
+    """
+    Create all missing boot-source selections at once.
+
+    The selections of every boot-source are listed once and indexed by
+    (os, release, arches, subarches, labels); the missing ones are created
+    and a single boot-resources import is triggered and waited for, instead
+    of one per selection.
+
+    :param selections: List of selections, dicts with the url of their
+                       boot-source, os, release and optional arches,
+                       subarches and labels.
+    :param wait:       Import the boot resources and wait for it to finish
+                       if any selection was created.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-call maasng.create_boot_sources_selections \
+            '[{url: "http://images.maas.io/ephemeral-v3/", os: ubuntu, release: xenial}]'
+    """
+    result = {"result": True, "new": [], "existing": [], "errors": []}
+    maas = _create_maas_client()
+    boot_sources = get_boot_source()
+    indexes = {}
+    for selection in selections:
+        url = selection['url']
+        data = {
+            "os": selection['os'],
+            "release": selection['release'],
+            "arches": selection.get('arches', '*'),
+            "subarches": selection.get('subarches', '*'),
+            "labels": selection.get('labels', '*'),
+        }
+        if url not in boot_sources:
+            result["errors"].append(
+                "boot-source:{0} not exist!".format(url))
+            continue
+        bs_id = boot_sources[url]['id']
+        if url not in indexes:
+            indexes[url] = dict(
+                (_selection_key(bs), bs['id']) for bs in json_codec.loads(
+                    maas.get(u'api/2.0/boot-sources/{0}/selections/'.format(
+                        bs_id)).read()))
+        key = _selection_key(data)
+        if key in indexes[url]:
+            result["existing"].append(data)
+            continue
+        json_res = _post_boot_source_selection(maas, bs_id, data)
+        if not json_res:
+            result["errors"].append(
+                'Failed to create boot-source selection {0} {1} '
+                'for {2}.'.format(data['os'], data['release'], url))
+            continue
+        indexes[url][key] = json_res.get('id')
+        result["new"].append(data)
+
+    result["comment"] = "{0} boot-source selections created, {1} already " \
+                        "exist, {2} failed".format(len(result["new"]),
+                                                   len(result["existing"]),
+                                                   len(result["errors"]))
+    if result["new"] and wait:
+        ret = _import_boot_resources_after_selections()
+        if isinstance(ret, dict):
+            result["errors"].append(ret['comment'])
+    if result["errors"]:
+        result["result"] = False
+    return result
+
 # END MAAS CONFIG SECTION
 
 # RACK CONTROLLERS SECTION
@@ -1748,7 +2165,7 @@ def list_racks(sort_by='hostname'):
     """
     racks = {}
     maas = _create_maas_client()
-    json_res = json.loads(
+    json_res = json_codec.loads(
         maas.get(u"/api/2.0/rackcontrollers/").read() or 'null')
     for item in json_res:
         racks[item[sort_by]] = item
@@ -1770,7 +2187,7 @@ def sync_bs_to_rack(hostname=None):
     if not hostname:
         LOG.info("boot-sources sync initiated for ALL Rack's")
         # Convert to json-like format
-        json_res = json.loads('["{0}"]'.format(
+        json_res = json_codec.loads('["{0}"]'.format(
             maas.post(u"/api/2.0/rackcontrollers/",
                       'import_boot_images').read()))
         LOG.debug("sync_bs_to_rack:{}".format(json_res))
@@ -1779,7 +2196,7 @@ def sync_bs_to_rack(hostname=None):
         return ret
     LOG.info("boot-sources sync initiated for RACK:{0}".format(hostname))
     # Convert to json-like format
-    json_res = json.loads('["{0}"]'.format(maas.post(
+    json_res = json_codec.loads('["{0}"]'.format(maas.post(
         u"/api/2.0/rackcontrollers/{0}/".format(
             get_rack(hostname)['system_id']),
         'import_boot_images').read()))
@@ -1794,7 +2211,7 @@ def rack_list_boot_imgs(hostname):
     ret = {}
     maas = _create_maas_client()
     LOG.debug("rack_list_boot_imgs:{}".format(hostname))
-    ret = json.loads(maas.get(u"/api/2.0/rackcontrollers/{0}/".format(
+    ret = json_codec.loads(maas.get(u"/api/2.0/rackcontrollers/{0}/".format(
         get_rack(hostname)['system_id']), 'list_boot_images').read() or 'null')
     return ret
 
@@ -1899,7 +2316,7 @@ def list_sshkeys():
     """
     ssh = {}
     maas = _create_maas_client()
-    json_res = json.loads(maas.get(u'api/2.0/account/prefs/sshkeys/').read())
+    json_res = json_codec.loads(maas.get(u'api/2.0/account/prefs/sshkeys/').read())
     LOG.info(json_res)
     for item in json_res:
         ssh[item["key"]] = item
@@ -1945,3 +2362,198 @@ def get_sshkey(sshkey):
     except KeyError:
         return {"error": "SSH key not found on MaaS server"}
 # END SSHKEYS
+# API STATS
+
+
+def api_stats(path=None, reset=False):
+    """
+    Return the MAAS API request statistics gathered by this minion
+    process: request count, errors, bytes and p50/p95/max latency per
+    endpoint.
+
+    :param path: Also write the statistics as JSON to this file.
+    :param reset: Start a new measurement window afterwards.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-call maasng.api_stats
+        salt-call maasng.api_stats path=/var/cache/salt/minion/maas/api_stats.json
+    """
+    stats = get_request_stats()
+    summary = stats.summary()
+    if path:
+        stats.write(path)
+    if reset:
+        stats.reset()
+    return summary
+# END API STATS
+# METRICS
+
+
+def _ip_to_int(ip):
+    family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+    return int(socket.inet_pton(family, ip).encode('hex'), 16)
+
+
+def _cidr_size(cidr):
+    address, prefix = cidr.split('/')
+    bits = 128 if ':' in address else 32
+    return 2 ** (bits - int(prefix))
+
+
+def _merged_length(intervals):
+    """
+    Number of addresses covered by ``intervals`` of (first, last)
+    addresses, counting overlapping or nested intervals once.
+    """
+    total = 0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is not None and start <= current_end + 1:
+            current_end = max(current_end, end)
+            continue
+        if current_end is not None:
+            total += current_end - current_start + 1
+        current_start, current_end = start, end
+    if current_end is not None:
+        total += current_end - current_start + 1
+    return total
+
+
+def _metric_line(name, value, **labels):
+    if labels:
+        name += '{%s}' % ','.join(
+            '{0}="{1}"'.format(key, unicode(val).replace('\\', '\\\\')
+                               .replace('"', '\\"').replace('\n', '\\n'))
+            for key, val in sorted(labels.items()))
+    return '{0} {1}'.format(name, value)
+
+
+def export_metrics(path='/var/lib/prometheus/node-exporter/maas.prom',
+                   stats_path='/var/cache/salt/minion/maas/api_stats.json',
+                   machines=None, racks=None, importing=None):
+    """
+    Write MAAS metrics for the node-exporter textfile collector: machines
+    per status, boot images sync per rack, boot-resources import, iprange
+    utilization per subnet and the API statistics of the last formula run
+    (see maasng.api_stats). The file is replaced atomically.
+
+    The ``maas`` engine calls it after its polls with the state it already
+    has: ``machines`` (status per hostname), ``racks`` (boot images status
+    per hostname) and ``importing``; only what is not passed is read from
+    the API. Machines come from the shared inventory and the listings go
+    through the shared response cache. A rack whose boot images cannot be
+    listed is exported with ``status="error"`` instead of failing the
+    export.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-call maasng.export_metrics
+        salt-call maasng.export_metrics path=/tmp/maas.prom
+    """
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append('# HELP {0} {1}'.format(name, help_text))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+        for value, labels in samples:
+            lines.append(_metric_line(name, value, **labels))
+
+    maas = _create_maas_client()
+    if machines is None:
+        statuses = collections.Counter(
+            machine.status_name for machine in get_inventory(maas))
+    else:
+        statuses = collections.Counter(machines.values())
+    metric('maas_machines', 'gauge', 'Machines per status.',
+           [(count, {'status': status})
+            for status, count in sorted(statuses.items())])
+
+    if racks is None:
+        racks = {}
+        for rack in json_codec.loads(
+                maas.get(u'api/2.0/rackcontrollers/').read()):
+            try:
+                racks[rack['hostname']] = json_codec.loads(maas.get(
+                    u'api/2.0/rackcontrollers/{0}/'.format(
+                        rack['system_id']),
+                    'list_boot_images').read()).get('status')
+            except Exception as error:
+                LOG.warning('Boot images of rack {0} not listed: {1}'.format(
+                    rack['hostname'], error))
+                racks[rack['hostname']] = 'error'
+    metric('maas_rack_boot_images_synced', 'gauge',
+           'Whether the rack controller boot images are synced.',
+           [(int(status == 'synced'), {'rack': hostname, 'status': status})
+            for hostname, status in sorted(racks.items())])
+
+    if importing is None:
+        importing = json_codec.loads(
+            maas.get(u'api/2.0/boot-resources/', 'is_importing').read())
+    metric('maas_boot_resources_importing', 'gauge',
+           'Whether boot resources are being imported.',
+           [(int(bool(importing)), {})])
+
+    intervals = collections.defaultdict(list)
+    for iprange in json_codec.loads(maas.get(u'api/2.0/ipranges/').read()):
+        intervals[(iprange['subnet']['cidr'], iprange['type'])].append(
+            (_ip_to_int(iprange['start_ip']), _ip_to_int(iprange['end_ip'])))
+    used = dict((key, _merged_length(ranges))
+                for key, ranges in intervals.items())
+    sizes = dict(
+        (subnet['cidr'], _cidr_size(subnet['cidr']))
+        for subnet in json_codec.loads(maas.get(u'api/2.0/subnets/').read()))
+    metric('maas_subnet_addresses', 'gauge', 'Addresses in the subnet.',
+           [(size, {'subnet': cidr}) for cidr, size in sorted(sizes.items())])
+    metric('maas_iprange_addresses', 'gauge',
+           'Addresses covered by ipranges per subnet and range type.',
+           [(count, {'subnet': cidr, 'type': type_range})
+            for (cidr, type_range), count in sorted(used.items())])
+    metric('maas_iprange_utilization_ratio', 'gauge',
+           'Share of the subnet covered by ipranges per range type.',
+           [(round(float(count) / sizes[cidr], 6),
+             {'subnet': cidr, 'type': type_range})
+            for (cidr, type_range), count in sorted(used.items())
+            if cidr in sizes])
+
+    if stats_path and os.path.isfile(stats_path):
+        with open(stats_path) as fd:
+            stats = json.load(fd)
+        endpoints = sorted(stats['endpoints'].items())
+        metric('maas_api_last_run_timestamp_seconds', 'gauge',
+               'Start of the last formula run.',
+               [(stats['started_at'], {})])
+        metric('maas_api_last_run_duration_seconds', 'gauge',
+               'Duration of the last formula run.', [(stats['duration'], {})])
+        metric('maas_api_last_run_requests', 'gauge',
+               'MAAS API requests of the last formula run per endpoint.',
+               [(data['count'], {'endpoint': endpoint})
+                for endpoint, data in endpoints])
+        metric('maas_api_last_run_errors', 'gauge',
+               'Failed MAAS API requests of the last formula run.',
+               [(data['errors'], {'endpoint': endpoint})
+                for endpoint, data in endpoints])
+        metric('maas_api_last_run_latency_seconds', 'gauge',
+               'MAAS API request latency of the last formula run.',
+               [(data[key], {'endpoint': endpoint, 'quantile': quantile})
+                for endpoint, data in endpoints
+                for key, quantile in (('p50', '0.5'), ('p95', '0.95'),
+                                      ('max', '1'))])
+
+    metric('maas_metrics_timestamp_seconds', 'gauge',
+           'When these metrics were exported.', [(int(time.time()), {})])
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with io.open(temp_path, 'w', encoding='utf-8') as fd:
+        fd.write(u'\n'.join(lines) + u'\n')
+    os.rename(temp_path, path)
+    return {'path': path, 'machines': sum(statuses.values()),
+            'lines': len(lines)}
+# END METRICS
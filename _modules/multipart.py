@@ -14,6 +14,7 @@ str = None
 __metaclass__ = type
 __all__ = [
     'encode_multipart_data',
+    'encode_multipart_fields',
     ]
 
 from collections import (
@@ -29,6 +30,7 @@ from io import (
     )
 from itertools import chain
 import mimetypes
+import os
 
 
 def get_content_type(*names):
@@ -121,6 +123,62 @@ def encode_multipart_message(message):
     return message.items(), body
 
 
+def string_fields(data):
+    """Return `data` as a list of (name, string) pairs, or None.
+
+    None is returned as soon as a value is not a byte or unicode string,
+    nor a list of them: such data needs `build_multipart_message`.
+    """
+    fields = []
+    for name, contents in data:
+        if not isinstance(contents, list):
+            contents = [contents]
+        for content in contents:
+            if not isinstance(content, (bytes, unicode)):
+                return None
+            fields.append((name, content))
+    return fields
+
+
+def encode_multipart_fields(fields):
+    """Hand-assemble the multipart payload of string fields.
+
+    The parts are those `build_multipart_message` would build, base64
+    encoded as well, without creating and flattening MIME objects.
+
+    @param fields: An iterable of (name, value) pairs, where value is a
+        byte or unicode string.
+    @return: A 2-tuple of C{(body, headers)}, like `encode_multipart_data`.
+    """
+    boundary = b"===============%s==" % os.urandom(12).encode("hex")
+    lines = []
+    for name, content in fields:
+        if isinstance(content, unicode):
+            content_type = b'text/plain; charset="utf-8"'
+            content = content.encode("utf-8")
+        else:
+            content_type = b"application/octet-stream"
+        if isinstance(name, unicode):
+            name = name.encode("utf-8")
+        lines.extend((
+            b"--" + boundary,
+            b"Content-Type: " + content_type,
+            b"MIME-Version: 1.0",
+            b"Content-Transfer-Encoding: base64",
+            b'Content-Disposition: form-data; name="%s"' % name.replace(
+                b"\\", b"\\\\").replace(b'"', b'\\"'),
+            b"",
+            content.encode("base64").rstrip(b"\n").replace(b"\n", b"\r\n")))
+    lines.append(b"--%s--" % boundary)
+    body = b"\r\n".join(lines)
+    headers = {
+        b"Content-Type": b'multipart/form-data; boundary="%s"' % boundary,
+        b"MIME-Version": b"1.0",
+        b"Content-Length": b"%d" % len(body),
+        }
+    return body, headers
+
+
 def encode_multipart_data(data=(), files=()):
     """Create a MIME multipart payload from L{data} and L{files}.
 
@@ -138,6 +196,12 @@ def encode_multipart_data(data=(), files=()):
         data = data.items()
     if isinstance(files, Mapping):
         files = files.items()
+    if not files:
+        # Plain string fields, i.e. almost every request: skip the MIME
+        # machinery, only file parts need it.
+        fields = string_fields(data)
+        if fields is not None:
+            return encode_multipart_fields(fields)
     message = build_multipart_message(chain(data, files))
     headers, body = encode_multipart_message(message)
     return body, dict(headers)
@@ -41,8 +41,11 @@ def urlencode(data):
     Unicode strings will be encoded to UTF-8. This is what Django expects; see
     `smart_text` in the Django documentation.
     """
-    enc = lambda string: quote_plus(
-        string.encode("utf-8") if isinstance(string, unicode) else string)
     return b"&".join(
-        b"%s=%s" % (enc(name), enc(value))
+        b"%s=%s" % (_quote(name), _quote(value))
         for name, value in data)
+
+
+def _quote(string):
+    return quote_plus(
+        string.encode("utf-8") if isinstance(string, unicode) else string)
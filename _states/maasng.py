@@ -54,7 +54,7 @@ def disk_layout_present(hostname, layout_type, root_size=None, root_device=None,
            'result': True,
            'comment': 'Disk layout "{0}" updated'.format(hostname)}
 
-    machine = __salt__['maasng.get_machine'](hostname)
+    machine = __salt__['maasng.get_machine'](hostname, compact=True)
     if "error" in machine:
         if 0 in machine["error"]:
             ret['comment'] = "No such machine {0}".format(hostname)
@@ -109,7 +109,7 @@ def raid_present(hostname, name, level, devices=[], partitions=[],
            'result': True,
            'comment': 'Raid {0} presented on {1}'.format(name, hostname)}
 
-    machine = __salt__['maasng.get_machine'](hostname)
+    machine = __salt__['maasng.get_machine'](hostname, compact=True)
     if "error" in machine:
         if 0 in machine["error"]:
             ret['comment'] = "No such machine {0}".format(hostname)
@@ -171,7 +171,7 @@ def disk_partition_present(hostname, name, partition_schema={}):
            'result': True,
            'comment': 'Disk layout {0} presented'.format(name)}
 
-    machine = __salt__['maasng.get_machine'](hostname)
+    machine = __salt__['maasng.get_machine'](hostname, compact=True)
     if "error" in machine:
         if 0 in machine["error"]:
             ret['comment'] = "No such machine {0}".format(hostname)
@@ -251,7 +251,7 @@ def volume_group_present(hostname, name, devices=[], partitions=[]):
            'result': True,
            'comment': 'LVM group {0} presented on {1}'.format(name, hostname)}
 
-    machine = __salt__['maasng.get_machine'](hostname)
+    machine = __salt__['maasng.get_machine'](hostname, compact=True)
     if "error" in machine:
         if 0 in machine["error"]:
             ret['comment'] = "No such machine {0}".format(hostname)
@@ -302,7 +302,7 @@ def volume_present(hostname, name, volume_group_name, size, type=None,
            'result': True,
            'comment': 'LVM group {0} presented on {1}'.format(name, hostname)}
 
-    machine = __salt__['maasng.get_machine'](hostname)
+    machine = __salt__['maasng.get_machine'](hostname, compact=True)
     if "error" in machine:
         if 0 in machine["error"]:
             ret['comment'] = "No such machine {0}".format(hostname)
@@ -322,6 +322,7 @@ def volume_present(hostname, name, volume_group_name, size, type=None,
         ret['result'] = None
         ret['comment'] = 'LVM volume {0} will be updated on {1}'.format(
             name, hostname)
+        return ret
 
     # TODO validation if exists
 
@@ -344,7 +345,7 @@ def select_boot_disk(hostname, name):
            'result': True,
            'comment': 'LVM group {0} presented on {1}'.format(name, hostname)}
 
-    machine = __salt__['maasng.get_machine'](hostname)
+    machine = __salt__['maasng.get_machine'](hostname, compact=True)
     if "error" in machine:
         if 0 in machine["error"]:
             ret['comment'] = "No such machine {0}".format(hostname)
@@ -362,8 +363,9 @@ def select_boot_disk(hostname, name):
 
     if __opts__['test']:
         ret['result'] = None
-        ret['comment'] = 'LVM volume {0}' \
-                         'will be updated on {1}'.format(name, hostname)
+        ret['comment'] = 'Boot disk {0} ' \
+                         'will be selected on {1}'.format(name, hostname)
+        return ret
 
     # TODO disk validation if exists
 
@@ -390,14 +392,14 @@ def vlan_present_in_fabric(name, fabric, vlan, primary_rack, description='', dhc
            'result': True,
            'comment': 'Module function maasng.update_vlan executed'}
 
-    if __opts__['test']:
-        ret['result'] = None
-        ret['comment'] = 'Vlan {0} will be updated for {1}'.format(
-            vlan, fabric)
-        return ret
     # Check, that vlan  already defined
     _rez = __salt__['maasng.check_vlan_in_fabric'](fabric=fabric,
                                                    vlan=vlan)
+    if __opts__['test']:
+        ret['result'] = None
+        ret['comment'] = 'Vlan {0} will be {2} for {1}'.format(
+            vlan, fabric, 'created' if _rez == 'not_exist' else 'updated')
+        return ret
     if _rez == 'not_exist':
         changes = __salt__['maasng.create_vlan_in_fabric'](name=name,
                                                            fabric=fabric,
@@ -448,19 +450,23 @@ def boot_source_present(url, keyring_file='', keyring_data='',
            'result': True,
            'comment': 'boot-source {0} presented'.format(url)}
 
-    if __opts__['test']:
-        ret['result'] = None
-        ret['comment'] = 'boot-source {0} will be updated'.format(url)
     maas_boot_sources = maasng('get_boot_source')
     # TODO implement check and update for keyrings!
     if url in maas_boot_sources.keys():
         ret["result"] = True
         ret["comment"] = 'boot-source {0} alredy exist'.format(url)
+    elif __opts__['test']:
+        ret['result'] = None
+        ret['comment'] = 'boot-source {0} will be created'.format(url)
     else:
         ret["changes"] = maasng('create_boot_source', url,
                                 keyring_filename=keyring_file,
                                 keyring_data=keyring_data)
-    if delete_undefined_sources:
+    if delete_undefined_sources and __opts__['test']:
+        ret['result'] = None
+        ret['comment'] += ', boot-sources other than {0} will be ' \
+                          'deleted'.format(url)
+    elif delete_undefined_sources:
         ret["changes"] = merge2dicts(ret.get('changes', {}),
                                      maasng('boot_sources_delete_all_others',
                                             except_urls=delete_undefined_sources_except_urls))
@@ -489,11 +495,6 @@ def boot_sources_selections_present(bs_url, os, release, arches="*",
            'result': True,
            'comment': 'boot-source {0} selection present'.format(bs_url)}
 
-    if __opts__['test']:
-        ret['result'] = None
-        ret['comment'] = 'boot-source {0}' \
-                         'selection will be updated'.format(bs_url)
-
     maas_boot_sources = maasng('get_boot_source')
     if bs_url not in maas_boot_sources.keys():
         ret["result"] = False
@@ -502,6 +503,12 @@ def boot_sources_selections_present(bs_url, os, release, arches="*",
                          'to proceed selection for it'.format(bs_url)
         return ret
 
+    if __opts__['test']:
+        ret['result'] = None
+        ret['comment'] = 'boot-source {0} ' \
+                         'selection will be updated'.format(bs_url)
+        return ret
+
     ret = maasng('create_boot_source_selections', bs_url, os, release,
                  arches=arches,
                  subarches=subarches,
@@ -510,6 +517,53 @@ def boot_sources_selections_present(bs_url, os, release, arches="*",
     return ret
 
 
+def boot_sources_all_selections_present(name, selections, wait=True):
+    """
+    Process every maas boot-sources selection at once: missing selections
+    are created and the boot resources are imported a single time.
+
+    :param selections: List of selections: url of the boot-source, os,
+                       release and optional arches, subarches and labels.
+    :param wait:       Initiate import and wait for done.
+
+    """
+    ret = {'name': name,
+           'changes': {},
+           'result': True,
+           'comment': 'boot-source selections present'}
+
+    if __opts__['test']:
+        maas_boot_sources = maasng('get_boot_source')
+        missing = []
+        for url in set(selection['url'] for selection in selections):
+            if url not in maas_boot_sources:
+                ret['result'] = False
+                ret['comment'] = 'Requested boot-source ' \
+                                 '{0} not exist! Unable ' \
+                                 'to proceed selection for it'.format(url)
+                return ret
+            existing = maasng('get_boot_source_selections', url)
+            missing.extend(
+                '{0} {1}'.format(selection['os'], selection['release'])
+                for selection in selections if selection['url'] == url and
+                not maasng('is_boot_source_selections_in', selection,
+                           existing))
+        if missing:
+            ret['result'] = None
+            ret['comment'] = 'boot-source selections {0} ' \
+                             'will be created'.format(', '.join(missing))
+        return ret
+
+    result = maasng('create_boot_sources_selections', selections, wait=wait)
+    ret['result'] = result['result']
+    ret['comment'] = result['comment']
+    if result['new']:
+        ret['changes'] = {'new': result['new']}
+    if result['errors']:
+        ret['comment'] += ': ' + '; '.join(result['errors'])
+    return ret
+
+
 def iprange_present(name, type_range, start_ip, end_ip, subnet=None,
                     comment=None):
     """
@@ -614,10 +668,6 @@ def fabric_present(name, description=None):
            'result': True,
            'comment': 'Module function maasng.fabric_present executed'}
 
-    if __opts__['test']:
-        ret['result'] = None
-        ret['comment'] = 'fabric {0} will be updated'.format(name)
-        return ret
     # All requested subnets
     _r_subnets = __salt__['config.get']('maas').get('region', {}).get('subnets',
                                                                       {})
@@ -626,6 +676,11 @@ def fabric_present(name, description=None):
                   _r_subnets[f]['fabric'] == name]
     _rez = __salt__['maasng.check_fabric_guess_with_cidr'](name=name,
                                                            cidrs=_a_subnets)
+    if __opts__['test']:
+        ret['result'] = None
+        ret['comment'] = 'fabric {0} will be {1}'.format(
+            name, 'created' if 'not_exist' in _rez else 'updated')
+        return ret
 
     if 'not_exist' in _rez:
         changes = __salt__['maasng.create_fabric'](name=name,
@@ -689,3 +744,37 @@ def sshkey_present(name, sshkey):
         return ret
 
     return ret
+
+
+def api_stats(name, path=None, reset=True):
+    """
+    Report the MAAS API requests made during this run.
+
+    :param name: Name of the state
+    :param path: Also write the statistics as JSON to this file
+    :param reset: Start a new measurement window afterwards
+
+    """
+
+    ret = {'name': name,
+           'changes': {},
+           'result': True,
+           'comment': ''}
+
+    if __opts__['test']:
+        path = None
+        reset = False
+    stats = __salt__['maasng.api_stats'](path=path, reset=reset)
+    lines = ['{0} MAAS API requests ({1} errors) in {2}s'.format(
+        stats['requests'], stats['errors'], round(stats['duration'], 1))]
+    endpoints = sorted(stats['endpoints'].items(),
+                       key=lambda item: item[1]['total'], reverse=True)
+    for endpoint, data in endpoints:
+        lines.append('{0}: count={1} errors={2} p50={3}s p95={4}s '
+                     'max={5}s'.format(endpoint, data['count'],
+                                       data['errors'], data['p50'],
+                                       data['p95'], data['max']))
+    if path:
+        lines.append('Statistics written to {0}'.format(path))
+    ret['comment'] = '\n'.join(lines)
+    return ret
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+'''
+Throughput and memory of the request encoders, offline.
+
+Every payload shape comes from a call the formula makes: a machine create
+with power parameters, an interface ``link_subnet``, a commissioning
+script upload and a boot resource upload (500 MB by default). Each
+payload is encoded by each applicable encoder (``multipart``, ``json``,
+``urlencode``) and every case runs in its own process, so the peak RSS
+reported is the one of that case only.
+
+Usage (python 2.7, from the repository root)::
+
+    python benchmarks/encoding.py [--seconds S] [--boot-resource-mb MB]
+                                  [--case NAME] [--json]
+'''
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, '_modules'))
+
+from encode_json import encode_json_data  # noqa: E402
+from maas_client import MAASOAuth  # noqa: E402
+from multipart import encode_multipart_data  # noqa: E402
+from utils import urlencode  # noqa: E402
+
+MB = 1024 * 1024
+
+COMMISSIONING_SCRIPT = b'''#!/bin/sh
+# Keep only the interface MAAS boots from configured.
+set -e
+for nic in /sys/class/net/*; do
+    echo "$(basename $nic) $(cat $nic/address)"
+done
+''' * 40
+
+
+def machine_create():
+    return {
+        'hostname': 'kvm01',
+        'architecture': 'amd64/generic',
+        'mac_addresses': '52:54:00:12:34:56',
+        'power_type': 'ipmi',
+        'power_parameters_power_address': '10.0.0.201',
+        'power_parameters_power_user': 'admin',
+        'power_parameters_power_pass': 'r00tme',
+        'power_parameters_power_driver': 'LAN_2_0',
+    }, {}
+
+
+def link_subnet():
+    return {
+        'op': 'link_subnet',
+        'mode': 'STATIC',
+        'subnet': '3',
+        'ip_address': '10.0.0.15',
+        'default_gateway': 'True',
+    }, {}
+
+
+def file_opener(path):
+    # A callable content is opened again for every encoding.
+    return lambda: io.open(path, 'rb')
+
+
+def commissioning_script(workdir):
+    path = os.path.join(workdir, '00-maas-05-simplify-network-interfaces')
+    with open(path, 'wb') as fd:
+        fd.write(COMMISSIONING_SCRIPT)
+    return {'name': '00-maas-05-simplify-network-interfaces'}, {
+        'content': file_opener(path)}
+
+
+def boot_resource(workdir, size_mb):
+    path = os.path.join(workdir, 'root-tgz')
+    chunk = os.urandom(MB)
+    with open(path, 'wb') as fd:
+        for _ in range(size_mb):
+            fd.write(chunk)
+    return {
+        'name': 'custom/xenial-kernel',
+        'title': 'Custom xenial kernel',
+        'architecture': 'amd64/generic',
+        'filetype': 'tgz',
+        'size': '{0}'.format(size_mb * MB),
+    }, {'content': file_opener(path)}
+
+
+ENCODERS = {
+    'multipart': lambda params, files: encode_multipart_data(params, files),
+    'json': lambda params, files: encode_json_data(params),
+    'urlencode': lambda params, files: (urlencode(params.items()), {}),
+}
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_case(payload, encoder, seconds, queue):
+    '''
+    Encode ``payload`` for at least ``seconds`` and put the result on
+    ``queue``; runs in a child process.
+    '''
+    params, files = payload()
+    encode = ENCODERS[encoder]
+    # make_file_payload prints the content it encodes.
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        baseline = peak_rss_kb()
+        ops = 0
+        size = 0
+        started = time.time()
+        while True:
+            body, headers = encode(params, files)
+            size += len(body)
+            ops += 1
+            del body, headers
+            elapsed = time.time() - started
+            if elapsed >= seconds:
+                break
+    finally:
+        sys.stdout = stdout
+    queue.put({
+        'ops': ops,
+        'seconds': elapsed,
+        'ops_per_sec': ops / elapsed,
+        'bytes_per_sec': size / elapsed,
+        'body_bytes': size // ops,
+        'peak_rss_kb': peak_rss_kb(),
+        'rss_growth_kb': peak_rss_kb() - baseline,
+    })
+
+
+def run_isolated(payload, encoder, seconds):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=run_case, args=(payload, encoder, seconds, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        return {'error': 'exit code {0}'.format(process.exitcode)}
+    return queue.get()
+
+
+def run_sign(seconds):
+    auth = MAASOAuth('consumer', 'token', 'secret')
+    ops = 0
+    started = time.time()
+    while time.time() - started < seconds:
+        for _ in range(1000):
+            auth.sign_request('http://maas/MAAS/api/2.0/machines/', {})
+        ops += 1000
+    elapsed = time.time() - started
+    return {'ops': ops, 'seconds': elapsed, 'ops_per_sec': ops / elapsed}
+
+
+def human(value, unit):
+    for prefix in ('', 'K', 'M', 'G'):
+        if abs(value) < 1024 or prefix == 'G':
+            return '{0:.1f} {1}{2}'.format(value, prefix, unit)
+        value /= 1024.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--seconds', type=float, default=1.0,
+                        help='minimum run time of each case')
+    parser.add_argument('--boot-resource-mb', type=int, default=500)
+    parser.add_argument('--case', action='append',
+                        help='only run this payload (repeatable)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='maas-encoding-')
+    try:
+        payloads = [
+            ('machine_create', machine_create,
+             ('multipart', 'json', 'urlencode')),
+            ('link_subnet', link_subnet, ('multipart', 'json', 'urlencode')),
+            ('commissioning_script',
+             lambda: commissioning_script(workdir), ('multipart',)),
+            ('boot_resource',
+             lambda: boot_resource(workdir, args.boot_resource_mb),
+             ('multipart',)),
+        ]
+        results = {'sign': run_sign(args.seconds)}
+        for name, payload, encoders in payloads:
+            if args.case and name not in args.case:
+                continue
+            for encoder in encoders:
+                results['{0}/{1}'.format(name, encoder)] = run_isolated(
+                    payload, encoder, args.seconds)
+    finally:
+        shutil.rmtree(workdir)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    print('{0:<32} {1:>12} {2:>12} {3:>12} {4:>12}'.format(
+        'case', 'ops/s', 'bytes/s', 'body', 'peak RSS'))
+    for name in sorted(results):
+        result = results[name]
+        if 'error' in result:
+            print('{0:<32} {1}'.format(name, result['error']))
+        elif 'body_bytes' not in result:
+            print('{0:<32} {1:>12.0f}'.format(name, result['ops_per_sec']))
+        else:
+            print('{0:<32} {1:>12.1f} {2:>12} {3:>12} {4:>12}'.format(
+                name, result['ops_per_sec'],
+                human(result['bytes_per_sec'], 'B'),
+                human(result['body_bytes'], 'B'),
+                human(result['peak_rss_kb'] * 1024, 'B')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+'''
+Decoding time of a ``machines/`` listing per JSON backend of json_codec.
+
+The listings are synthetic, 1k and 10k machines shaped like the ones MAAS
+2.x returns: interfaces with links, block devices with partitions, tags.
+Backends that are not installed are reported as such.
+
+Usage (python 2.7, from the repository root)::
+
+    python benchmarks/json_decoding.py [--machines N ...] [--repeat R]
+'''
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, '_modules'))
+
+import json_codec  # noqa: E402
+
+
+def interface(index, machine):
+    mac = '52:54:{0:02x}:{1:02x}:{2:02x}:{3:02x}'.format(
+        index, (machine >> 16) & 0xff, (machine >> 8) & 0xff, machine & 0xff)
+    return {
+        'id': machine * 4 + index,
+        'name': 'eth{0}'.format(index),
+        'type': 'physical',
+        'mac_address': mac,
+        'enabled': True,
+        'effective_mtu': 1500,
+        'params': {},
+        'tags': [],
+        'parents': [],
+        'children': [],
+        'vlan': {'id': 5001, 'vid': 0, 'name': 'untagged', 'fabric': 'fabric-0',
+                 'fabric_id': 0, 'mtu': 1500, 'dhcp_on': True,
+                 'primary_rack': '4y3h7n', 'secondary_rack': None,
+                 'external_dhcp': None, 'relay_vlan': None, 'space': 'undefined',
+                 'resource_uri': '/MAAS/api/2.0/vlans/5001/'},
+        'links': [{
+            'id': machine * 4 + index,
+            'mode': 'static',
+            'ip_address': '10.{0}.{1}.{2}'.format(
+                index, (machine >> 8) & 0xff, machine & 0xff),
+            'subnet': {'id': index + 1, 'name': '10.{0}.0.0/16'.format(index),
+                       'cidr': '10.{0}.0.0/16'.format(index),
+                       'gateway_ip': '10.{0}.0.1'.format(index),
+                       'dns_servers': [], 'managed': True,
+                       'allow_proxy': True, 'active_discovery': False,
+                       'resource_uri': '/MAAS/api/2.0/subnets/{0}/'.format(
+                           index + 1)},
+        }],
+        'discovered': [],
+        'resource_uri': '/MAAS/api/2.0/nodes/{0:06x}/interfaces/{1}/'.format(
+            machine, machine * 4 + index),
+    }
+
+
+def block_device(index, machine):
+    return {
+        'id': machine * 2 + index,
+        'name': 'sd{0}'.format('ab'[index]),
+        'path': '/dev/disk/by-dname/sd{0}'.format('ab'[index]),
+        'id_path': '/dev/disk/by-id/wwn-0x5000c500{0:08x}'.format(machine),
+        'model': 'ST2000NM0033', 'serial': 'Z1X{0:06d}'.format(machine),
+        'size': 2000398934016, 'block_size': 4096,
+        'available_size': 0, 'used_size': 2000393691136,
+        'used_for': 'GPT partitioned with ext4 filesystem',
+        'tags': ['rotary', 'sata'],
+        'filesystem': None,
+        'partition_table_type': 'GPT',
+        'partitions': [{
+            'id': machine * 2 + index, 'uuid': '{0:032x}'.format(machine),
+            'size': 2000393691136, 'bootable': False, 'type': 'partition',
+            'path': '/dev/disk/by-dname/sd{0}-part1'.format('ab'[index]),
+            'filesystem': {'fstype': 'ext4', 'label': 'root',
+                           'uuid': '{0:032x}'.format(machine),
+                           'mount_point': '/' if index == 0 else None,
+                           'mount_options': None},
+            'used_for': 'ext4 formatted filesystem mounted at /',
+            'tags': [],
+        }],
+        'storage_pool': None,
+        'resource_uri': '/MAAS/api/2.0/nodes/{0:06x}/blockdevices/{1}/'.format(
+            machine, machine * 2 + index),
+    }
+
+
+def machine(index):
+    system_id = '{0:06x}'.format(index)
+    interfaces = [interface(nic, index) for nic in range(4)]
+    return {
+        'system_id': system_id,
+        'hostname': 'cmp{0:05d}'.format(index),
+        'fqdn': 'cmp{0:05d}.maas'.format(index),
+        'domain': {'id': 0, 'name': 'maas', 'authoritative': True,
+                   'ttl': None, 'resource_record_count': 0,
+                   'resource_uri': '/MAAS/api/2.0/domains/0/'},
+        'architecture': 'amd64/generic',
+        'status': 6, 'status_name': 'Deployed', 'status_message': 'Deployed',
+        'status_action': '',
+        'power_type': 'ipmi', 'power_state': 'on',
+        'osystem': 'ubuntu', 'distro_series': 'xenial',
+        'hwe_kernel': 'ga-16.04', 'min_hwe_kernel': '',
+        'netboot': False, 'locked': False, 'owner': 'admin', 'owner_data': {},
+        'cpu_count': 48, 'memory': 262144, 'storage': 4000797.868032,
+        'zone': {'id': 1, 'name': 'default', 'description': '',
+                 'resource_uri': '/MAAS/api/2.0/zones/default/'},
+        'pool': {'id': 0, 'name': 'default', 'description': '',
+                 'resource_uri': '/MAAS/api/2.0/resourcepool/0/'},
+        'tag_names': ['virtual', 'compute', 'dpdk'],
+        'ip_addresses': [link['ip_address'] for nic in interfaces
+                         for link in nic['links']],
+        'boot_interface': interfaces[0],
+        'interface_set': interfaces,
+        'blockdevice_set': [block_device(disk, index) for disk in range(2)],
+        'physicalblockdevice_set': [block_device(disk, index)
+                                    for disk in range(2)],
+        'virtualblockdevice_set': [],
+        'special_filesystems': [],
+        'commissioning_status': 2, 'commissioning_status_name': 'Passed',
+        'testing_status': 2, 'testing_status_name': 'Passed',
+        'node_type': 0, 'node_type_name': 'Machine',
+        'resource_uri': '/MAAS/api/2.0/machines/{0}/'.format(system_id),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--machines', type=int, nargs='+',
+                        default=[1000, 10000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    selected = json_codec.backend
+    print('selected backend: {0}'.format(selected))
+    print('{0:>9} {1:>10} {2:<12} {3:>10} {4:>10} {5:>8}'.format(
+        'machines', 'size', 'backend', 'decode s', 'MB/s', 'vs json'))
+    for count in args.machines:
+        document = json.dumps([machine(index) for index in range(count)])
+        megabytes = len(document) / 1e6
+        reference = None
+        for name, _ in reversed(json_codec.BACKENDS):
+            try:
+                json_codec.use(name)
+            except ImportError:
+                print('{0:>9} {1:>8.1f}MB {2:<12} {3:>10}'.format(
+                    count, megabytes, name, 'missing'))
+                continue
+            best = None
+            for _ in range(args.repeat):
+                started = time.time()
+                json_codec.loads(document)
+                elapsed = time.time() - started
+                best = elapsed if best is None else min(best, elapsed)
+            reference = reference or best
+            print('{0:>9} {1:>8.1f}MB {2:<12} {3:>10.3f} {4:>10.1f} '
+                  '{5:>7.1f}x'.format(count, megabytes, name, best,
+                                      megabytes / best, reference / best))
+    json_codec.use(selected)
+
+
+if __name__ == '__main__':
+    main()
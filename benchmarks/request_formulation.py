@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+'''
+CPU cost of formulating MAAS API requests, before and after the fast path.
+
+"before" signs with ``oauth.OAuthRequest`` and encodes bodies with the
+``email.mime`` machinery, as MAASClient used to; "after" is the current
+MAASClient. No request is sent.
+
+Usage (python 2.7, from the repository root)::
+
+    python benchmarks/request_formulation.py [--number N]
+'''
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, '_modules'))
+
+from maas_client import MAASClient, MAASOAuth  # noqa: E402
+from multipart import (  # noqa: E402
+    build_multipart_message,
+    encode_multipart_message,
+)
+import oauth.oauth as oauth  # noqa: E402
+
+
+class LegacyOAuth(MAASOAuth):
+    '''
+    Sign through a new, PLAINTEXT signed ``oauth.OAuthRequest``.
+    '''
+
+    def sign_request(self, url, headers):
+        oauth_request = oauth.OAuthRequest.from_consumer_and_token(
+            self.consumer_token, token=self.resource_token, http_url=url)
+        oauth_request.sign_request(
+            oauth.OAuthSignatureMethod_PLAINTEXT(), self.consumer_token,
+            self.resource_token)
+        headers.update(oauth_request.to_header())
+
+
+def legacy_encode(params):
+    headers, body = encode_multipart_message(
+        build_multipart_message(params.items()))
+    return body, dict(headers)
+
+
+def client(auth):
+    return MAASClient(auth, None, 'http://maas.example.com:5240/MAAS/')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    credentials = ('consumer', 'token', 'secret')
+    before = client(LegacyOAuth(*credentials))
+    after = client(MAASOAuth(*credentials))
+    # A typical write: a VLAN update with three short fields and an op.
+    fields = {'name': 'pxe', 'mtu': '1500', 'dhcp_on': 'True'}
+    path = 'api/2.0/fabrics/1/vlans/10/'
+
+    def change_before():
+        url = before._make_url(path) + '?op=update'
+        body, headers = legacy_encode(fields)
+        before.auth.sign_request(url, headers)
+
+    cases = [
+        ('sign', lambda: before.auth.sign_request(path, {}),
+         lambda: after.auth.sign_request(path, {})),
+        ('GET', lambda: before._formulate_get(path, {'op': 'details'}),
+         lambda: after._formulate_get(path, {'op': 'details'})),
+        ('multipart body', lambda: legacy_encode(fields),
+         lambda: after._formulate_change(path, fields)[2]),
+        ('POST', change_before,
+         lambda: after._formulate_change(path, dict(fields, op='update'))),
+    ]
+    print('{0:<16} {1:>12} {2:>12} {3:>8}'.format(
+        'case', 'before us', 'after us', 'speedup'))
+    for name, slow, fast in cases:
+        slow_us = min(timeit.repeat(slow, number=args.number, repeat=3)) \
+            / args.number * 1e6
+        fast_us = min(timeit.repeat(fast, number=args.number, repeat=3)) \
+            / args.number * 1e6
+        print('{0:<16} {1:>12.1f} {2:>12.1f} {3:>7.1f}x'.format(
+            name, slow_us, fast_us, slow_us / fast_us))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of maasng.create_boot_sources_selections, which creates the
+missing boot-source selections with a single import.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+import io
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+import maasng  # noqa: E402
+
+URL = 'http://images.maas.io/ephemeral-v3/daily/'
+
+
+class Client(object):
+    '''
+    A region with one boot-source and its ``selections``.
+    '''
+
+    def __init__(self, selections):
+        self.selections = selections
+        self.requests = []
+
+    def get(self, path, op=None, **params):
+        self.requests.append(('GET', path))
+        if path == 'api/2.0/boot-sources/':
+            body = [{'id': 1, 'url': URL}]
+        else:
+            body = self.selections
+        return io.BytesIO(json.dumps(body).encode('utf-8'))
+
+    def post(self, path, op, **data):
+        self.requests.append(('POST', path))
+        selection = dict(data, id=len(self.selections) + 1)
+        self.selections.append(selection)
+        return io.BytesIO(json.dumps(selection).encode('utf-8'))
+
+
+class SelectionKeyTest(unittest.TestCase):
+
+    def test_requested_and_listed_forms_match(self):
+        self.assertEqual(
+            maasng._selection_key({'os': 'ubuntu', 'release': 'xenial',
+                                   'arches': '"i386", amd64'}),
+            maasng._selection_key({'os': 'ubuntu', 'release': 'xenial',
+                                   'arches': ['amd64', 'i386'],
+                                   'subarches': ['*'], 'labels': ['*']}))
+
+    def test_release_is_part_of_the_key(self):
+        self.assertNotEqual(
+            maasng._selection_key({'os': 'ubuntu', 'release': 'xenial'}),
+            maasng._selection_key({'os': 'ubuntu', 'release': 'bionic'}))
+
+
+class CreateBootSourcesSelectionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client([{
+            'id': 1, 'os': 'ubuntu', 'release': 'xenial',
+            'arches': ['amd64'], 'subarches': ['*'], 'labels': ['*']}])
+        self.imports = []
+        self.import_result = True
+        self.saved = (maasng._create_maas_client,
+                      maasng.boot_resources_import, maasng.time.sleep)
+        maasng._create_maas_client = lambda *args: self.client
+        maasng.boot_resources_import = self.boot_resources_import
+        maasng.time.sleep = lambda seconds: None
+
+    def tearDown(self):
+        (maasng._create_maas_client, maasng.boot_resources_import,
+         maasng.time.sleep) = self.saved
+
+    def boot_resources_import(self, action, wait):
+        self.imports.append((action, wait))
+        return self.import_result
+
+    def test_missing_selections_share_one_listing_and_one_import(self):
+        ret = maasng.create_boot_sources_selections([
+            {'url': URL, 'os': 'ubuntu', 'release': 'xenial',
+             'arches': 'amd64'},
+            {'url': URL, 'os': 'ubuntu', 'release': 'bionic',
+             'arches': 'amd64'},
+            {'url': URL, 'os': 'ubuntu', 'release': 'focal'},
+            {'url': URL, 'os': 'ubuntu', 'release': 'focal'},
+        ])
+        self.assertTrue(ret['result'])
+        self.assertEqual([s['release'] for s in ret['new']],
+                         ['bionic', 'focal'])
+        self.assertEqual(len(ret['existing']), 2)
+        self.assertEqual(self.client.requests, [
+            ('GET', 'api/2.0/boot-sources/'),
+            ('GET', 'api/2.0/boot-sources/1/selections/'),
+            ('POST', 'api/2.0/boot-sources/1/selections/'),
+            ('POST', 'api/2.0/boot-sources/1/selections/')])
+        self.assertEqual(self.imports, [('import', True)])
+
+    def test_nothing_missing_nothing_imported(self):
+        ret = maasng.create_boot_sources_selections([
+            {'url': URL, 'os': 'ubuntu', 'release': 'xenial',
+             'arches': 'amd64'}])
+        self.assertTrue(ret['result'])
+        self.assertEqual(self.imports, [])
+
+    def test_unknown_boot_source_and_failed_import_are_errors(self):
+        self.import_result = {'result': False, 'comment': 'import failed'}
+        ret = maasng.create_boot_sources_selections([
+            {'url': 'http://mirror/', 'os': 'ubuntu', 'release': 'xenial'},
+            {'url': URL, 'os': 'ubuntu', 'release': 'bionic'}])
+        self.assertFalse(ret['result'])
+        self.assertEqual(ret['errors'], ['boot-source:http://mirror/ not '
+                                         'exist!', 'import failed'])
+        self.assertEqual(len(ret['new']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of maas_client.RecordingDispatcher and ReplayDispatcher: what a
+recorded cassette replays and how requests are matched to it.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+from io import BytesIO
+import httplib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import urllib2
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+from maas_client import (  # noqa: E402
+    CassetteMiss,
+    RecordingDispatcher,
+    ReplayDispatcher,
+)
+
+
+class Dispatcher(object):
+    '''
+    Answer with the next of ``responses``, a list of `(code, body)`.
+    '''
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    def dispatch_query(self, request_url, headers, method='GET', data=None):
+        code, body = self.responses.pop(0)
+        info = httplib.HTTPMessage(BytesIO(
+            b'Content-Type: application/json\r\n\r\n'))
+        if code != 200:
+            raise urllib2.HTTPError(request_url, code, 'error', info,
+                                    BytesIO(body))
+        return urllib2.addinfourl(BytesIO(body), info, request_url, code)
+
+
+class CassetteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.cassette = os.path.join(self.workdir, 'region.jsonl.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def record(self, *exchanges):
+        '''
+        Record `(method, url, code, body)` exchanges into the cassette.
+        '''
+        recorder = RecordingDispatcher(self.cassette, Dispatcher(
+            (code, body) for _, _, code, body in exchanges))
+        for method, url, code, body in exchanges:
+            try:
+                res = recorder.dispatch_query(url, {}, method=method)
+            except urllib2.HTTPError as error:
+                res = error
+            # The caller still gets the whole response.
+            self.assertEqual((res.code, res.read()), (code, body))
+        recorder.close()
+        return ReplayDispatcher(self.cassette)
+
+    def test_keys_ignore_host_and_query_order(self):
+        replay = self.record((
+            'GET', 'http://10.0.0.11:5240/MAAS/api/2.0/machines/'
+            '?op=list&hostname=kvm01', 200, b'[1]'))
+        res = replay.dispatch_query(
+            'http://maas/MAAS/api/2.0/machines/?hostname=kvm01&op=list', {})
+        self.assertEqual(res.read(), b'[1]')
+        self.assertEqual(res.info()['Content-Type'], 'application/json')
+        self.assertEqual(list(replay.requests.values()), [1])
+
+    def test_method_and_path_are_part_of_the_key(self):
+        replay = self.record(
+            ('GET', 'http://maas/MAAS/api/2.0/machines/', 200, b'[]'))
+        with self.assertRaises(CassetteMiss):
+            replay.dispatch_query('http://maas/MAAS/api/2.0/machines/', {},
+                                  method='POST')
+        with self.assertRaises(CassetteMiss):
+            replay.dispatch_query('http://maas/MAAS/api/2.0/devices/', {})
+        self.assertEqual(sum(replay.misses.values()), 2)
+
+    def test_recordings_are_replayed_in_order_then_repeated(self):
+        url = 'http://maas/MAAS/api/2.0/machines/abc/'
+        replay = self.record(('GET', url, 200, b'"Deploying"'),
+                             ('GET', url, 200, b'"Deployed"'))
+        self.assertEqual([replay.dispatch_query(url, {}).read()
+                          for _ in range(3)],
+                         [b'"Deploying"', b'"Deployed"', b'"Deployed"'])
+
+    def test_http_errors_are_replayed(self):
+        url = 'http://maas/MAAS/api/2.0/machines/abc/?op=deploy'
+        replay = self.record(('POST', url, 409, b'busy'))
+        with self.assertRaises(urllib2.HTTPError) as raised:
+            replay.dispatch_query(url, {}, method='POST')
+        self.assertEqual(raised.exception.code, 409)
+        self.assertEqual(raised.exception.read(), b'busy')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of maas.CheckpointJournal and of the deploy run resuming from
+it.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+from collections import defaultdict
+from io import BytesIO
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+import maas  # noqa: E402
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def test_key_order_does_not_matter(self):
+        self.assertEqual(
+            maas._fingerprint({'a': 1, 'b': {'c': [1, 2], 'd': None}}),
+            maas._fingerprint({'b': {'d': None, 'c': [1, 2]}, 'a': 1}))
+
+    def test_any_change_does(self):
+        self.assertNotEqual(maas._fingerprint({'a': [1, 2]}),
+                            maas._fingerprint({'a': [2, 1]}))
+        self.assertNotEqual(maas._fingerprint({'a': 1}),
+                            maas._fingerprint({'a': '1'}))
+
+    def test_values_json_cannot_encode(self):
+        self.assertEqual(maas._fingerprint({'a': set([1])}),
+                         maas._fingerprint({'a': set([1])}))
+
+
+class CheckpointJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, 'journals', 'run.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_steps_survive_the_run(self):
+        journal = maas.CheckpointJournal(self.path)
+        journal.record('kvm01', 'f1', 'allocated')
+        journal.record('kvm02', 'f2')
+        journal.flush()
+        journal = maas.CheckpointJournal(self.path)
+        self.assertEqual(journal.step('kvm01', 'f1'), 'allocated')
+        self.assertFalse(journal.is_done('kvm01', 'f1'))
+        self.assertTrue(journal.is_done('kvm02', 'f2'))
+        self.assertIsNone(journal.step('kvm03', 'f3'))
+
+    def test_steps_for_another_pillar_are_ignored(self):
+        journal = maas.CheckpointJournal(self.path)
+        journal.record('kvm01', 'f1')
+        self.assertIsNone(journal.step('kvm01', 'changed'))
+        self.assertFalse(journal.is_done('kvm01', 'changed'))
+
+    def test_forgetting_every_object_removes_the_file(self):
+        journal = maas.CheckpointJournal(self.path)
+        journal.record('kvm01', 'f1')
+        journal.record('kvm02', 'f2')
+        journal.flush()
+        journal.forget(['kvm01'])
+        self.assertEqual(list(maas.CheckpointJournal(self.path).steps),
+                         ['kvm02'])
+        journal.forget(['kvm02'])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_corrupted_journal_is_ignored(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as fd:
+            fd.write('{"kvm01": ')
+        self.assertEqual(maas.CheckpointJournal(self.path).steps, {})
+
+
+class Client(object):
+    '''
+    List ``machines`` and record the POSTs; deploys fail while ``broken``.
+    '''
+
+    def __init__(self, machines):
+        self.machines = machines
+        self.writes = defaultdict(int)
+        self.posts = []
+        self.broken = False
+
+    def get(self, path, op=None, **params):
+        return BytesIO(json.dumps(self.machines).encode('utf-8'))
+
+    def post(self, path, op, **data):
+        self.posts.append(op)
+        if op == 'deploy' and self.broken:
+            raise Exception('deploy refused')
+        return BytesIO(b'{}')
+
+
+class DeployResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.client = Client([{'hostname': 'kvm01', 'system_id': 'abc',
+                               'status': maas.DeployMachines.READY}])
+        self.machines = {'kvm01': {'distro_series': 'xenial'}}
+        maas.__salt__ = {'config.get': lambda key, default=None: {
+            'region': {'machines': self.machines}}}
+        self.saved = maas.JOURNAL_DIR, maas._create_maas_client
+        maas.JOURNAL_DIR = self.workdir
+        maas._create_maas_client = lambda: self.client
+        maas._prefetched.clear()
+
+    def tearDown(self):
+        maas.JOURNAL_DIR, maas._create_maas_client = self.saved
+        maas._prefetched.clear()
+        del maas.__salt__
+        shutil.rmtree(self.workdir)
+
+    def fail_after_allocate(self):
+        self.client.broken = True
+        with self.assertRaises(Exception):
+            maas.DeployMachines().process()
+        self.client.broken = False
+        self.client.machines[0]['status'] = maas.DeployMachines.ALLOCATED
+        del self.client.posts[:]
+
+    def test_machine_allocated_by_a_failed_run_is_deployed(self):
+        self.fail_after_allocate()
+        ret = maas.DeployMachines().process()
+        self.assertEqual(ret['success'], ['kvm01'])
+        self.assertEqual(self.client.posts, ['deploy'])
+        self.assertFalse(os.path.exists(
+            os.path.join(self.workdir, 'deploy_machines.journal')))
+
+    def test_machine_allocated_for_another_pillar_is_not_deployed(self):
+        self.fail_after_allocate()
+        self.machines['kvm01']['distro_series'] = 'bionic'
+        with self.assertRaises(Exception) as raised:
+            maas.DeployMachines().process()
+        self.assertEqual(raised.exception.args[0]['errors'],
+                         {'kvm01': 'Not in ready state'})
+        self.assertEqual(self.client.posts, [])
+
+    def test_machine_allocated_by_someone_else_is_not_deployed(self):
+        self.client.machines[0]['status'] = maas.DeployMachines.ALLOCATED
+        with self.assertRaises(Exception):
+            maas.DeployMachines().process()
+        self.assertEqual(self.client.posts, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of the process-wide client registry of maas_client.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+from maas_client import (  # noqa: E402
+    ClientRegistry,
+    MAASDispatcher,
+    RequestGovernor,
+    ResponseCache,
+)
+
+
+class ClientRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.credentials = os.path.join(self.workdir, 'maas-credentials')
+        self.write_credentials('consumer:token:secret')
+        self.registry = ClientRegistry()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def write_credentials(self, key):
+        with open(self.credentials, 'w') as fd:
+            fd.write('admin\n{0}\n'.format(key))
+
+    def get(self, **settings):
+        return self.registry.get_client(
+            'http://maas/MAAS', self.credentials, **settings)
+
+    def test_same_settings_share_the_client(self):
+        governor = RequestGovernor()
+        self.assertIs(self.get(governor=governor), self.get(governor=governor))
+
+    def test_other_settings_do_not_reconfigure_the_shared_client(self):
+        governor = RequestGovernor()
+        cache = ResponseCache()
+        dispatcher = MAASDispatcher()
+        shared = self.get(governor=governor, cache=cache)
+        other = self.get(governor=RequestGovernor(), dispatcher=dispatcher)
+        self.assertIsNot(shared, other)
+        self.assertIs(shared.governor, governor)
+        self.assertIs(shared.cache, cache)
+        self.assertIsNot(shared.dispatcher, dispatcher)
+        self.assertIs(other.dispatcher, dispatcher)
+        self.assertIsNone(other.cache)
+
+    def test_rewritten_credentials_build_a_new_client(self):
+        client = self.get()
+        self.write_credentials('consumer2:token2:secret2')
+        stat = os.stat(self.credentials)
+        os.utime(self.credentials, (stat.st_atime, time.time() + 10))
+        renewed = self.get()
+        self.assertIsNot(client, renewed)
+        self.assertEqual(renewed.auth.consumer_token.key, 'consumer2')
+
+
+if __name__ == '__main__':
+    unittest.main()
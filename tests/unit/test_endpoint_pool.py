@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of the failover of maas_client.EndpointPool.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+from io import BytesIO
+import httplib
+import os
+import socket
+import sys
+import unittest
+import urllib2
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+from maas_client import EndpointPool  # noqa: E402
+
+REGIONS = ['http://10.0.0.11:5240/MAAS', 'http://10.0.0.12:5240/MAAS']
+
+
+class Dispatcher(object):
+    '''
+    Answer every request, except for the region URLs in ``down`` which
+    raise their exception.
+    '''
+
+    def __init__(self, down=None):
+        self.down = down or {}
+        self.sent = []
+
+    def dispatch_query(self, request_url, headers, method='GET', data=None):
+        self.sent.append((method, request_url))
+        for url, error in self.down.items():
+            if request_url.startswith(url):
+                raise error
+        return urllib2.addinfourl(
+            BytesIO(b'[]'), httplib.HTTPMessage(BytesIO(b'\r\n')),
+            request_url, 200)
+
+
+class EndpointPoolTest(unittest.TestCase):
+
+    path = '/MAAS/api/2.0/machines/'
+
+    def test_reads_are_spread_over_the_endpoints(self):
+        dispatcher = Dispatcher()
+        pool = EndpointPool(dispatcher, REGIONS)
+        for _ in range(4):
+            pool.dispatch_query('http://maas' + self.path, {})
+        used = [url.split('/MAAS')[0] for _, url in dispatcher.sent]
+        self.assertEqual(sorted(set(used)),
+                         ['http://10.0.0.11:5240', 'http://10.0.0.12:5240'])
+
+    def test_unreachable_endpoint_is_ejected_and_request_retried(self):
+        dispatcher = Dispatcher(
+            {REGIONS[0]: urllib2.URLError('connection refused')})
+        pool = EndpointPool(dispatcher, REGIONS, eject_for=60)
+        for method in ('GET', 'POST', 'GET'):
+            response = pool.dispatch_query(
+                'http://maas' + self.path, {}, method=method)
+            self.assertTrue(response.geturl().startswith(REGIONS[1]))
+        status = dict((endpoint['url'], endpoint)
+                      for endpoint in pool.status())
+        self.assertTrue(status[REGIONS[0]]['ejected'])
+        self.assertEqual(status[REGIONS[0]]['errors'], 1)
+        self.assertTrue(status[REGIONS[1]]['writer'])
+
+    def test_last_error_is_raised_when_every_endpoint_fails(self):
+        refused = urllib2.URLError('connection refused')
+        dispatcher = Dispatcher(dict((url, refused) for url in REGIONS))
+        pool = EndpointPool(dispatcher, REGIONS)
+        with self.assertRaises(urllib2.URLError) as raised:
+            pool.dispatch_query('http://maas' + self.path, {})
+        self.assertIs(raised.exception, refused)
+        self.assertEqual(len(dispatcher.sent), 2)
+
+    def test_broken_write_is_not_retried(self):
+        dispatcher = Dispatcher(
+            dict((url, socket.error('reset')) for url in REGIONS))
+        pool = EndpointPool(dispatcher, REGIONS)
+        with self.assertRaises(socket.error):
+            pool.dispatch_query('http://maas' + self.path, {}, method='POST')
+        self.assertEqual(len(dispatcher.sent), 1)
+
+    def test_timeout_does_not_eject(self):
+        dispatcher = Dispatcher({REGIONS[0]: socket.timeout('timed out')})
+        pool = EndpointPool(dispatcher, REGIONS)
+        with self.assertRaises(socket.timeout):
+            pool.dispatch_query('http://maas' + self.path, {}, method='POST')
+        self.assertFalse(any(endpoint['ejected']
+                             for endpoint in pool.status()))
+
+    def test_http_errors_are_answers(self):
+        error = urllib2.HTTPError(
+            REGIONS[0], 404, 'Not Found',
+            httplib.HTTPMessage(BytesIO(b'\r\n')), BytesIO(b''))
+        dispatcher = Dispatcher({REGIONS[0]: error})
+        pool = EndpointPool(dispatcher, REGIONS)
+        with self.assertRaises(urllib2.HTTPError):
+            pool.dispatch_query('http://maas' + self.path, {}, method='PUT')
+        self.assertEqual(len(dispatcher.sent), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of maasng.export_metrics, the node-exporter textfile written by
+the maas engine.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+import maasng  # noqa: E402
+
+
+class Client(object):
+    '''
+    Serve the listings in ``listings`` and record the requests.
+    '''
+
+    def __init__(self, listings):
+        self.listings = listings
+        self.requests = []
+
+    def get(self, path, op=None, **params):
+        self.requests.append((path, op))
+        return io.BytesIO(json.dumps(self.listings[path]).encode('utf-8'))
+
+
+class ExportMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, 'maas.prom')
+        subnet = {'cidr': '10.0.0.0/24'}
+        self.client = Client({
+            'api/2.0/subnets/': [subnet],
+            'api/2.0/ipranges/': [
+                {'subnet': subnet, 'type': 'dynamic',
+                 'start_ip': '10.0.0.10', 'end_ip': '10.0.0.100'},
+                {'subnet': subnet, 'type': 'dynamic',
+                 'start_ip': '10.0.0.50', 'end_ip': '10.0.0.137'}],
+        })
+        self.saved = maasng._create_maas_client
+        maasng._create_maas_client = lambda: self.client
+
+    def tearDown(self):
+        maasng._create_maas_client = self.saved
+        shutil.rmtree(self.workdir)
+
+    def lines(self):
+        with io.open(self.path, encoding='utf-8') as fd:
+            return [line for line in fd.read().splitlines()
+                    if not line.startswith('#')]
+
+    def test_polled_state_is_not_listed_again(self):
+        ret = maasng.export_metrics(
+            path=self.path, stats_path=None,
+            machines={'kvm01': 'Deployed', 'kvm02': 'Deployed',
+                      'kvm03': 'Ready'},
+            racks={'rack02': 'syncing', 'rack01': 'synced'},
+            importing=False)
+        self.assertEqual(sorted(self.client.requests), [
+            ('api/2.0/ipranges/', None), ('api/2.0/subnets/', None)])
+        self.assertEqual(ret['machines'], 3)
+        lines = self.lines()
+        self.assertIn('maas_machines{status="Deployed"} 2', lines)
+        self.assertIn('maas_machines{status="Ready"} 1', lines)
+        self.assertIn('maas_rack_boot_images_synced'
+                      '{rack="rack01",status="synced"} 1', lines)
+        self.assertIn('maas_rack_boot_images_synced'
+                      '{rack="rack02",status="syncing"} 0', lines)
+        self.assertIn('maas_boot_resources_importing 0', lines)
+        # Overlapping ranges are counted once.
+        self.assertIn('maas_iprange_addresses'
+                      '{subnet="10.0.0.0/24",type="dynamic"} 128', lines)
+
+    def test_state_not_passed_is_read_from_the_api(self):
+        self.client.listings.update({
+            'api/2.0/rackcontrollers/': [
+                {'hostname': 'rack01', 'system_id': 'r4ck'}],
+            'api/2.0/rackcontrollers/r4ck/': {'status': 'synced'},
+            'api/2.0/boot-resources/': True,
+        })
+        maasng.export_metrics(path=self.path, stats_path=None, machines={})
+        self.assertIn(('api/2.0/rackcontrollers/r4ck/', 'list_boot_images'),
+                      self.client.requests)
+        self.assertIn(('api/2.0/boot-resources/', 'is_importing'),
+                      self.client.requests)
+        self.assertIn('maas_boot_resources_importing 1', self.lines())
+
+
+if __name__ == '__main__':
+    unittest.main()
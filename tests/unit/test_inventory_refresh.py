@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of maas_inventory.get_inventory refreshing the machine
+inventory from the events logged by the region.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+from collections import Counter
+from io import BytesIO
+import httplib
+import json
+import os
+import sys
+import unittest
+import urllib2
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+import maas_inventory  # noqa: E402
+
+
+class Client(object):
+    '''
+    A region with ``machines`` by system_id and the ``events`` logged.
+    '''
+
+    url = 'http://maas:5240/MAAS'
+
+    def __init__(self, machines, events=()):
+        self.machines = dict((m['system_id'], m) for m in machines)
+        self.events = list(events)
+        self.writes = Counter()
+        self.requests = []
+
+    def get(self, path, op=None, **params):
+        self.requests.append(path if op is None else (path, op))
+        if path == 'api/2.0/events/':
+            events = [e for e in self.events
+                      if e['id'] > int(params.get('after', -1))]
+            if 'after' not in params:
+                events = events[-int(params['limit']):]
+            body = {'events': events[:int(params['limit'])]}
+        elif path == 'api/2.0/machines/':
+            body = list(self.machines.values())
+        else:
+            system_id = path.split('/')[-2]
+            if system_id not in self.machines:
+                raise urllib2.HTTPError(
+                    path, 404, 'Not Found',
+                    httplib.HTTPMessage(BytesIO(b'\r\n')), BytesIO(b''))
+            body = self.machines[system_id]
+        return BytesIO(json.dumps(body).encode('utf-8'))
+
+    def log(self, system_id):
+        self.events.append({'id': len(self.events) + 1, 'node': system_id})
+
+
+def machine(hostname, system_id, status_name='Ready'):
+    return {'hostname': hostname, 'system_id': system_id,
+            'status_name': status_name}
+
+
+class InventoryRefreshTest(unittest.TestCase):
+
+    def setUp(self):
+        maas_inventory.invalidate_inventory()
+        self.client = Client([machine('kvm01', 'abc'),
+                              machine('kvm02', 'def')])
+        self.client.log('abc')
+        self.inventory = maas_inventory.get_inventory(self.client)
+        del self.client.requests[:]
+
+    def tearDown(self):
+        maas_inventory.invalidate_inventory()
+
+    def refresh(self):
+        return maas_inventory.get_inventory(self.client, refresh=True)
+
+    def test_inventory_is_reused_within_max_age(self):
+        self.assertIs(maas_inventory.get_inventory(self.client),
+                      self.inventory)
+        self.assertEqual(self.client.requests, [])
+
+    def test_only_nodes_named_by_new_events_are_fetched(self):
+        self.client.machines['abc']['status_name'] = 'Deploying'
+        self.client.machines['ghi'] = machine('kvm03', 'ghi')
+        self.client.log('abc')
+        self.client.log('ghi')
+        self.client.log(None)
+        inventory = self.refresh()
+        self.assertEqual(sorted(self.client.requests[1:]), [
+            'api/2.0/machines/abc/', 'api/2.0/machines/ghi/'])
+        self.assertEqual(inventory.get('kvm01').status_name, 'Deploying')
+        self.assertEqual(inventory.get('kvm03').system_id, 'ghi')
+        self.assertEqual(inventory.cursor, 4)
+        # Readers of the previous inventory are not disturbed.
+        self.assertEqual(self.inventory.get('kvm01').status_name, 'Ready')
+        self.assertIsNone(self.inventory.get('kvm03'))
+
+    def test_deleted_machines_are_dropped(self):
+        del self.client.machines['def']
+        self.client.log('def')
+        inventory = self.refresh()
+        self.assertIsNone(inventory.get('kvm02'))
+        self.assertEqual(len(inventory), 1)
+
+    def test_no_event_no_fetch(self):
+        inventory = self.refresh()
+        self.assertEqual(self.client.requests,
+                         [('api/2.0/events/', 'query')])
+        self.assertEqual(len(inventory), 2)
+
+    def test_too_many_changes_list_every_machine(self):
+        limit = maas_inventory.DELTA_MAX_NODES
+        maas_inventory.DELTA_MAX_NODES = 1
+        try:
+            self.client.log('abc')
+            self.client.log('def')
+            self.refresh()
+        finally:
+            maas_inventory.DELTA_MAX_NODES = limit
+        self.assertIn('api/2.0/machines/', self.client.requests)
+        self.assertNotIn('api/2.0/machines/abc/', self.client.requests)
+
+    def test_writes_through_the_client_list_every_machine(self):
+        self.client.writes['machines'] += 1
+        inventory = maas_inventory.get_inventory(self.client)
+        self.assertIsNot(inventory, self.inventory)
+        self.assertIn('api/2.0/machines/', self.client.requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of maas_inventory.MacIndex, the MAC address to node index.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+from maas_inventory import MacIndex  # noqa: E402
+
+
+def node(hostname, system_id, *macs):
+    return {'hostname': hostname, 'system_id': system_id,
+            'interface_set': [{'id': index, 'mac_address': mac}
+                              for index, mac in enumerate(macs, 1)]}
+
+
+class MacIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = MacIndex(
+            [node('kvm01', 'abc', '52:54:00:AA:00:01', '52:54:00:aa:00:02'),
+             {'hostname': 'kvm02', 'system_id': 'def',
+              'interface_set': [{'id': 1, 'mac_address': None}]}],
+            [node('switch01', 'xyz', '52:54:00:bb:00:01')])
+
+    def test_lookup_ignores_case_and_covers_devices(self):
+        entry = self.index.get('52:54:00:aa:00:01')
+        self.assertEqual((entry.kind, entry.hostname, entry.system_id,
+                          entry.nic_id), ('machine', 'kvm01', 'abc', 1))
+        self.assertEqual(self.index.get('52:54:00:BB:00:01').kind, 'device')
+        self.assertEqual(self.index.macs('abc'),
+                         set(['52:54:00:aa:00:01', '52:54:00:aa:00:02']))
+        self.assertEqual(self.index.macs('def'), set())
+
+    def test_nic_id_only_for_the_owner(self):
+        self.assertEqual(self.index.nic_id('abc', '52:54:00:AA:00:02'), 2)
+        self.assertIsNone(self.index.nic_id('xyz', '52:54:00:aa:00:02'))
+        self.assertIsNone(self.index.nic_id('abc', '52:54:00:ff:ff:ff'))
+
+    def test_conflicts_name_the_other_owner(self):
+        conflicts = self.index.conflicts(
+            'kvm03', ['52:54:00:aa:00:02', '52:54:00:cc:00:01'])
+        self.assertEqual(list(conflicts), ['52:54:00:aa:00:02'])
+        self.assertEqual(conflicts['52:54:00:aa:00:02'].hostname, 'kvm01')
+        self.assertEqual(
+            self.index.conflicts('kvm01', ['52:54:00:aa:00:02']), {})
+
+    def test_adding_a_node_again_reindexes_it(self):
+        self.index.add_node('machine', node('kvm01', 'abc',
+                                            '52:54:00:aa:00:03'))
+        self.assertIsNone(self.index.get('52:54:00:aa:00:01'))
+        self.assertEqual(self.index.get('52:54:00:aa:00:03').hostname,
+                         'kvm01')
+
+    def test_removing_nodes_sharing_a_mac(self):
+        # The device was given the MAC of the machine, and indexed last.
+        self.index.add_node('device', node('vm01', 'vvv',
+                                           '52:54:00:aa:00:01'))
+        self.index.remove_node('abc')
+        self.assertEqual(self.index.get('52:54:00:aa:00:01').hostname,
+                         'vm01')
+        self.assertIsNone(self.index.get('52:54:00:aa:00:02'))
+        self.index.remove_node('vvv')
+        self.assertIsNone(self.index.get('52:54:00:aa:00:01'))
+        self.index.remove_node('vvv')
+
+
+if __name__ == '__main__':
+    unittest.main()
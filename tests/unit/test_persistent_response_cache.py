@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of maas_client.PersistentResponseCache, the response cache
+shared by the salt processes of a minion through files.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+from io import BytesIO
+import fcntl
+import httplib
+import marshal
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib2
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+from maas_client import (  # noqa: E402
+    MAASClient,
+    MAASOAuth,
+    PersistentResponseCache,
+)
+
+MAAS_URL = 'http://maas:5240/MAAS'
+
+
+class Dispatcher(object):
+    '''
+    Serve ``bodies`` by path with a fixed ETag, answering 304 to a request
+    carrying it.
+    '''
+
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.sent = []
+
+    def dispatch_query(self, request_url, headers, method='GET', data=None):
+        path = request_url[len(MAAS_URL):].split('?')[0]
+        self.sent.append((method, path, headers.get('If-None-Match')))
+        info = httplib.HTTPMessage(BytesIO(b'\r\n'))
+        if method != 'GET':
+            return urllib2.addinfourl(BytesIO(b'{}'), info, request_url, 200)
+        if headers.get('If-None-Match') == '"v1"':
+            raise urllib2.HTTPError(request_url, 304, 'Not Modified', info,
+                                    BytesIO(b''))
+        info[b'ETag'] = b'"v1"'
+        return urllib2.addinfourl(BytesIO(self.bodies[path]), info,
+                                  request_url, 200)
+
+
+class PersistentResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.dispatcher = Dispatcher({
+            '/api/2.0/machines/': b'[{"hostname": "kvm01"}]',
+            '/api/2.0/fabrics/': b'[{"name": "fabric-0"}]',
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def process(self, **config):
+        '''
+        Return a client with a cache of its own, as in a new salt process.
+        '''
+        config.setdefault('path', self.workdir)
+        return MAASClient(MAASOAuth('consumer', 'token', 'secret'),
+                          self.dispatcher, MAAS_URL,
+                          cache=PersistentResponseCache(config))
+
+    def test_fresh_entries_are_shared_with_the_next_process(self):
+        self.process().get('api/2.0/fabrics/').read()
+        body = self.process().get('api/2.0/fabrics/').read()
+        self.assertEqual(body, b'[{"name": "fabric-0"}]')
+        self.assertEqual(len(self.dispatcher.sent), 1)
+
+    def test_validators_are_shared_with_the_next_process(self):
+        self.process().get('api/2.0/machines/').read()
+        body = self.process().get('api/2.0/machines/').read()
+        self.assertEqual(body, b'[{"hostname": "kvm01"}]')
+        self.assertEqual(self.dispatcher.sent[1],
+                         ('GET', '/api/2.0/machines/', '"v1"'))
+
+    def test_writes_invalidate_other_processes(self):
+        reader = self.process()
+        reader.get('api/2.0/fabrics/').read()
+        self.process().post('api/2.0/vlans/', None, vid='10')
+        self.assertFalse(os.path.exists(
+            os.path.join(self.workdir, 'fabrics.cache')))
+        reader.get('api/2.0/fabrics/').read()
+        self.assertEqual(self.dispatcher.sent[-1],
+                         ('GET', '/api/2.0/fabrics/', None))
+
+    def test_files_of_another_version_are_ignored(self):
+        with open(os.path.join(self.workdir, 'fabrics.cache'), 'wb') as fd:
+            marshal.dump({'version': 0, 'entries': {
+                '/api/2.0/fabrics/': 'garbage'}}, fd)
+        self.process().get('api/2.0/fabrics/').read()
+        self.assertEqual(len(self.dispatcher.sent), 1)
+
+    def test_entries_past_max_age_are_dropped_from_the_files(self):
+        cache = PersistentResponseCache({'path': self.workdir,
+                                         'max_age': 60})
+        client = MAASClient(MAASOAuth('consumer', 'token', 'secret'),
+                            self.dispatcher, MAAS_URL, cache=cache)
+        client.get('api/2.0/machines/').read()
+        client.get('api/2.0/machines/', 'list_allocated').read()
+        cache.lookup('/api/2.0/machines/')['stored_at'] -= 120
+        cache._write_through('/api/2.0/machines/')
+        client.get('api/2.0/machines/', 'power_parameters').read()
+        with open(os.path.join(self.workdir, 'machines.cache'), 'rb') as fd:
+            keys = sorted(marshal.load(fd)['entries'])
+        self.assertEqual(keys, ['/api/2.0/machines/?op=list_allocated',
+                                '/api/2.0/machines/?op=power_parameters'])
+
+    def test_readers_wait_for_the_writer_lock(self):
+        self.process().get('api/2.0/fabrics/').read()
+        reader = self.process()
+        done = threading.Event()
+
+        def read():
+            reader.get('api/2.0/fabrics/').read()
+            done.set()
+
+        with open(os.path.join(self.workdir, 'fabrics.cache.lock'),
+                  'ab') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            thread = threading.Thread(target=read)
+            thread.start()
+            time.sleep(0.2)
+            self.assertFalse(done.is_set())
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        thread.join(5)
+        self.assertTrue(done.is_set())
+        self.assertEqual(len(self.dispatcher.sent), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
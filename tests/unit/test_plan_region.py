@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of maas.plan_region, which computes the writes of a run
+without making any.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+from io import BytesIO
+import httplib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import urllib2
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+import maas  # noqa: E402
+from maas_client import (  # noqa: E402
+    MAASClient,
+    MAASOAuth,
+    WriteBlocked,
+)
+
+MAAS_URL = 'http://maas:5240/MAAS'
+
+
+class Dispatcher(object):
+    '''
+    Serve ``listings`` by path and record every request.
+    '''
+
+    def __init__(self, listings):
+        self.listings = listings
+        self.sent = []
+
+    def dispatch_query(self, request_url, headers, method='GET', data=None):
+        path = request_url[len(MAAS_URL):].split('?')[0]
+        self.sent.append((method, path))
+        return urllib2.addinfourl(
+            BytesIO(json.dumps(self.listings[path]).encode('utf-8')),
+            httplib.HTTPMessage(BytesIO(b'\r\n')), request_url, 200)
+
+
+class PlanRegionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.dispatcher = Dispatcher({
+            '/api/2.0/fabrics/': [{'id': 3, 'name': 'fabric-0', 'vlans': [
+                {'id': 5001, 'vid': 0, 'name': 'untagged'}]}],
+            '/api/2.0/rackcontrollers/': [],
+            '/api/2.0/subnets/': [],
+            '/api/2.0/ipranges/': [],
+        })
+        self.client = MAASClient(MAASOAuth('consumer', 'token', 'secret'),
+                                 self.dispatcher, MAAS_URL)
+        region = {
+            'fabrics': {
+                'fabric-0': {'description': 'pxe', 'vlans': {
+                    0: {'description': 'untagged', 'dhcp': True}}},
+                'fabric-1': {'description': 'storage'},
+            },
+            'subnets': {'pxe': {
+                'cidr': '10.0.0.0/24', 'fabric': 'fabric-0',
+                'gateway_ip': '10.0.0.1', 'ipranges': {'dynamic': {
+                    'start': '10.0.0.10', 'end': '10.0.0.100'}}}},
+            'boot_resources': {'custom': {}},
+        }
+        maas.__salt__ = {'config.get': lambda key, default=None: {
+            'region': region}}
+        self.saved = maas._create_maas_client
+        maas._create_maas_client = lambda: self.client
+        maas._prefetched.clear()
+
+    def tearDown(self):
+        maas._create_maas_client = self.saved
+        maas._prefetched.clear()
+        del maas.__salt__
+        shutil.rmtree(self.workdir)
+
+    def test_nothing_but_reads_reach_the_region(self):
+        report = maas.plan_region(stats_file=None)
+        self.assertEqual(set(method for method, _ in self.dispatcher.sent),
+                         set(['GET']))
+        self.assertEqual(report['estimate']['reads'],
+                         len(self.dispatcher.sent))
+
+    def test_writes_are_planned_per_step(self):
+        report = maas.plan_region(stats_file=None)
+        self.assertEqual(sorted(report['fabrics']['create']), ['fabric-1'])
+        self.assertEqual(report['fabrics']['update'], ['fabric-0'])
+        self.assertEqual(report['vlans']['update'], ['fabric-0.0'])
+        self.assertEqual(report['subnets']['create'], ['10.0.0.0/24'])
+        self.assertEqual(report['subnets']['planned'], [{
+            'object': '10.0.0.0/24', 'method': 'POST',
+            'path': 'api/2.0/subnets/', 'op': None}])
+        # The subnet of the range is only planned.
+        self.assertEqual(list(report['ipranges']['errors']), ['10.0.0.10'])
+        self.assertEqual(report['excluded'], {
+            'boot_resources': maas.PLAN_EXCLUDED['boot_resources']})
+        writes = sum(len(report[step]['planned']) for step in
+                     ('fabrics', 'vlans', 'subnets', 'ipranges',
+                      'vlans_dhcp'))
+        self.assertEqual(report['estimate']['writes'], writes)
+
+    def test_estimate_uses_the_recorded_latency(self):
+        stats_file = os.path.join(self.workdir, 'api_stats.json')
+        with open(stats_file, 'w') as fd:
+            json.dump({'endpoints': {
+                'POST /MAAS/api/2.0/subnets/': {'p50': 10.0}}}, fd)
+
+        def write_seconds(report):
+            # Concurrent steps may list a collection more than once.
+            return report['estimate']['seconds'] - \
+                report['estimate']['reads'] * maas.DEFAULT_LATENCY['GET']
+
+        with_stats = maas.plan_region(stats_file=stats_file)
+        maas._prefetched.clear()
+        without = maas.plan_region(stats_file=None)
+        self.assertAlmostEqual(
+            write_seconds(with_stats) - write_seconds(without),
+            10.0 - maas.DEFAULT_LATENCY['POST'], delta=0.1)
+
+    def test_read_only_client_refuses_writes(self):
+        with self.assertRaises(WriteBlocked):
+            self.client.read_only().post('api/2.0/fabrics/', None, name='x')
+        self.assertEqual(self.dispatcher.sent, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
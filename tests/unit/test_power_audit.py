@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of maasng.power_audit, the concurrent power state audit.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+from collections import Counter, defaultdict
+import io
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+import maas_inventory  # noqa: E402
+import maasng  # noqa: E402
+
+
+def machine(hostname, rack=None, power_type='ipmi'):
+    return {'hostname': hostname, 'system_id': 'id-' + hostname,
+            'status_name': 'Ready', 'power_type': power_type,
+            'boot_interface': {'vlan': {'primary_rack': rack}}}
+
+
+class Client(object):
+    '''
+    A region answering power queries with ``states`` by hostname, after
+    ``delay`` seconds; a state which is an exception is raised. The most
+    queries in flight per rack are kept in ``peak``.
+    '''
+
+    url = 'http://maas:5240/MAAS'
+
+    def __init__(self, machines, states, delay=0):
+        self.machines = machines
+        self.states = states
+        self.delay = delay
+        self.writes = Counter()
+        self.queries = []
+        self.peak = Counter()
+        self._in_flight = Counter()
+        self._lock = threading.Lock()
+
+    def get(self, path, op=None, **params):
+        if path == 'api/2.0/events/':
+            raise Exception('events not available')
+        if path == 'api/2.0/machines/':
+            return io.BytesIO(json.dumps(self.machines).encode('utf-8'))
+        hostname = path.split('/')[-2][len('id-'):]
+        rack = [m['boot_interface']['vlan']['primary_rack']
+                for m in self.machines if m['hostname'] == hostname][0]
+        with self._lock:
+            self.queries.append(hostname)
+            self._in_flight[rack] += 1
+            self.peak[rack] = max(self.peak[rack], self._in_flight[rack])
+        try:
+            time.sleep(self.delay)
+        finally:
+            with self._lock:
+                self._in_flight[rack] -= 1
+        state = self.states[hostname]
+        if isinstance(state, Exception):
+            raise state
+        return io.BytesIO(json.dumps({'state': state}).encode('utf-8'))
+
+
+class PowerAuditTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, 'power_states.json')
+        self.client = None
+        self.saved = maasng._create_maas_client
+        maasng._create_maas_client = lambda *args: self.client
+        maas_inventory.invalidate_inventory()
+
+    def tearDown(self):
+        maasng._create_maas_client = self.saved
+        maas_inventory.invalidate_inventory()
+        shutil.rmtree(self.workdir)
+
+    def test_queries_are_capped_per_rack(self):
+        machines = [machine('r1-{0}'.format(i), 'rack1') for i in range(6)]
+        machines += [machine('x-{0}'.format(i)) for i in range(4)]
+        self.client = Client(machines, defaultdict(lambda: 'on'),
+                             delay=0.05)
+        ret = maasng.power_audit(concurrency=10, rack_concurrency=2,
+                                 path=None)
+        self.assertEqual(ret['queried'], 10)
+        self.assertEqual(self.client.peak['rack1'], 2)
+        # Machines without a known rack do not wait on each other.
+        self.assertGreater(self.client.peak[None], 1)
+
+    def test_states_are_reused_within_their_ttl(self):
+        self.client = Client([machine('kvm01'), machine('kvm02')],
+                             {'kvm01': 'on', 'kvm02': 'off'})
+        maasng.power_audit(path=self.path)
+        ret = maasng.power_audit(path=self.path)
+        self.assertEqual(ret['queried'], 0)
+        self.assertTrue(ret['machines']['kvm01']['cached'])
+        self.assertEqual(ret['machines']['kvm02']['state'], 'off')
+        self.assertEqual(len(self.client.queries), 2)
+        ret = maasng.power_audit(hostnames='kvm01', refresh=True,
+                                 path=self.path)
+        self.assertEqual(ret['queried'], 1)
+        ret = maasng.power_audit(path=self.path, cache_ttl=0)
+        self.assertEqual(ret['queried'], 2)
+
+    def test_failures_are_reported_per_machine(self):
+        self.client = Client(
+            [machine('kvm01'), machine('kvm02'), machine('kvm03'),
+             machine('vm01', power_type='virsh')],
+            {'kvm01': 'on', 'kvm02': socket.timeout(),
+             'kvm03': Exception('BMC refused'), 'vm01': 'unknown'})
+        ret = maasng.power_audit(hostnames='kvm01,kvm02,kvm03,vm01,kvm09',
+                                 timeout=5, path=self.path)
+        self.assertEqual(ret['machines']['kvm02']['error'],
+                         'Timed out after 5s')
+        self.assertEqual(ret['machines']['kvm03']['error'], 'BMC refused')
+        self.assertEqual(ret['machines']['kvm09'],
+                         {'error': 'Machine not found'})
+        self.assertEqual(ret['summary'], {
+            'ipmi': {'on': 1, 'off': 0, 'unknown': 0, 'error': 2},
+            'virsh': {'on': 0, 'off': 0, 'unknown': 1, 'error': 0}})
+        # Failed queries are not cached.
+        with open(self.path) as fd:
+            self.assertEqual(sorted(json.load(fd)),
+                             ['id-kvm01', 'id-vm01'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of maas.Machine.process, the batched enlistment of machines.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+from collections import defaultdict
+from io import BytesIO
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+import maas  # noqa: E402
+
+
+def node(hostname, system_id, mac):
+    return {'hostname': hostname, 'system_id': system_id,
+            'interface_set': [{'id': 1, 'mac_address': mac}]}
+
+
+class Client(object):
+    '''
+    A region with ``machines`` and ``devices``, recording the writes; POSTs
+    for the hostnames in ``failing`` are refused.
+    '''
+
+    def __init__(self, machines=(), devices=()):
+        self.listings = {'api/2.0/machines/': list(machines),
+                         'api/2.0/devices/': list(devices)}
+        self.writes = defaultdict(int)
+        self.sent = []
+        self.failing = set()
+
+    def get(self, path, op=None, **params):
+        return BytesIO(json.dumps(self.listings[path]).encode('utf-8'))
+
+    def post(self, path, op, **data):
+        self.sent.append(('POST', data['hostname']))
+        if data['hostname'] in self.failing:
+            raise Exception('{0} refused'.format(data['hostname']))
+        return BytesIO(json.dumps(node(
+            data['hostname'], 'new-' + data['hostname'],
+            data['mac_addresses'])).encode('utf-8'))
+
+    def put(self, path, **data):
+        self.sent.append(('PUT', data['hostname']))
+        return BytesIO(json.dumps(node(
+            data['hostname'], data['system_id'],
+            data['mac_addresses'][0])).encode('utf-8'))
+
+    def delete(self, path):
+        self.sent.append(('DELETE', path))
+
+
+def pillar(mac):
+    return {'pxe_interface_mac': mac,
+            'power_parameters': {'power_type': 'ipmi',
+                                 'power_address': '10.0.0.1'}}
+
+
+class ProcessMachinesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.client = Client(
+            [node('kvm01', 'abc', '52:54:00:00:00:01'),
+             node('kvm02', 'def', '52:54:00:00:00:02')],
+            [node('switch01', 'xyz', '52:54:00:ff:00:01')])
+        self.machines = {
+            'kvm01': pillar('52:54:00:00:00:01'),
+            'kvm02': pillar('52:54:00:00:00:12'),
+            'kvm03': pillar('52:54:00:00:00:03'),
+        }
+        config = {
+            'maas': {'region': {'machines': self.machines}},
+            'maas:region:enlistment': {'concurrency': 2, 'batch_size': 2},
+        }
+        maas.__salt__ = {'config.get': lambda key, default=None: config[key]}
+        self.saved = maas.JOURNAL_DIR, maas._create_maas_client
+        maas.JOURNAL_DIR = self.workdir
+        maas._create_maas_client = lambda: self.client
+
+    def tearDown(self):
+        maas.JOURNAL_DIR, maas._create_maas_client = self.saved
+        del maas.__salt__
+        shutil.rmtree(self.workdir)
+
+    def test_machines_are_created_updated_or_replaced(self):
+        ret = maas.Machine().process()
+        self.assertEqual(ret['summary'], {'created': 1, 'updated': 1,
+                                          'replaced': 1, 'skipped': 0,
+                                          'failed': 0})
+        self.assertEqual(ret['success'], ['kvm03'])
+        self.assertEqual(ret['updated'], ['kvm01'])
+        self.assertEqual(ret['replaced'], ['kvm02'])
+        self.assertEqual(sorted(self.client.sent), [
+            ('DELETE', 'api/2.0/machines/def/'), ('POST', 'kvm02'),
+            ('POST', 'kvm03'), ('PUT', 'kvm01')])
+
+    def test_mac_of_another_node_fails_before_any_request(self):
+        self.machines['kvm03'] = pillar('52:54:00:FF:00:01')
+        with self.assertRaises(Exception) as raised:
+            maas.Machine().process()
+        ret = raised.exception.args[0]
+        self.assertIn('switch01', ret['errors']['kvm03'])
+        self.assertNotIn(('POST', 'kvm03'), self.client.sent)
+        self.assertEqual(ret['summary']['failed'], 1)
+
+    def test_next_run_skips_machines_done_by_a_failed_run(self):
+        self.client.failing.add('kvm03')
+        with self.assertRaises(Exception) as raised:
+            maas.Machine().process()
+        self.assertEqual(list(raised.exception.args[0]['errors']),
+                         ['kvm03'])
+        # kvm02 is now known under its new MAC address.
+        self.client.listings['api/2.0/machines/'] = [
+            node('kvm01', 'abc', '52:54:00:00:00:01'),
+            node('kvm02', 'new-kvm02', '52:54:00:00:00:12')]
+        self.client.failing.clear()
+        del self.client.sent[:]
+        ret = maas.Machine().process()
+        self.assertEqual(sorted(ret['skipped']), ['kvm01', 'kvm02'])
+        self.assertEqual(self.client.sent, [('POST', 'kvm03')])
+
+    def test_changed_pillar_is_enlisted_again(self):
+        self.client.failing.add('kvm03')
+        with self.assertRaises(Exception):
+            maas.Machine().process()
+        self.machines['kvm01']['power_parameters']['power_address'] = \
+            '10.0.0.2'
+        self.client.failing.clear()
+        del self.client.sent[:]
+        ret = maas.Machine().process()
+        self.assertIn('kvm01', ret['updated'])
+        self.assertNotIn('kvm01', ret['skipped'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of maas.Redeployer, the bounded redeploy of failed machines.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+from io import BytesIO
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+import maas  # noqa: E402
+
+
+class Client(object):
+    '''
+    Record the POSTs; the operations in ``failing`` raise.
+    '''
+
+    def __init__(self):
+        self.posts = []
+        self.failing = set()
+
+    def post(self, path, op, **data):
+        self.posts.append((path, op))
+        if op in self.failing:
+            raise Exception('{0} refused'.format(op))
+        return BytesIO(b'{}')
+
+
+class RedeployerTest(unittest.TestCase):
+
+    config = {'attempts': 2, 'backoff': 0}
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.client = Client()
+        self.saved = maas.JOURNAL_DIR, maas._create_maas_client
+        maas.JOURNAL_DIR = self.workdir
+        maas._create_maas_client = lambda: self.client
+
+    def tearDown(self):
+        maas.JOURNAL_DIR, maas._create_maas_client = self.saved
+        shutil.rmtree(self.workdir)
+
+    def redeployer(self):
+        return maas.Redeployer(self.config,
+                               {'kvm01': {'distro_series': 'xenial'}})
+
+    def test_failed_machine_is_released_then_deployed(self):
+        redeployer = self.redeployer()
+        self.assertTrue(redeployer.recover(
+            'kvm01', 'abc', 'Failed deployment', 0))
+        self.assertEqual(self.client.posts,
+                         [('api/2.0/machines/abc/', 'release')])
+        self.assertTrue(redeployer.recover('kvm01', 'abc', 'Releasing', 0))
+        self.assertTrue(redeployer.recover('kvm01', 'abc', 'Ready', 0))
+        self.assertEqual(self.client.posts[1:], [
+            ('api/2.0/machines/', 'allocate'),
+            ('api/2.0/machines/abc/', 'deploy')])
+        self.assertIn('deployed_at', redeployer.history('kvm01')[0])
+
+    def test_half_finished_release_is_resumed(self):
+        # A previous run released the machine and stopped before
+        # deploying it again.
+        journal = maas.CheckpointJournal(
+            os.path.join(self.workdir, 'redeploy_machines.journal'))
+        journal.record('kvm01', 'abc', [{
+            'attempt': 1, 'failed_status': 'failed deployment',
+            'released_at': int(time.time()) - 600}])
+        journal.flush()
+        redeployer = self.redeployer()
+        self.assertTrue(redeployer.recover('kvm01', 'abc', 'Ready', 600))
+        self.assertEqual(self.client.posts, [
+            ('api/2.0/machines/', 'allocate'),
+            ('api/2.0/machines/abc/', 'deploy')])
+        history = maas.CheckpointJournal(journal.path).step('kvm01', 'abc')
+        self.assertEqual(len(history), 1)
+        self.assertIn('deployed_at', history[0])
+
+    def test_attempts_are_bounded_across_runs(self):
+        redeployer = self.redeployer()
+        for _ in range(2):
+            redeployer.recover('kvm01', 'abc', 'Failed deployment', 0)
+            redeployer.recover('kvm01', 'abc', 'Ready', 0)
+        self.assertFalse(self.redeployer().recover(
+            'kvm01', 'abc', 'Failed deployment', 3600))
+        self.assertEqual(
+            [op for _, op in self.client.posts].count('release'), 2)
+
+    def test_deploy_error_releases_and_fails_the_machine(self):
+        self.client.failing.add('deploy')
+        redeployer = self.redeployer()
+        redeployer.recover('kvm01', 'abc', 'Failed deployment', 0)
+        self.assertFalse(redeployer.recover('kvm01', 'abc', 'Ready', 0))
+        self.assertTrue(redeployer.failed('kvm01'))
+        self.assertEqual(self.client.posts[-1],
+                         ('api/2.0/machines/abc/', 'release'))
+        self.assertEqual(redeployer.history('kvm01')[0]['error'],
+                         'deploy refused')
+
+    def test_done_forgets_the_machine(self):
+        redeployer = self.redeployer()
+        redeployer.recover('kvm01', 'abc', 'Failed deployment', 0)
+        redeployer.done('kvm01')
+        self.assertEqual(redeployer.history('kvm01'), [])
+        self.assertFalse(os.path.exists(redeployer.journal.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of the request limits of maas_client.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+from maas_client import RequestGovernor, TokenBucket  # noqa: E402
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_is_served_without_waiting(self):
+        bucket = TokenBucket(rate=1, burst=5)
+        started = time.time()
+        for _ in range(5):
+            bucket.acquire()
+        self.assertLess(time.time() - started, 0.1)
+
+    def test_waits_for_tokens_once_empty(self):
+        bucket = TokenBucket(rate=20, burst=1)
+        bucket.acquire()
+        started = time.time()
+        for _ in range(4):
+            bucket.acquire()
+        # Four more tokens at 20 per second take at least 0.2 seconds.
+        self.assertGreaterEqual(time.time() - started, 0.18)
+
+    def test_default_burst_is_the_rate(self):
+        self.assertEqual(TokenBucket(rate=10).capacity, 10)
+        self.assertEqual(TokenBucket(rate=0.5).capacity, 1)
+
+
+class RequestGovernorTest(unittest.TestCase):
+
+    def test_classify(self):
+        governor = RequestGovernor()
+        self.assertEqual(governor.classify('GET'), 'read')
+        self.assertEqual(governor.classify('POST', 'update'), 'write')
+        self.assertEqual(governor.classify('POST', 'deploy'), 'long')
+        self.assertEqual(governor.classify('GET', 'query_power_state'), 'bmc')
+        governor = RequestGovernor({'long': {'ops': ['release']}})
+        self.assertEqual(governor.classify('POST', 'release'), 'long')
+        self.assertEqual(governor.classify('POST', 'deploy'), 'write')
+
+    def test_limits_are_on_by_default(self):
+        governor = RequestGovernor()
+        self.assertEqual(
+            sorted(governor._buckets), ['bmc', 'long', 'read', 'write'])
+        self.assertEqual(
+            sorted(governor._slots), ['bmc', 'long', 'read', 'write'])
+
+    def test_false_class_disables_its_limits(self):
+        governor = RequestGovernor({'read': False, 'long': False})
+        self.assertEqual(sorted(governor._buckets), ['bmc', 'write'])
+        self.assertEqual(sorted(governor._slots), ['bmc', 'write'])
+        self.assertEqual(governor.long_ops,
+                         frozenset(RequestGovernor.LONG_OPS))
+
+    def test_false_key_disables_that_limit(self):
+        governor = RequestGovernor({'write': {'rate': 0},
+                                    'read': {'concurrency': 0}})
+        self.assertNotIn('write', governor._buckets)
+        self.assertIn('write', governor._slots)
+        self.assertIn('read', governor._buckets)
+        self.assertNotIn('read', governor._slots)
+
+    def test_concurrency_caps_requests_in_flight(self):
+        governor = RequestGovernor({'write': {'rate': 0, 'concurrency': 2}})
+        lock = threading.Lock()
+        state = {'active': 0, 'peak': 0}
+
+        def request():
+            with governor.slot('POST', 'update') as name:
+                self.assertEqual(name, 'write')
+                with lock:
+                    state['active'] += 1
+                    state['peak'] = max(state['peak'], state['active'])
+                time.sleep(0.05)
+                with lock:
+                    state['active'] -= 1
+
+        threads = [threading.Thread(target=request) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(state['peak'], 2)
+
+    def test_slot_is_released_on_error(self):
+        governor = RequestGovernor({'read': {'rate': 0, 'concurrency': 1}})
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                with governor.slot('GET'):
+                    raise ValueError()
+        with governor.slot('GET'):
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()
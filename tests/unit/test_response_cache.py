@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of maas_client.ResponseCache: ETag revalidation, TTL and
+invalidation on writes.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+from io import BytesIO
+import httplib
+import os
+import sys
+import unittest
+import urllib2
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+from maas_client import MAASClient, MAASOAuth, ResponseCache  # noqa: E402
+
+MAAS_URL = 'http://maas:5240/MAAS'
+
+
+class Dispatcher(object):
+    '''
+    Serve ``bodies`` by path with an ETag derived from the body, answering
+    304 to a request carrying the current one.
+    '''
+
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.sent = []
+
+    def dispatch_query(self, request_url, headers, method='GET', data=None):
+        path = request_url[len(MAAS_URL):].split('?')[0]
+        self.sent.append((method, path, headers.get('If-None-Match')))
+        info = httplib.HTTPMessage(BytesIO(b'\r\n'))
+        if method != 'GET':
+            return urllib2.addinfourl(BytesIO(b'{}'), info, request_url, 200)
+        body = self.bodies[path]
+        etag = '"{0}"'.format(len(body))
+        if headers.get('If-None-Match') == etag:
+            raise urllib2.HTTPError(request_url, 304, 'Not Modified', info,
+                                    BytesIO(b''))
+        info['ETag'] = etag
+        return urllib2.addinfourl(BytesIO(body), info, request_url, 200)
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = Dispatcher({
+            '/api/2.0/machines/': b'[{"hostname": "kvm01"}]',
+            '/api/2.0/fabrics/': b'[{"name": "fabric-0"}]',
+        })
+        self.cache = ResponseCache()
+        self.client = MAASClient(MAASOAuth('consumer', 'token', 'secret'),
+                                 self.dispatcher, MAAS_URL, cache=self.cache)
+
+    def test_unchanged_resource_is_revalidated(self):
+        self.client.get('api/2.0/machines/').read()
+        body = self.client.get('api/2.0/machines/').read()
+        self.assertEqual(body, b'[{"hostname": "kvm01"}]')
+        self.assertEqual(self.dispatcher.sent, [
+            ('GET', '/api/2.0/machines/', None),
+            ('GET', '/api/2.0/machines/', '"23"')])
+
+    def test_changed_resource_is_fetched_again(self):
+        self.client.get('api/2.0/machines/').read()
+        self.dispatcher.bodies['/api/2.0/machines/'] = b'[]'
+        self.assertEqual(self.client.get('api/2.0/machines/').read(), b'[]')
+        self.assertEqual(self.cache.lookup('/api/2.0/machines/')['etag'],
+                         '"2"')
+
+    def test_collection_within_its_ttl_is_served_locally(self):
+        self.client.get('api/2.0/fabrics/').read()
+        self.client.get('api/2.0/fabrics/').read()
+        self.assertEqual(len(self.dispatcher.sent), 1)
+        self.cache.lookup('/api/2.0/fabrics/')['stored_at'] -= \
+            ResponseCache.DEFAULT_TTL['fabrics']
+        self.client.get('api/2.0/fabrics/').read()
+        self.assertEqual(self.dispatcher.sent[1:], [
+            ('GET', '/api/2.0/fabrics/', '"22"')])
+
+    def test_named_operations_are_always_revalidated(self):
+        self.dispatcher.bodies['/api/2.0/fabrics/'] = b'[]'
+        self.client.get('api/2.0/fabrics/', 'list_stuff').read()
+        self.client.get('api/2.0/fabrics/', 'list_stuff').read()
+        self.assertEqual(len(self.dispatcher.sent), 2)
+
+    def test_writes_drop_related_collections(self):
+        self.client.get('api/2.0/fabrics/').read()
+        self.client.get('api/2.0/machines/').read()
+        self.client.post('api/2.0/subnets/', None, cidr='10.0.0.0/24')
+        self.assertIsNone(self.cache.lookup('/api/2.0/fabrics/'))
+        self.assertIsNotNone(self.cache.lookup('/api/2.0/machines/'))
+        self.client.get('api/2.0/fabrics/').read()
+        self.assertEqual(self.dispatcher.sent[-1],
+                         ('GET', '/api/2.0/fabrics/', None))
+        self.assertEqual(self.client.writes['subnets'], 1)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = ResponseCache({'size': 1})
+        client = MAASClient(MAASOAuth('consumer', 'token', 'secret'),
+                            self.dispatcher, MAAS_URL, cache=cache)
+        client.get('api/2.0/machines/').read()
+        client.get('api/2.0/fabrics/').read()
+        self.assertIsNone(cache.lookup('/api/2.0/machines/'))
+        self.assertIsNotNone(cache.lookup('/api/2.0/fabrics/'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of maas.sync_region: the order of its steps and the objects
+they send, which must match those of the maasng states.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+from collections import defaultdict
+from io import BytesIO
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+import maas  # noqa: E402
+
+
+class Client(object):
+    '''
+    Serve the listings in ``listings`` and record the writes.
+    '''
+
+    def __init__(self, listings):
+        self.listings = listings
+        self.writes = defaultdict(int)
+        self.sent = []
+
+    def get(self, path, op=None, **params):
+        return BytesIO(json.dumps(self.listings[path]).encode('utf-8'))
+
+    def post(self, path, op, **data):
+        self.sent.append(('POST', path, data))
+        return BytesIO(b'{"id": 7}')
+
+    def put(self, path, **data):
+        self.sent.append(('PUT', path, data))
+        return BytesIO(b'{"id": 7}')
+
+
+class SyncRegionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.region = {}
+        self.client = Client({
+            'api/2.0/fabrics/': [{'id': 3, 'name': 'fabric-0', 'vlans': [
+                {'id': 5001, 'vid': 0, 'name': 'untagged'}]}],
+            'api/2.0/rackcontrollers/': [
+                {'system_id': 'r4ck', 'hostname': 'rack01'}],
+            'api/2.0/subnets/': [
+                {'id': 7, 'name': 'old-name', 'cidr': '10.0.0.0/24',
+                 'vlan': {'fabric': 'fabric-0'}}],
+        })
+        maas.__salt__ = {
+            'config.get': lambda key, default=None: {'region': self.region}}
+        self.saved = maas._create_maas_client, maas._run_step
+        maas._create_maas_client = lambda: self.client
+        maas._prefetched.clear()
+
+    def tearDown(self):
+        maas._create_maas_client, maas._run_step = self.saved
+        maas._prefetched.clear()
+        del maas.__salt__
+
+    def test_steps_depending_on_a_failed_one_are_skipped(self):
+        self.region = {'fabrics': {}, 'subnets': {}, 'dhcp_snippets': {},
+                       'maas_config': {}, 'devices': {}}
+        for key in self.region:
+            self.region[key] = {'x': {}}
+        run = []
+
+        def run_step(step):
+            run.append(step[0])
+            errors = {'x': 'refused'} if step[0] == 'subnets' else {}
+            return {'success': [], 'updated': [], 'errors': errors}
+
+        maas._run_step = run_step
+        with self.assertRaises(Exception) as raised:
+            maas.sync_region()
+        summary = raised.exception.args[0]['summary']
+        self.assertEqual(summary, {
+            'maas_config': 'ok', 'fabrics': 'ok', 'vlans': 'ok',
+            'subnets': 'failed', 'ipranges': 'skipped',
+            'vlans_dhcp': 'skipped', 'dhcp_snippets': 'skipped',
+            'devices': 'skipped'})
+        self.assertLess(run.index('vlans'), run.index('subnets'))
+        self.assertNotIn('ipranges', run)
+
+    def test_subnets_are_named_and_matched_like_subnet_present(self):
+        self.region = {'subnets': {
+            'pxe': {'cidr': '10.0.0.0/24', 'fabric': 'fabric-0',
+                    'gateway_ip': '10.0.0.1'},
+            'deploy': {'cidr': '10.0.1.0/24', 'fabric': 'fabric-0',
+                       'name': 'deploy-net', 'gateway_ip': '10.0.1.1'},
+        }}
+        ret = maas.SubnetByCidr().process()
+        self.assertEqual(ret['updated'], ['10.0.0.0/24'])
+        self.assertEqual(ret['success'], ['10.0.1.0/24'])
+        sent = dict((path, (method, data))
+                    for method, path, data in self.client.sent)
+        self.assertEqual(sent['api/2.0/subnets/7/'][0], 'PUT')
+        self.assertEqual(sent['api/2.0/subnets/7/'][1]['name'], '')
+        self.assertEqual(sent['api/2.0/subnets/'][1]['name'], 'deploy-net')
+        self.assertEqual(sent['api/2.0/subnets/'][1]['fabric'], '3')
+
+    def test_primary_rack_is_optional(self):
+        self.region = {'fabrics': {'fabric-0': {'vlans': {
+            0: {'description': 'pxe', 'dhcp': True},
+            1: {'description': 'dhcp relay', 'dhcp': True,
+                'primary_rack': 'rack01'},
+        }}}}
+        ret = maas.VlanDHCP().process()
+        self.assertEqual(ret['errors'], {})
+        data = dict((path, data) for _, path, data in self.client.sent)
+        untagged = data['api/2.0/fabrics/3/vlans/0/']
+        self.assertEqual(untagged['dhcp_on'], 'True')
+        self.assertNotIn('primary_rack', untagged)
+        self.assertEqual(data['api/2.0/fabrics/3/vlans/']['primary_rack'],
+                         'r4ck')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+'''
+Unit checks of maas.wait_for_machine_status outcomes.
+
+Usage (python 2.7, from the repository root)::
+
+    python -m unittest discover -s tests/unit
+'''
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    '_modules'))
+
+import maas  # noqa: E402
+
+
+class WaitForMachineStatusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.region = {'machines': {'m1': {}, 'm2': {}}}
+        self.polls = []
+        maas.__salt__ = {
+            'config.get': lambda key, default=None: self.region}
+        self.execute = maas.MachinesStatus.execute
+        self.sleep = maas.time.sleep
+        maas.MachinesStatus.execute = classmethod(
+            lambda cls, objects_name=None, refresh=False: {
+                'machines': self.polls.pop(0) if len(self.polls) > 1
+                else self.polls[0]})
+        maas.time.sleep = lambda seconds: None
+
+    def tearDown(self):
+        maas.MachinesStatus.execute = self.execute
+        maas.time.sleep = self.sleep
+        del maas.__salt__
+
+    def machine(self, hostname, status):
+        return {'hostname': hostname, 'system_id': 's-' + hostname,
+                'status': status}
+
+    def test_machine_never_listed_times_out(self):
+        self.polls = [[self.machine('m1', 'Deployed')]]
+        with self.assertRaises(Exception) as raised:
+            maas.wait_for_machine_status(req_status='Deployed', timeout=0)
+        ret = raised.exception.args[0]
+        self.assertEqual(ret['summary'], {'reached': 1, 'pending': 1})
+        self.assertEqual(ret['machines']['m2'],
+                         {'outcome': 'pending', 'status': None,
+                          'in_status': 0})
+
+    def test_machines_reaching_the_status(self):
+        self.polls = [[self.machine('m1', 'Deploying')],
+                      [self.machine('m1', 'Deployed'),
+                       self.machine('m2', 'Deployed')]]
+        ret = maas.wait_for_machine_status(req_status='Deployed',
+                                           timeout=60, poll_time=0)
+        self.assertEqual(ret['summary'], {'reached': 2})
+
+    def test_terminal_status_fails_at_once(self):
+        self.polls = [[self.machine('m1', 'Failed deployment'),
+                       self.machine('m2', 'Deploying')]]
+        with self.assertRaises(Exception) as raised:
+            maas.wait_for_machine_status(req_status='Deployed',
+                                         timeout=3600)
+        ret = raised.exception.args[0]
+        self.assertEqual(ret['machines']['m1']['outcome'], 'failed')
+        self.assertEqual(ret['machines']['m2']['outcome'], 'pending')
+
+    def test_no_machine_to_wait_for(self):
+        self.region = {}
+        ret = maas.wait_for_machine_status(req_status='Ready')
+        self.assertEqual(ret, {'machines': {}, 'summary': {},
+                               'req_status': 'Ready', 'elapsed': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()